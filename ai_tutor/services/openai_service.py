@@ -1,7 +1,8 @@
+import asyncio
 import os
 import re
 from django.conf import settings
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic
 
 # Configure API key
 API_KEY = os.getenv('ANTHROPIC_API_KEY') or getattr(settings, 'ANTHROPIC_API_KEY', None)
@@ -199,6 +200,57 @@ def get_ai_response(
         'intent': str
     }
     """
+    prepared = _prepare_request(message, exercise, user_query, error, user_id, submissions, problem_database_name)
+    if isinstance(prepared, dict):
+        return prepared
+    system_prompt, user_prompt = prepared
+    
+    try:
+        # Create Anthropic client
+        client = Anthropic(api_key=API_KEY)
+        
+        response = client.messages.create(**_message_params(system_prompt, user_prompt))
+        return _parse_response(response, user_id)
+        
+    except Exception as e:
+        return _error_response(e)
+
+
+async def get_ai_response_async(
+    message: str, 
+    exercise=None, 
+    user_query: str = None, 
+    error: str = None,
+    user_role: str = 'student',
+    user_id: int = None,
+    submissions: list = None,
+    problem_database_name: str = None
+) -> dict:
+    """get_ai_response() with the async Anthropic client (ASGI views); same return dict"""
+    prepared = _prepare_request(message, exercise, user_query, error, user_id, submissions, problem_database_name)
+    if isinstance(prepared, dict):
+        return prepared
+    system_prompt, user_prompt = prepared
+    
+    try:
+        # One client (and its HTTP connection pool) per event loop
+        loop_id = id(asyncio.get_running_loop())
+        client = _async_clients.get(loop_id)
+        if client is None:
+            client = _async_clients[loop_id] = AsyncAnthropic(api_key=API_KEY)
+        
+        response = await client.messages.create(**_message_params(system_prompt, user_prompt))
+        return _parse_response(response, user_id)
+        
+    except Exception as e:
+        return _error_response(e)
+
+
+_async_clients = {}
+
+
+def _prepare_request(message, exercise, user_query, error, user_id, submissions, problem_database_name):
+    """(system_prompt, user_prompt), or the response dict when no API call is made"""
     mode = getattr(settings, 'ANTHROPIC_MODE', 'mock')
     
     # Mock mode
@@ -239,53 +291,56 @@ def get_ai_response(
     if submissions and len(submissions) > 0:
         user_prompt += f"\n\nUser has {len(submissions)} previous submission(s) for this problem."
     
-    try:
-        # Create Anthropic client
-        client = Anthropic(api_key=API_KEY)
-        
-        response = client.messages.create(
-            model='claude-3-haiku-20240307',
-            max_tokens=300, 
-            temperature=0.3,
-            system=system_prompt,
-            messages=[
-                {"role": "user", "content": user_prompt}
-            ]
-        )
-        
-        # Extract response
-        if not response.content:
-            return {
-                'response': "AI returned no content.",
-                'sql_query': None,
-                'should_execute': False,
-                'intent': 'error'
-            }
-        
-        # Anthropic returns content as a list of text blocks
-        response_text = response.content[0].text.strip()
-        
-        # Parse response for SQL and intent
-        sql_query, intent = _extract_sql_from_response(response_text)
-        
-        # Replace user_id placeholder if present
-        if sql_query and '{user_id}' in sql_query:
-            sql_query = sql_query.replace('{user_id}', str(user_id))
-        
-        # Auto-execute data queries
-        should_execute = (intent == 'data_query' and sql_query is not None)
-        
-        return {
-            'response': response_text,
-            'sql_query': sql_query,
-            'should_execute': should_execute,
-            'intent': intent
-        }
-        
-    except Exception as e:
+    return system_prompt, user_prompt
+
+
+def _message_params(system_prompt: str, user_prompt: str) -> dict:
+    return {
+        'model': 'claude-3-haiku-20240307',
+        'max_tokens': 300,
+        'temperature': 0.3,
+        'system': system_prompt,
+        'messages': [
+            {"role": "user", "content": user_prompt}
+        ]
+    }
+
+
+def _parse_response(response, user_id) -> dict:
+    # Extract response
+    if not response.content:
         return {
-            'response': f"AI tutor encountered an error: {str(e)}. Please try rephrasing your question.",
+            'response': "AI returned no content.",
             'sql_query': None,
             'should_execute': False,
             'intent': 'error'
-        }
\ No newline at end of file
+        }
+    
+    # Anthropic returns content as a list of text blocks
+    response_text = response.content[0].text.strip()
+    
+    # Parse response for SQL and intent
+    sql_query, intent = _extract_sql_from_response(response_text)
+    
+    # Replace user_id placeholder if present
+    if sql_query and '{user_id}' in sql_query:
+        sql_query = sql_query.replace('{user_id}', str(user_id))
+    
+    # Auto-execute data queries
+    should_execute = (intent == 'data_query' and sql_query is not None)
+    
+    return {
+        'response': response_text,
+        'sql_query': sql_query,
+        'should_execute': should_execute,
+        'intent': intent
+    }
+
+
+def _error_response(e: Exception) -> dict:
+    return {
+        'response': f"AI tutor encountered an error: {str(e)}. Please try rephrasing your question.",
+        'sql_query': None,
+        'should_execute': False,
+        'intent': 'error'
+    }
@@ -4,137 +4,96 @@ from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
+from django.views import View
+from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from rest_framework.utils.encoders import JSONEncoder
 from django.shortcuts import get_object_or_404
-from django.db import connection
 from exercises.models import Exercise, ChatHistory
 from exercises.views import get_problem_from_gcp
+from exercises.services.admission import admission, request_user_key
+from chatsql.routers import system_cursor, system_db_alias
+from exercises.services.backends import DjangoDBBackend
+from exercises.services.catalog import problem_catalog
+from exercises.services.async_executor import execute_async
 from exercises.services.executor import SQLExecutor
-from ai_tutor.services.openai_service import get_ai_response
+from ai_tutor.services.openai_service import get_ai_response, get_ai_response_async
+import json
 
-@method_decorator(csrf_exempt, name='dispatch')
-class ExerciseAIView(APIView):
-    """POST /api/exercises/{id}/ai/ - Get AI help for students"""
-    # permission_classes = [IsAuthenticated]
+class ProblemExercise:
+    """类似Exercise的对象，用来传递problems表中的problem信息"""
+    def __init__(self, problem_data):
+        self.id = problem_data['id']
+        self.title = problem_data['title']
+        self.description = problem_data.get('description', '')
+        self.difficulty = problem_data.get('difficulty', 'easy')
+        self.expected_query = problem_data.get('expected_query', '')
+        self.database_name = problem_data.get('database_name', '')  # 添加database_name属性
 
-    def post(self, request, exercise_id):
-        # 从GCP获取problem信息（优先），如果不存在则尝试从Django模型获取
-        problem = get_problem_from_gcp(problem_id=exercise_id)
-        problem_database_name = None  # 存储problem的数据库名
-        
-        if problem:
-            # 创建一个类似Exercise的对象来传递problem信息
-            class ProblemExercise:
-                def __init__(self, problem_data):
-                    self.id = problem_data['id']
-                    self.title = problem_data['title']
-                    self.description = problem_data.get('description', '')
-                    self.difficulty = problem_data.get('difficulty', 'easy')
-                    self.expected_query = problem_data.get('expected_query', '')
-                    self.database_name = problem_data.get('database_name', '')  # 添加database_name属性
-            
-            exercise = ProblemExercise(problem)
-            problem_database_name = problem.get('database_name')
-        else:
-            # Fallback: 尝试从Django模型获取
-            try:
-                exercise = get_object_or_404(Exercise, id=exercise_id)
-                # 从schema获取database_name
-                if hasattr(exercise, 'schema') and exercise.schema:
-                    problem_database_name = exercise.schema.db_name
-            except:
-                return Response(
-                    {'error': 'Exercise not found'}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
-        
-        message = request.data.get('message', '')
-        user_query = request.data.get('user_query')
-        error = request.data.get('error')
-        submissions = request.data.get('submissions', [])  # 接收前端传递的submissions
 
-        if not message and not user_query and not error:
-            return Response(
-                {'error': 'message or user_query or error is required'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+def resolve_exercise(exercise_id):
+    """
+    (exercise, problem_database_name), or None if the exercise doesn't exist.
+    从GCP获取problem信息（优先），如果不存在则尝试从Django模型获取
+    """
+    problem = get_problem_from_gcp(problem_id=exercise_id)
+    if problem:
+        return ProblemExercise(problem), problem.get('database_name')
+    
+    # Fallback: 尝试从Django模型获取
+    try:
+        exercise = get_object_or_404(Exercise, id=exercise_id)
+    except:
+        return None
+    problem_database_name = None
+    # 从schema获取database_name
+    if hasattr(exercise, 'schema') and exercise.schema:
+        problem_database_name = exercise.schema.db_name
+    return exercise, problem_database_name
 
-        # 临时修复：使用假 user_id 或从 session 获取
-        user_id = request.user.id if request.user.is_authenticated else 1
-        # 从session获取user_id（如果存在）
-        session_user_id = request.session.get('user_id')
-        if session_user_id:
-            user_id = session_user_id
 
-        # Ensure session
-        session_id = request.session.session_key
-        if not session_id:
-            request.session.create()
-            session_id = request.session.session_key
+def request_user_and_session(request):
+    """(user_id, session_id); creates the session if needed"""
+    # 临时修复：使用假 user_id 或从 session 获取
+    user_id = request.user.id if request.user.is_authenticated else 1
+    # 从session获取user_id（如果存在）
+    session_user_id = request.session.get('user_id')
+    if session_user_id:
+        user_id = session_user_id
 
-        # Get AI response (returns dict with sql_query, should_execute, etc.)
-        ai_result = get_ai_response(
-            message=message or user_query or 'Help me',
-            exercise=exercise,
-            user_query=user_query,
-            error=error,
-            user_role='student',  # Hard-coded for now, will use request.user.role later
-            user_id=user_id,
-            submissions=submissions,  # 传递submissions数据
-            problem_database_name=problem_database_name  # 传递problem数据库名
-        )
+    # Ensure session
+    session_id = request.session.session_key
+    if not session_id:
+        request.session.create()
+        session_id = request.session.session_key
+    return user_id, session_id
 
-        response_data = {
-            'response': ai_result['response'],
-            'intent': ai_result['intent']
-        }
 
-        # If AI generated SQL and wants to execute it
-        if ai_result['should_execute'] and ai_result['sql_query']:
-            try:
-                # Execute the AI-generated SQL in the correct database
-                execution_result = self._execute_sql(ai_result['sql_query'], problem_database_name, exercise_id)
-                
-                response_data['sql_query'] = ai_result['sql_query']
-                response_data['query_result'] = execution_result
-                response_data['executed'] = True
-                
-                # Append result to response text
-                result_summary = self._format_result_summary(execution_result)
-                response_data['response'] = f"{ai_result['response']}\n\n{result_summary}"
-                
-            except Exception as e:
-                response_data['sql_query'] = ai_result['sql_query']
-                response_data['execution_error'] = str(e)
-                response_data['executed'] = False
-                response_data['response'] = f"{ai_result['response']}\n\n⚠️ Failed to execute query: {str(e)}"
-        
-        elif ai_result['sql_query'] and not ai_result['should_execute']:
-            # SQL generated but not auto-executed (e.g., for teaching purposes)
-            response_data['sql_query'] = ai_result['sql_query']
-            response_data['executed'] = False
+def save_chat_history(exercise, session_id, message, user_query, error, ai_result, response_data):
+    # Persist ChatHistory (只有当exercise是Django模型实例时才保存)
+    try:
+        if isinstance(exercise, Exercise):
+            ChatHistory.objects.create(
+                session_id=session_id,
+                exercise=exercise,
+                message=message or user_query or '',
+                response=response_data['response'],
+                context={
+                    'user_query': user_query,
+                    'error': error,
+                    'ai_generated_sql': ai_result.get('sql_query'),
+                    'intent': ai_result['intent']
+                }
+            )
+    except Exception as e:
+        # 如果保存失败（例如exercise不是Django模型），记录但不影响响应
+        import logging
+        logger = logging.getLogger(__name__)
+        logger.warning(f"Failed to save chat history: {e}")
 
-        # Persist ChatHistory (只有当exercise是Django模型实例时才保存)
-        try:
-            if isinstance(exercise, Exercise):
-                ChatHistory.objects.create(
-                    session_id=session_id,
-                    exercise=exercise,
-                    message=message or user_query or '',
-                    response=response_data['response'],
-                    context={
-                        'user_query': user_query,
-                        'error': error,
-                        'ai_generated_sql': ai_result.get('sql_query'),
-                        'intent': ai_result['intent']
-                    }
-                )
-        except Exception as e:
-            # 如果保存失败（例如exercise不是Django模型），记录但不影响响应
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"Failed to save chat history: {e}")
 
-        return Response(response_data)
+class ExerciseAIMixin:
+    """SQL execution and result formatting shared by the sync and async AI views"""
 
     def _execute_sql(self, sql_query: str, problem_database_name: str = None, exercise_id: int = None) -> dict:
         """
@@ -148,30 +107,31 @@ class ExerciseAIView(APIView):
         # 判断SQL查询是针对哪个数据库的
         query_upper = sql_query.strip().upper()
         
-        # 如果查询的是submissions表，使用chatsql_system数据库
-        if 'submissions' in query_upper or 'exercises' in query_upper or 'problems' in query_upper:
+        if self._is_system_query(sql_query):
             # 查询系统表，使用chatsql_system数据库
-            with connection.cursor() as cursor:
-                cursor.execute('USE chatsql_system')
+            if query_upper.startswith('SELECT'):
+                # Same row cap / time limit / result format as the problem databases
+                result = DjangoDBBackend(system_db_alias()).execute(
+                    sql_query, SQLExecutor.MAX_ROWS, SQLExecutor.MAX_EXECUTION_TIME
+                )
+                if not result['success']:
+                    raise Exception(result['error'])
+                return {
+                    'success': True,
+                    'columns': result['columns'],
+                    'rows': result['rows'],
+                    'row_count': result['row_count']
+                }
+            
+            with system_cursor() as cursor:
                 cursor.execute(sql_query)
-                
-                # Check if it's a SELECT query
-                if query_upper.startswith('SELECT'):
-                    columns = [col[0] for col in cursor.description] if cursor.description else []
-                    rows = cursor.fetchall()
-                    return {
-                        'success': True,
-                        'columns': columns,
-                        'rows': [list(row) for row in rows],
-                        'row_count': len(rows)
-                    }
-                else:
-                    # UPDATE/INSERT/DELETE
-                    return {
-                        'success': True,
-                        'affected_rows': cursor.rowcount,
-                        'message': f'{cursor.rowcount} row(s) affected'
-                    }
+                # UPDATE/INSERT/DELETE：系统表可能被修改，下次查询时重新加载题目目录
+                problem_catalog.invalidate()
+                return {
+                    'success': True,
+                    'affected_rows': cursor.rowcount,
+                    'message': f'{cursor.rowcount} row(s) affected'
+                }
         else:
             # 查询problem相关的表，使用对应的problem数据库
             if not problem_database_name:
@@ -193,23 +153,7 @@ class ExerciseAIView(APIView):
             # 使用SQLExecutor执行查询（它会连接到正确的problem数据库）
             try:
                 executor = SQLExecutor(problem_database_name)
-                result = executor.execute(sql_query)
-                
-                if result['success']:
-                    return {
-                        'success': True,
-                        'columns': result['columns'],
-                        'rows': result['rows'],
-                        'row_count': result['row_count']
-                    }
-                else:
-                    return {
-                        'success': False,
-                        'error': result.get('error', 'Query execution failed'),
-                        'columns': [],
-                        'rows': [],
-                        'row_count': 0
-                    }
+                return self._shape_result(executor.execute(sql_query))
             except Exception as e:
                 return {
                     'success': False,
@@ -219,7 +163,43 @@ class ExerciseAIView(APIView):
                     'row_count': 0
                 }
 
-    def _format_result_summary(self, result: dict) -> str:
+    @staticmethod
+    def _attach_execution(response_data: dict, ai_result: dict, execution_result: dict):
+        response_data['sql_query'] = ai_result['sql_query']
+        response_data['query_result'] = execution_result
+        response_data['executed'] = True
+        
+        # Append result to response text
+        result_summary = ExerciseAIMixin._format_result_summary(execution_result)
+        response_data['response'] = f"{ai_result['response']}\n\n{result_summary}"
+
+    @staticmethod
+    def _attach_execution_error(response_data: dict, ai_result: dict, e: Exception):
+        response_data['sql_query'] = ai_result['sql_query']
+        response_data['execution_error'] = str(e)
+        response_data['executed'] = False
+        response_data['response'] = f"{ai_result['response']}\n\n⚠️ Failed to execute query: {str(e)}"
+
+    @staticmethod
+    def _shape_result(result) -> dict:
+        """Executor result -> the query_result returned to the frontend"""
+        if result['success']:
+            return {
+                'success': True,
+                'columns': result['columns'],
+                'rows': result['rows'],
+                'row_count': result['row_count']
+            }
+        return {
+            'success': False,
+            'error': result.get('error', 'Query execution failed'),
+            'columns': [],
+            'rows': [],
+            'row_count': 0
+        }
+
+    @staticmethod
+    def _format_result_summary(result: dict) -> str:
         """Format query result into readable text."""
         if not result['success']:
             return "❌ Query execution failed"
@@ -235,4 +215,162 @@ class ExerciseAIView(APIView):
                 return f"📊 Query returned {count} results"
         else:
             # UPDATE/INSERT/DELETE result
-            return f"✅ {result['message']}"
\ No newline at end of file
+            return f"✅ {result['message']}"
+
+    @staticmethod
+    def _is_system_query(sql_query: str) -> bool:
+        # 如果查询的是submissions表，使用chatsql_system数据库
+        query_upper = sql_query.strip().upper()
+        return 'submissions' in query_upper or 'exercises' in query_upper or 'problems' in query_upper
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ExerciseAIView(ExerciseAIMixin, APIView):
+    """POST /api/exercises/{id}/ai/ - Get AI help for students"""
+    # permission_classes = [IsAuthenticated]
+
+    def post(self, request, exercise_id):
+        resolved = resolve_exercise(exercise_id)
+        if resolved is None:
+            return Response(
+                {'error': 'Exercise not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        exercise, problem_database_name = resolved
+        
+        message = request.data.get('message', '')
+        user_query = request.data.get('user_query')
+        error = request.data.get('error')
+        submissions = request.data.get('submissions', [])  # 接收前端传递的submissions
+
+        if not message and not user_query and not error:
+            return Response(
+                {'error': 'message or user_query or error is required'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        user_id, session_id = request_user_and_session(request)
+
+        # Get AI response (returns dict with sql_query, should_execute, etc.)
+        ai_result = get_ai_response(
+            message=message or user_query or 'Help me',
+            exercise=exercise,
+            user_query=user_query,
+            error=error,
+            user_role='student',  # Hard-coded for now, will use request.user.role later
+            user_id=user_id,
+            submissions=submissions,  # 传递submissions数据
+            problem_database_name=problem_database_name  # 传递problem数据库名
+        )
+
+        response_data = {
+            'response': ai_result['response'],
+            'intent': ai_result['intent']
+        }
+
+        # If AI generated SQL and wants to execute it
+        if ai_result['should_execute'] and ai_result['sql_query']:
+            try:
+                # Execute the AI-generated SQL in the correct database, admitted like /execute
+                # (a rejection is reported as an execution error)
+                with admission.admit(request_user_key(request), exercise_id):
+                    execution_result = self._execute_sql(ai_result['sql_query'], problem_database_name, exercise_id)
+                self._attach_execution(response_data, ai_result, execution_result)
+            except Exception as e:
+                self._attach_execution_error(response_data, ai_result, e)
+        
+        elif ai_result['sql_query'] and not ai_result['should_execute']:
+            # SQL generated but not auto-executed (e.g., for teaching purposes)
+            response_data['sql_query'] = ai_result['sql_query']
+            response_data['executed'] = False
+
+        save_chat_history(exercise, session_id, message, user_query, error, ai_result, response_data)
+
+        return Response(response_data)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncExerciseAIView(ExerciseAIMixin, View):
+    """
+    POST /api/exercises/{id}/ai/ - ExerciseAIView for ASGI (settings.ASYNC_VIEWS)
+    The Anthropic call and problem-database queries are awaited instead of
+    blocking a worker thread; ORM/session work runs via sync_to_async.
+    """
+
+    async def post(self, request, exercise_id):
+        resolved = await sync_to_async(resolve_exercise)(exercise_id)
+        if resolved is None:
+            return JsonResponse({'error': 'Exercise not found'}, status=status.HTTP_404_NOT_FOUND)
+        exercise, problem_database_name = resolved
+
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Invalid JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+
+        message = data.get('message', '')
+        user_query = data.get('user_query')
+        error = data.get('error')
+        submissions = data.get('submissions', [])  # 接收前端传递的submissions
+
+        if not message and not user_query and not error:
+            return JsonResponse(
+                {'error': 'message or user_query or error is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        user_id, session_id = await sync_to_async(request_user_and_session)(request)
+
+        ai_result = await get_ai_response_async(
+            message=message or user_query or 'Help me',
+            exercise=exercise,
+            user_query=user_query,
+            error=error,
+            user_role='student',
+            user_id=user_id,
+            submissions=submissions,
+            problem_database_name=problem_database_name
+        )
+
+        response_data = {
+            'response': ai_result['response'],
+            'intent': ai_result['intent']
+        }
+
+        if ai_result['should_execute'] and ai_result['sql_query']:
+            try:
+                user_key = await sync_to_async(request_user_key)(request)
+                ticket = await admission.acquire_async(user_key, exercise_id)
+                try:
+                    execution_result = await self._execute_sql_async(ai_result['sql_query'], problem_database_name, exercise_id)
+                finally:
+                    admission.release(ticket)
+                self._attach_execution(response_data, ai_result, execution_result)
+            except Exception as e:
+                self._attach_execution_error(response_data, ai_result, e)
+
+        elif ai_result['sql_query'] and not ai_result['should_execute']:
+            response_data['sql_query'] = ai_result['sql_query']
+            response_data['executed'] = False
+
+        await sync_to_async(save_chat_history)(exercise, session_id, message, user_query, error, ai_result, response_data)
+
+        return JsonResponse(response_data, encoder=JSONEncoder)
+
+    async def _execute_sql_async(self, sql_query: str, problem_database_name: str = None, exercise_id: int = None) -> dict:
+        if self._is_system_query(sql_query) or not problem_database_name:
+            # System tables / database lookup: sync Django connection in a thread
+            return await sync_to_async(self._execute_sql)(sql_query, problem_database_name, exercise_id)
+        try:
+            executor = await sync_to_async(SQLExecutor)(problem_database_name)
+            return self._shape_result(await execute_async(executor, sql_query))
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'columns': [],
+                'rows': [],
+                'row_count': 0
+            }
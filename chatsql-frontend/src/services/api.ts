@@ -121,8 +121,13 @@ export const getSchemas = async (useMock = false): Promise<DatabaseSchema[]> =>
 export const getExercises = async (useMock = false, params?: any): Promise<Exercise[]> => {
   return tryApi(
     async () => {
-      const r = await api.get('/exercises/', { params })
-      return r.data
+      // The list is shared (and cached) for everyone; completion is a small per-user overlay
+      const [r, completion] = await Promise.all([
+        api.get('/exercises/', { params }),
+        api.get('/exercises/completion/').catch(() => ({ data: { completed: [] } }))
+      ])
+      const completed = new Set<number>(completion.data.completed)
+      return r.data.map((e: Exercise) => ({ ...e, completed: completed.has(e.id) }))
     },
     mockExercises,
     useMock
@@ -4,6 +4,7 @@ export interface DatabaseSchema {
   display_name: string
   description?: string
   db_name?: string
+  tables?: string[]
   exercise_count?: number
 }
 
@@ -19,6 +20,7 @@ export interface Exercise {
   tags?: string[]
   workshop?: string
   database_name?: string
+  completed?: boolean
 }
 
 export interface QueryResult {
@@ -26,8 +28,10 @@ export interface QueryResult {
   columns: string[]
   rows: any[][]
   row_count: number
+  truncated?: boolean
   execution_time?: number
   error?: string
+  warning?: string
 }
 
 export interface SubmitResult {
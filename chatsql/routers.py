@@ -0,0 +1,51 @@
+"""
+Database routing for chatsql_system.
+
+problems, problem_tables and submissions (the GCP system tables) live in
+the chatsql_system database. They have their own alias,
+settings.DATABASES['chatsql_system'], with persistent health-checked
+connections. Callers no longer run `USE chatsql_system` on the shared
+default connection, which cost a round trip per access and left the default
+connection on the wrong schema for the next caller.
+
+Without that alias (local SQLite) everything stays on 'default'.
+"""
+from django.conf import settings
+from django.db import connections
+
+SYSTEM_DB_ALIAS = 'chatsql_system'
+
+# db_table of models whose rows live in chatsql_system
+SYSTEM_TABLES = frozenset(['problems'])
+
+
+def system_db_alias() -> str:
+    return SYSTEM_DB_ALIAS if SYSTEM_DB_ALIAS in settings.DATABASES else 'default'
+
+
+def system_connection():
+    """Django connection to chatsql_system"""
+    return connections[system_db_alias()]
+
+
+def system_cursor():
+    """Cursor on chatsql_system: `with system_cursor() as cursor: ...`"""
+    return system_connection().cursor()
+
+
+class SystemDatabaseRouter:
+    """Send the chatsql_system models (Problem) to the chatsql_system alias"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.db_table in SYSTEM_TABLES:
+            return system_db_alias()
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # chatsql_system's schema is not managed through this alias (on GCP it
+        # is also 'default', which runs the migrations)
+        if db == SYSTEM_DB_ALIAS:
+            return False
+        return None
@@ -68,6 +68,9 @@ GCP_DB_PASSWORD = os.getenv('GCP_DB_PASSWORD')
 GCP_DB_PORT = os.getenv('GCP_DB_PORT', '3306')
 GCP_INSTANCE_CONNECTION_NAME = os.getenv('GCP_INSTANCE_CONNECTION_NAME')  # 格式: project:region:instance
 
+# Django的MySQL连接跨请求复用（秒），复用前做健康检查
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '300'))
+
 def get_gcp_db_config(db_name: str):
     """生成GCP Cloud SQL数据库配置"""
     return {
@@ -77,6 +80,8 @@ def get_gcp_db_config(db_name: str):
         'PASSWORD': GCP_DB_PASSWORD,
         'HOST': GCP_DB_HOST,
         'PORT': GCP_DB_PORT,
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
             'charset': 'utf8mb4',
@@ -89,6 +94,8 @@ if GCP_DB_HOST:
     # GCP Cloud SQL配置
     DATABASES = {
         'default': get_gcp_db_config('chatsql_system'),
+        # 系统表（problems / problem_tables / submissions）专用连接，见 chatsql/routers.py
+        'chatsql_system': {**get_gcp_db_config('chatsql_system'), 'TEST': {'MIRROR': 'default'}},
     }
     
     # 动态题目数据库会在运行时通过executor动态连接
@@ -103,6 +110,8 @@ elif DB_NAME:
             'PASSWORD': os.getenv('DB_PASSWORD'),
             'HOST': os.getenv('DB_HOST'),
             'PORT': os.getenv('DB_PORT', '3306'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
             'OPTIONS': {
                 'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
                 'charset': 'utf8mb4',
@@ -133,6 +142,12 @@ elif DB_NAME:
             'PORT': '3306',
         }
     }
+    # 系统表在同一服务器的chatsql_system库中，见 chatsql/routers.py
+    DATABASES['chatsql_system'] = {
+        **DATABASES['default'],
+        'NAME': 'chatsql_system',
+        'TEST': {'MIRROR': 'default'},
+    }
 else:
     # Local development fallback
     DATABASES = {
@@ -142,6 +157,78 @@ else:
         }
     }
 
+DATABASE_ROUTERS = ['chatsql.routers.SystemDatabaseRouter']
+
+# SQLExecutor connection pool (one pool per host/user, shared by all problem databases)
+SQL_POOL_MIN_SIZE = int(os.getenv('SQL_POOL_MIN_SIZE', '1'))
+SQL_POOL_MAX_SIZE = int(os.getenv('SQL_POOL_MAX_SIZE', '10'))
+SQL_POOL_IDLE_TIMEOUT = float(os.getenv('SQL_POOL_IDLE_TIMEOUT', '300'))  # seconds
+
+# Streaming execution (POST /api/exercises/{id}/execute/?stream=1)
+SQL_STREAM_MAX_ROWS = int(os.getenv('SQL_STREAM_MAX_ROWS', '100000'))
+SQL_STREAM_MAX_EXECUTION_TIME = int(os.getenv('SQL_STREAM_MAX_EXECUTION_TIME', '30'))  # seconds
+
+# Shared query-result cache for the read-only problem databases
+QUERY_RESULT_CACHE_ENABLED = os.getenv('QUERY_RESULT_CACHE_ENABLED', 'True') == 'True'
+QUERY_RESULT_CACHE_MAX_BYTES = int(os.getenv('QUERY_RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+QUERY_RESULT_CACHE_TTL = float(os.getenv('QUERY_RESULT_CACHE_TTL', '600'))  # seconds
+
+# Memoized validate_query verdicts (bounded LRU)
+SQL_VALIDATION_CACHE_SIZE = int(os.getenv('SQL_VALIDATION_CACHE_SIZE', '4096'))
+
+# Expected-query result cache; apply_seed bumps the per-database version, PROBLEM_DATA_VERSION all of them
+PROBLEM_DATA_VERSION = os.getenv('PROBLEM_DATA_VERSION', '1')
+DATA_VERSION_TTL = float(os.getenv('DATA_VERSION_TTL', '5'))  # seconds between re-reads of the reseed counters
+EXPECTED_RESULT_CACHE_SIZE = int(os.getenv('EXPECTED_RESULT_CACHE_SIZE', '256'))
+
+# Submission grading: 'checksum' (MySQL hashes full results server-side) or 'fetch' (compare fetched rows)
+SQL_GRADING_MODE = os.getenv('SQL_GRADING_MODE', 'checksum')
+SQL_GRADING_WORKERS = int(os.getenv('SQL_GRADING_WORKERS', '8'))  # user + expected queries run concurrently
+
+# Byte budget for captured query results (rows beyond it are counted, not kept)
+SQL_RESULT_MAX_BYTES = int(os.getenv('SQL_RESULT_MAX_BYTES', str(4 * 1024 * 1024)))
+SQL_RESULT_MAX_CELL_BYTES = int(os.getenv('SQL_RESULT_MAX_CELL_BYTES', str(16 * 1024)))  # longer cells are clipped
+
+# EXPLAIN-based cost guard for student queries on MySQL: 'reject', 'warn' or 'off'
+SQL_COST_GUARD_MODE = os.getenv('SQL_COST_GUARD_MODE', 'reject')
+SQL_COST_GUARD_MAX_ROWS = int(os.getenv('SQL_COST_GUARD_MAX_ROWS', '10000000'))  # estimated rows examined
+SQL_COST_GUARD_CACHE_SIZE = int(os.getenv('SQL_COST_GUARD_CACHE_SIZE', '4096'))
+
+# Accept submissions whose canonical form matches a known-correct query without running them
+SQL_CANONICAL_GRADING = os.getenv('SQL_CANONICAL_GRADING', 'True') == 'True'
+
+# Hidden dataset variants: <database_name>__v1, __v2, ... (sibling schemas or
+# DatabaseSchema snapshots) graded concurrently with the visible dataset
+SQL_GRADING_VARIANTS = os.getenv('SQL_GRADING_VARIANTS', 'True') == 'True'
+SQL_GRADING_VARIANTS_MAX = int(os.getenv('SQL_GRADING_VARIANTS_MAX', '4'))
+SQL_GRADING_VARIANTS_TTL = int(os.getenv('SQL_GRADING_VARIANTS_TTL', '300'))  # seconds between discoveries
+
+# In-memory problem catalog (chatsql_system.problems): full reload every TTL seconds,
+# cheap COUNT/MAX version probe at most once per PROBE_INTERVAL seconds
+PROBLEM_CATALOG_TTL = int(os.getenv('PROBLEM_CATALOG_TTL', '300'))
+PROBLEM_CATALOG_PROBE_INTERVAL = int(os.getenv('PROBLEM_CATALOG_PROBE_INTERVAL', '5'))
+
+# Embedded in-memory SQLite engine built from DatabaseSchema (schema_sql + seed_sql).
+# Always used for databases that aren't configured; EMBEDDED_SQL_ENGINE=True prefers it everywhere.
+EMBEDDED_SQL_ENGINE = os.getenv('EMBEDDED_SQL_ENGINE', 'False') == 'True'
+EMBEDDED_SQL_MAX_BYTES = int(os.getenv('EMBEDDED_SQL_MAX_BYTES', str(64 * 1024 * 1024)))  # total template size
+
+# Admission control in front of query execution (429 + Retry-After when saturated)
+SQL_ADMISSION_ENABLED = os.getenv('SQL_ADMISSION_ENABLED', 'True') == 'True'
+# Pooled connections admitted requests may hold at once: execute holds 1, submit up to 3 + hidden variants
+SQL_MAX_CONCURRENT_QUERIES = int(os.getenv('SQL_MAX_CONCURRENT_QUERIES', str(SQL_POOL_MAX_SIZE)))
+SQL_MAX_QUERIES_PER_USER = int(os.getenv('SQL_MAX_QUERIES_PER_USER', '2'))
+SQL_MAX_QUERIES_PER_PROBLEM = int(os.getenv('SQL_MAX_QUERIES_PER_PROBLEM', str(SQL_POOL_MAX_SIZE)))
+SQL_ADMISSION_QUEUE_SIZE = int(os.getenv('SQL_ADMISSION_QUEUE_SIZE', '100'))  # requests waiting for a slot
+SQL_ADMISSION_QUEUE_TIMEOUT = float(os.getenv('SQL_ADMISSION_QUEUE_TIMEOUT', '5'))  # seconds
+SQL_USER_EXECUTION_BUDGET = float(os.getenv('SQL_USER_EXECUTION_BUDGET', '30'))  # execution seconds per user (bucket size)
+SQL_USER_EXECUTION_REFILL = float(os.getenv('SQL_USER_EXECUTION_REFILL', '0.5'))  # seconds regained per second
+# Reverse proxies (comma-separated addresses) whose X-Forwarded-For names the client of anonymous requests
+SQL_ADMISSION_TRUSTED_PROXIES = [a.strip() for a in os.getenv('SQL_ADMISSION_TRUSTED_PROXIES', '').split(',') if a.strip()]
+
+# Serve execute/submit/AI with the async views (run under ASGI, e.g. uvicorn chatsql.asgi:application)
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -1,14 +1,18 @@
+from django.conf import settings
 from django.urls import path, include
 from exercises.admin import admin_site
 from exercises.views import (
     SchemaListView,
     ExerciseListView,
+    ExerciseCompletionView,
     ExerciseDetailView,
     ExecuteQueryView,
     SubmitQueryView,
     SubmissionListView,
+    AsyncExecuteQueryView,
+    AsyncSubmitQueryView,
 )
-from ai_tutor.views import ExerciseAIView
+from ai_tutor.views import ExerciseAIView, AsyncExerciseAIView
 from accounts.views import (
     me,
     instructor_stats,
@@ -20,19 +24,27 @@ from accounts.views import (
 from exercises.views import (
     instructor_exercises,
     instructor_exercise_detail,
+    instructor_executor_stats,
 )
 
+# ASGI部署时使用异步视图（不占用worker线程等待Cloud SQL / Anthropic）
+if settings.ASYNC_VIEWS:
+    ExecuteView, SubmitView, AIView = AsyncExecuteQueryView, AsyncSubmitQueryView, AsyncExerciseAIView
+else:
+    ExecuteView, SubmitView, AIView = ExecuteQueryView, SubmitQueryView, ExerciseAIView
+
 urlpatterns = [
     path('admin/', admin_site.urls),  # 使用自定义admin site
     
     # Exercise APIs
     path('api/schemas/', SchemaListView.as_view(), name='schema-list'),
     path('api/exercises/', ExerciseListView.as_view(), name='exercise-list'),
+    path('api/exercises/completion/', ExerciseCompletionView.as_view(), name='exercise-completion'),
     path('api/exercises/<int:exercise_id>/', ExerciseDetailView.as_view(), name='exercise-detail'),
-    path('api/exercises/<int:exercise_id>/execute/', ExecuteQueryView.as_view(), name='execute-query'),
-    path('api/exercises/<int:exercise_id>/submit/', SubmitQueryView.as_view(), name='submit-query'),
+    path('api/exercises/<int:exercise_id>/execute/', ExecuteView.as_view(), name='execute-query'),
+    path('api/exercises/<int:exercise_id>/submit/', SubmitView.as_view(), name='submit-query'),
     path('api/exercises/<int:exercise_id>/submissions/', SubmissionListView.as_view(), name='submission-list'),
-    path('api/exercises/<int:exercise_id>/ai/', ExerciseAIView.as_view(), name='exercise-ai'),
+    path('api/exercises/<int:exercise_id>/ai/', AIView.as_view(), name='exercise-ai'),
     
     # Auth APIs
     path('api/auth/', include('accounts.urls')),
@@ -45,6 +57,7 @@ urlpatterns = [
     path('api/instructor/recent-activity/', instructor_recent_activity, name='instructor-recent-activity'),
     path('api/instructor/exercises/', instructor_exercises, name='instructor-exercises'),
     path('api/instructor/exercises/<int:exercise_id>/', instructor_exercise_detail, name='instructor-exercise-detail'),
+    path('api/instructor/executor-stats/', instructor_executor_stats, name='instructor-executor-stats'),
     
     # Frontend
 ]
\ No newline at end of file
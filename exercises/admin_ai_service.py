@@ -4,7 +4,7 @@ Admin AI Assistant Service
 """
 import os
 from django.conf import settings
-from django.db import connection
+from chatsql.routers import system_cursor
 from anthropic import Anthropic
 
 API_KEY = os.getenv('ANTHROPIC_API_KEY') or getattr(settings, 'ANTHROPIC_API_KEY', None)
@@ -29,9 +29,7 @@ def get_problem_statistics():
     ]
     """
     try:
-        with connection.cursor() as cursor:
-            cursor.execute('USE chatsql_system')
-            
+        with system_cursor() as cursor:
             # 获取每个问题的统计信息
             cursor.execute("""
                 SELECT 
@@ -77,9 +75,7 @@ def get_problem_statistics():
 def get_overall_statistics():
     """获取整体统计信息"""
     try:
-        with connection.cursor() as cursor:
-            cursor.execute('USE chatsql_system')
-            
+        with system_cursor() as cursor:
             # 总提交数
             cursor.execute('SELECT COUNT(*) FROM submissions')
             total_submissions = cursor.fetchone()[0] or 0
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.db import connection, transaction
 from exercises.models import DatabaseSchema
+from exercises.services.data_version import bump_data_version
 
 
 class Command(BaseCommand):
@@ -21,6 +22,8 @@ class Command(BaseCommand):
                             cursor.executescript(s.schema_sql)
                         if s.seed_sql:
                             cursor.executescript(s.seed_sql)
+                    # Reseeded data invalidates cached expected results
+                    bump_data_version(s.db_name)
                     self.stdout.write(self.style.SUCCESS(f'Applied schema and seed for {s.name}'))
                 except Exception as e:
                     self.stdout.write(self.style.ERROR(f'Failed to apply {s.name}: {e}'))
\ No newline at end of file
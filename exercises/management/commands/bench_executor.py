@@ -0,0 +1,351 @@
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import time
+from datetime import datetime, timezone
+from unittest import mock
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from rest_framework.renderers import JSONRenderer
+
+from exercises.models import DatabaseSchema
+from exercises.services.executor import SQLExecutor
+from exercises.services.result import QueryResult
+from exercises.services.sql_lexer import VerdictCache
+from exercises.services.sqlite_engine import embedded_engine
+
+BENCH_DB = 'practice_bench'
+MYSQL_BENCH_DB = 'chatsql_bench'
+
+SCHEMA_SQL = '''
+CREATE TABLE Products (
+    id INTEGER PRIMARY KEY,
+    name VARCHAR(100),
+    category VARCHAR(50),
+    price DECIMAL(10, 2),
+    stock INTEGER
+);
+'''
+
+# Mixed query shapes for validate_query (valid, invalid, keyword-in-string)
+VALIDATION_QUERIES = [
+    "SELECT * FROM Products",
+    "SELECT name, price FROM Products WHERE category = 'Books' ORDER BY price DESC",
+    "SELECT category, COUNT(*) AS n, AVG(price) FROM Products GROUP BY category HAVING COUNT(*) > 3",
+    "SELECT p.name FROM Products p WHERE p.name LIKE '%DROP%' AND p.stock > 0",
+    "SELECT created_at, updated_at FROM Products",
+    "DELETE FROM Products",
+    "SELECT 1; DROP TABLE Products",
+    "SELECT * FROM Products -- comment",
+]
+
+
+def _seed_sql(rows: int) -> str:
+    categories = ['Books', 'Games', 'Music', 'Toys', 'Garden']
+    values = ',\n'.join(
+        f"({i}, 'Product {i}', '{categories[i % len(categories)]}', {(i * 37) % 1000 + 0.99}, {i % 50})"
+        for i in range(1, rows + 1)
+    )
+    return f"INSERT INTO Products (id, name, category, price, stock) VALUES\n{values};"
+
+
+def _timings(samples):
+    samples = sorted(samples)
+    mean = statistics.fmean(samples)
+    return {
+        'runs': len(samples),
+        'mean_ms': round(mean * 1000, 4),
+        'p50_ms': round(samples[len(samples) // 2] * 1000, 4),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 4),
+        'min_ms': round(samples[0] * 1000, 4),
+        'ops_per_sec': round(1 / mean, 1) if mean else None,
+    }
+
+
+def _measure(fn, runs: int, warmup: int = 1):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return _timings(samples)
+
+
+def _synthetic_result(rows: int) -> QueryResult:
+    return QueryResult(
+        True,
+        columns=['id', 'name', 'category', 'price', 'stock'],
+        rows=[(i, f'Product {i}', 'Books', i * 1.5, i % 50) for i in range(rows)],
+    )
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the SQLExecutor hot path (SQLite stand-in, or a local MySQL with --mysql) and write JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None,
+                            help='JSON output path (default: benchmarks/executor-<commit>.json)')
+        parser.add_argument('--baseline', default=None,
+                            help='Previous JSON output; prints the mean-time ratio for every scenario')
+        parser.add_argument('--rows', type=int, default=1000, help='Rows in the benchmark Products table')
+        parser.add_argument('--runs', type=int, default=50, help='Timed runs per scenario')
+        parser.add_argument('--mysql', action='store_true',
+                            help='Use a local MySQL (BENCH_MYSQL_HOST/PORT/USER/PASSWORD) instead of SQLite')
+
+    def handle(self, *args, **options):
+        runs = options['runs']
+        runner = DiscoverRunner(verbosity=0)
+        # Throwaway test database: nothing is written to the real default DB
+        old_config = runner.setup_databases()
+        try:
+            db_name = self._setup_dataset(options['rows'], options['mysql'])
+            results = {
+                'connection': self._bench_connection(db_name, options['mysql'], runs),
+                'validate_query': self._bench_validation(db_name, runs),
+                'compare_results': self._bench_compare(db_name, runs),
+                'serialization': self._bench_serialization(runs),
+                'submit_view': self._bench_submit_view(db_name, runs),
+            }
+        finally:
+            runner.teardown_databases(old_config)
+
+        report = {
+            'meta': self._meta(options),
+            'results': results,
+        }
+        output = options['output'] or os.path.join('benchmarks', f"executor-{report['meta']['commit'] or 'unknown'}.json")
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {output}'))
+
+        if options['baseline']:
+            self._print_comparison(options['baseline'], report)
+
+    # ------------------------------------------------------------------
+    # Dataset
+    # ------------------------------------------------------------------
+
+    def _setup_dataset(self, rows: int, use_mysql: bool) -> str:
+        seed_sql = _seed_sql(rows)
+        if not use_mysql:
+            # Served by the embedded SQLite engine (no network round trip)
+            DatabaseSchema.objects.create(
+                name='bench', display_name='Benchmark', description='bench_executor dataset',
+                db_name=BENCH_DB, schema_sql=SCHEMA_SQL, seed_sql=seed_sql,
+            )
+            embedded_engine.invalidate(BENCH_DB)
+            return BENCH_DB
+
+        import pymysql
+        config = self._mysql_config()
+        conn = pymysql.connect(host=config['HOST'], port=int(config['PORT']), user=config['USER'],
+                               password=config['PASSWORD'], autocommit=True)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f'DROP DATABASE IF EXISTS {MYSQL_BENCH_DB}')
+                cursor.execute(f'CREATE DATABASE {MYSQL_BENCH_DB}')
+                cursor.execute(f'USE {MYSQL_BENCH_DB}')
+                cursor.execute(SCHEMA_SQL)
+                cursor.execute(seed_sql)
+        finally:
+            conn.close()
+        # SQLExecutor picks configured databases from settings.DATABASES
+        settings.DATABASES[MYSQL_BENCH_DB] = config
+        return MYSQL_BENCH_DB
+
+    @staticmethod
+    def _mysql_config():
+        return {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': MYSQL_BENCH_DB,
+            'HOST': os.getenv('BENCH_MYSQL_HOST', '127.0.0.1'),
+            'PORT': os.getenv('BENCH_MYSQL_PORT', '3306'),
+            'USER': os.getenv('BENCH_MYSQL_USER', 'root'),
+            'PASSWORD': os.getenv('BENCH_MYSQL_PASSWORD', ''),
+            'OPTIONS': {'charset': 'utf8mb4'},
+        }
+
+    # ------------------------------------------------------------------
+    # Scenarios
+    # ------------------------------------------------------------------
+
+    def _bench_connection(self, db_name: str, use_mysql: bool, runs: int):
+        """A fresh connection per query vs. the executor's reused one (pool / template clone)"""
+        query = 'SELECT * FROM Products WHERE id <= 10'
+        executor = SQLExecutor(db_name)
+        executor.result_cacheable = False  # measure execution, not the shared cache
+
+        if use_mysql:
+            import pymysql
+            config = settings.DATABASES[db_name]
+
+            def fresh():
+                conn = pymysql.connect(host=config['HOST'], port=int(config['PORT']), user=config['USER'],
+                                       password=config['PASSWORD'], database=db_name)
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute(query)
+                        cursor.fetchall()
+                finally:
+                    conn.close()
+        else:
+            schema = DatabaseSchema.objects.get(db_name=db_name)
+
+            def fresh():
+                # Build the database from schema_sql/seed_sql for every query
+                conn = sqlite3.connect(':memory:')
+                try:
+                    conn.executescript(schema.schema_sql)
+                    conn.executescript(schema.seed_sql)
+                    conn.execute(query).fetchall()
+                finally:
+                    conn.close()
+
+        return {
+            'backend': executor.engine,
+            'fresh_connection': _measure(fresh, runs),
+            'executor_execute': _measure(lambda: executor.execute(query), runs),
+        }
+
+    def _bench_validation(self, db_name: str, runs: int):
+        executor = SQLExecutor(db_name)
+        batch = VALIDATION_QUERIES * 125  # 1000 validations per run
+
+        # Distinct text (trailing spaces) so every validation misses the verdict cache
+        distinct = [q + ' ' * (i + 1) for i, q in enumerate(batch)]
+        verdicts = SQLExecutor._verdicts
+
+        def cold():
+            SQLExecutor._verdicts = VerdictCache(verdicts.max_entries)
+            for q in distinct:
+                executor.validate_query(q)
+
+        def warm():
+            for q in batch:
+                executor.validate_query(q)
+
+        try:
+            cold_t = _measure(cold, max(5, runs // 5))
+        finally:
+            SQLExecutor._verdicts = verdicts
+        warm_t = _measure(warm, runs)
+        return {
+            'queries_per_run': len(batch),
+            'cold_cache': cold_t,
+            'warm_cache': warm_t,
+            'cold_validations_per_sec': round(len(batch) / (cold_t['mean_ms'] / 1000), 1),
+            'warm_validations_per_sec': round(len(batch) / (warm_t['mean_ms'] / 1000), 1),
+        }
+
+    def _bench_compare(self, db_name: str, runs: int):
+        executor = SQLExecutor(db_name)
+        results = {}
+        for rows in (10, 1000, 100000):
+            user = _synthetic_result(rows)
+            expected = _synthetic_result(rows)
+            n = runs if rows < 100000 else max(3, runs // 10)
+
+            def unfingerprinted():
+                user.fingerprint = None
+                expected.fingerprint = None
+                executor.compare_results(user, expected)
+
+            timings = {'no_fingerprint': _measure(unfingerprinted, n)}
+            user.fingerprint = executor.result_fingerprint(user)
+            expected.fingerprint = executor.result_fingerprint(expected)
+            timings['precomputed_fingerprint'] = _measure(lambda: executor.compare_results(user, expected), n)
+            results[f'{rows}_rows'] = timings
+        return results
+
+    def _bench_serialization(self, runs: int):
+        from exercises.views import stream_query_response
+
+        renderer = JSONRenderer()
+        results = {}
+        for rows in (10, 1000, 10000):
+            result = _synthetic_result(rows)
+            executor = mock.Mock()
+            executor.stream.side_effect = lambda q, r=result: iter([
+                ('header', r.columns),
+                ('rows', [list(row) for row in r.rows]),
+                ('stats', {'row_count': r.row_count, 'execution_time': 0, 'truncated': False}),
+            ])
+            n = runs if rows < 10000 else max(5, runs // 5)
+            results[f'{rows}_rows'] = {
+                'json_response': _measure(lambda: renderer.render(result), n),
+                'ndjson_stream': _measure(lambda: b''.join(stream_query_response(executor, '').streaming_content), n),
+                'json_bytes': len(renderer.render(result)),
+            }
+        return results
+
+    def _bench_submit_view(self, db_name: str, runs: int):
+        """End-to-end POST /api/exercises/1/submit/ through Django's test client"""
+        import exercises.views as views
+
+        problem = {
+            'id': 1, 'title': 'Benchmark', 'difficulty': 'easy', 'tag': '', 'description': '',
+            'database_name': db_name, 'expected_query': "SELECT name, price FROM Products WHERE category = 'Books'",
+            'expected_result': None, 'created_at': None,
+        }
+        client = Client(HTTP_HOST='localhost')
+        cases = {
+            'correct': "SELECT price, name FROM Products WHERE category = 'Books' ORDER BY id DESC",
+            'wrong': "SELECT name, price FROM Products WHERE category = 'Games'",
+            'invalid': "DELETE FROM Products",
+        }
+        results = {}
+        with mock.patch.object(views, 'get_problem_from_gcp', return_value=problem), \
+                mock.patch.object(views, 'save_submission_to_gcp'):
+            for name, query in cases.items():
+                def post():
+                    response = client.post('/api/exercises/1/submit/', {'query': query}, content_type='application/json')
+                    assert response.status_code == 200, response.status_code
+                results[name] = _measure(post, runs)
+        return results
+
+    # ------------------------------------------------------------------
+
+    def _meta(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                    text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'backend': 'mysql' if options['mysql'] else 'embedded-sqlite',
+            'rows': options['rows'],
+            'runs': options['runs'],
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+        }
+
+    def _print_comparison(self, baseline_path: str, report):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+        def walk(old, new, path):
+            for key, value in new.items():
+                if key not in old:
+                    continue
+                if isinstance(value, dict):
+                    walk(old[key], value, path + [key])
+                elif key == 'mean_ms' and old[key]:
+                    ratio = value / old[key]
+                    style = self.style.ERROR if ratio > 1.1 else self.style.SUCCESS if ratio < 0.9 else str
+                    self.stdout.write(style(f"{'/'.join(path):60s} {old[key]:>10.3f} -> {value:>10.3f} ms  x{ratio:.2f}"))
+
+        self.stdout.write(f"Compared with {baseline_path} ({baseline['meta'].get('commit')})")
+        walk(baseline['results'], report['results'], [])
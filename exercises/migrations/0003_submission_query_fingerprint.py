@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercises', '0002_submission'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Problem',
+            fields=[
+                ('id', models.BigIntegerField(db_column='id', primary_key=True, serialize=False)),
+                ('title', models.CharField(db_column='title', max_length=255)),
+                ('difficulty', models.CharField(blank=True, choices=[('Easy', 'Easy'), ('Medium', 'Medium'), ('Hard', 'Hard'), ('easy', 'easy'), ('medium', 'medium'), ('hard', 'hard')], db_column='difficulty', max_length=50, null=True)),
+                ('tag', models.CharField(blank=True, db_column='tag', max_length=255, null=True)),
+                ('description', models.TextField(blank=True, db_column='description', null=True)),
+                ('database_name', models.CharField(blank=True, db_column='database_name', max_length=255, null=True)),
+                ('expected_query', models.TextField(blank=True, db_column='expected_query', null=True)),
+                ('expected_result', models.TextField(blank=True, db_column='expected_result', null=True)),
+                ('created_at', models.DateTimeField(blank=True, db_column='created_at', null=True)),
+            ],
+            options={
+                'db_table': 'problems',
+                'ordering': ['id'],
+                'managed': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='submission',
+            name='query_fingerprint',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
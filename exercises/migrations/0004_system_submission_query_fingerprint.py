@@ -0,0 +1,42 @@
+from django.db import DEFAULT_DB_ALIAS, connections, migrations
+
+from chatsql.routers import SYSTEM_DB_ALIAS
+
+
+def _same_database(a, b) -> bool:
+    keys = ('HOST', 'PORT', 'NAME')
+    return all(a.settings_dict.get(key) == b.settings_dict.get(key) for key in keys)
+
+
+def add_system_column(apps, schema_editor):
+    """
+    With the legacy DB_NAME config chatsql_system is a separate database that
+    SystemDatabaseRouter keeps out of migrate, so 0003 never reaches its
+    submissions table (the one save_submission_to_gcp writes). Add the column there.
+    """
+    connection = schema_editor.connection
+    if connection.alias != DEFAULT_DB_ALIAS or SYSTEM_DB_ALIAS not in connections.databases:
+        return
+    system = connections[SYSTEM_DB_ALIAS]
+    if _same_database(system, connection):
+        return  # GCP config / tests: 0003 already added it
+    with system.cursor() as cursor:
+        if 'submissions' not in system.introspection.table_names(cursor):
+            return
+        columns = {column.name for column in system.introspection.get_table_description(cursor, 'submissions')}
+    if 'query_fingerprint' in columns:
+        return
+    Submission = apps.get_model('exercises', 'Submission')
+    with system.schema_editor() as editor:
+        editor.add_field(Submission, Submission._meta.get_field('query_fingerprint'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercises', '0003_submission_query_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_system_column, migrations.RunPython.noop),
+    ]
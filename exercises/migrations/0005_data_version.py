@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exercises', '0004_system_submission_query_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('db_name', models.CharField(max_length=255, unique=True)),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'data_versions',
+            },
+        ),
+    ]
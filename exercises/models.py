@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 
 class DatabaseSchema(models.Model):
     """
@@ -89,6 +91,8 @@ class Submission(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='submissions')
     exercise = models.ForeignKey(Exercise, on_delete=models.CASCADE, related_name='submissions')
     query = models.TextField()
+    # sql_normalize.fingerprint(query): same value for queries differing only in formatting
+    query_fingerprint = models.BigIntegerField(null=True, blank=True, db_index=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     execution_time = models.FloatField(null=True, blank=True, help_text='Query execution time in seconds')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -149,4 +153,37 @@ class Problem(models.Model):
     class Meta:
         db_table = 'problems'
         managed = False  # 表已存在于数据库中，Django 不管理迁移
-        ordering = ['id']
\ No newline at end of file
+        ordering = ['id']
+
+
+class DataVersion(models.Model):
+    """Reseed count of a practice database, shared by all processes (services/data_version.py)"""
+    db_name = models.CharField(max_length=255, unique=True)
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.db_name} v{self.version}"
+
+    class Meta:
+        db_table = 'data_versions'
+
+
+@receiver(post_save, sender=Problem)
+@receiver(post_delete, sender=Problem)
+def invalidate_problem_caches(sender, instance, **kwargs):
+    """题目被修改或删除时，清除缓存的expected result和题目目录"""
+    from .services.catalog import problem_catalog
+    from .services.expected_cache import invalidate_problem
+    invalidate_problem(instance.id)
+    problem_catalog.invalidate()
+
+
+@receiver(post_save, sender=DatabaseSchema)
+@receiver(post_delete, sender=DatabaseSchema)
+def invalidate_embedded_template(sender, instance, **kwargs):
+    """架构或种子数据修改后，重建内嵌SQLite模板"""
+    from .services.sqlite_engine import embedded_engine
+    from .services.variants import variant_registry
+    embedded_engine.invalidate(instance.db_name)
+    # 新增/删除的 <db_name>__vK 快照即为隐藏测试数据集
+    variant_registry.invalidate_database(instance.db_name)
@@ -0,0 +1,277 @@
+"""
+Admission control in front of query execution.
+
+When a whole class presses "Run" at once, every request would otherwise grab
+its own database connection. Each execute/submit request must first be
+admitted:
+
+- admitted requests hold at most SQL_MAX_CONCURRENT_QUERIES pooled
+  connections at a time (global); each request is charged what it may hold at
+  once (cost): 1 for execute, up to 3 + hidden variants for submit (grading.py)
+- at most SQL_MAX_QUERIES_PER_PROBLEM of them on the same problem
+- at most SQL_MAX_QUERIES_PER_USER in flight per user (rejected right away)
+- requests that can't run yet wait in a bounded queue for at most
+  SQL_ADMISSION_QUEUE_TIMEOUT seconds; a full queue or an expired wait is
+  rejected (the views answer 429 with Retry-After)
+- each user has a token bucket of execution seconds (capacity
+  SQL_USER_EXECUTION_BUDGET, refilled at SQL_USER_EXECUTION_REFILL per
+  second); the time a request held its database connection is charged after
+  it finishes (a stream isn't charged for the client downloading its last
+  rows), and users in debt are rejected until the bucket refills
+
+Users are told apart by session, else by client IP: behind a reverse proxy
+REMOTE_ADDR is the proxy, so X-Forwarded-For is used when the request comes
+from one of SQL_ADMISSION_TRUSTED_PROXIES.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Hashable, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted; retry after retry_after seconds"""
+
+    def __init__(self, reason: str, message: str, retry_after: float):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class Ticket:
+    __slots__ = ('user', 'problem', 'cost', 'admitted_at', 'released')
+
+    def __init__(self, user: Hashable, problem: Hashable, cost: int = 1):
+        self.user = user
+        self.problem = problem
+        self.cost = cost
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.updated_at = time.monotonic()
+
+
+class AdmissionController:
+    """Thread-safe admission gate (one per process)"""
+
+    def __init__(self, max_concurrent: int = 10, max_per_user: int = 2, max_per_problem: int = 10,
+                 max_queue: int = 100, queue_timeout: float = 5.0,
+                 budget: float = 30.0, refill_rate: float = 0.5, enabled: bool = True):
+        self.enabled = enabled
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self.max_per_problem = max_per_problem
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.budget = budget
+        self.refill_rate = refill_rate
+
+        self._cond = threading.Condition(threading.Lock())
+        self._in_flight = 0
+        self._connections = 0       # sum of the admitted tickets' cost
+        self._per_user: Dict[Hashable, int] = {}
+        self._per_problem: Dict[Hashable, int] = {}
+        self._buckets: Dict[Hashable, _Bucket] = {}
+        self._waiting = 0
+
+        # Metrics
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {'queue_full': 0, 'queue_timeout': 0, 'user_limit': 0, 'budget': 0}
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def admit(self, user: Hashable, problem: Hashable, cost: int = 1):
+        """Run the block once admitted; raises AdmissionRejected"""
+        ticket = self.acquire(user, problem, cost)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def acquire(self, user: Hashable, problem: Hashable, cost: int = 1) -> Ticket:
+        """
+        Wait (bounded) until the request may run; pair with release().
+        cost: pooled connections the request may hold at once.
+        """
+        if not self.enabled:
+            ticket = Ticket(user, problem)
+            ticket.released = True  # nothing to release
+            return ticket
+        # A request costlier than the whole limit still runs, alone
+        cost = max(1, min(cost, self.max_concurrent))
+        start = time.monotonic()
+        with self._cond:
+            tokens = self._refill_locked(user, start)
+            if tokens <= 0:
+                self.rejected['budget'] += 1
+                raise AdmissionRejected(
+                    'budget', "Execution time budget exhausted, please wait a moment",
+                    (-tokens) / self.refill_rate if self.refill_rate > 0 else self.queue_timeout
+                )
+            if self._per_user.get(user, 0) >= self.max_per_user:
+                self.rejected['user_limit'] += 1
+                raise AdmissionRejected(
+                    'user_limit', "Too many queries running at once, please wait for them to finish", 1
+                )
+
+            if not self._can_run_locked(problem, cost):
+                if self._waiting >= self.max_queue:
+                    self.rejected['queue_full'] += 1
+                    raise AdmissionRejected('queue_full', "Server is busy, please try again", self.queue_timeout)
+
+                deadline = start + self.queue_timeout
+                self._waiting += 1
+                self.max_queue_depth = max(self.max_queue_depth, self._waiting)
+                try:
+                    while not self._can_run_locked(problem, cost):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected['queue_timeout'] += 1
+                            raise AdmissionRejected(
+                                'queue_timeout', "Server is busy, please try again", self.queue_timeout
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                # The user may have started another query meanwhile
+                if self._per_user.get(user, 0) >= self.max_per_user:
+                    self.rejected['user_limit'] += 1
+                    self._cond.notify_all()
+                    raise AdmissionRejected(
+                        'user_limit', "Too many queries running at once, please wait for them to finish", 1
+                    )
+
+            self._in_flight += 1
+            self._connections += cost
+            self._per_user[user] = self._per_user.get(user, 0) + 1
+            self._per_problem[problem] = self._per_problem.get(problem, 0) + 1
+            waited = time.monotonic() - start
+            self.admitted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return Ticket(user, problem, cost)
+
+    async def acquire_async(self, user: Hashable, problem: Hashable, cost: int = 1) -> Ticket:
+        """acquire() for the async views: the bounded wait happens in a worker thread"""
+        return await sync_to_async(self.acquire, thread_sensitive=False)(user, problem, cost)
+
+    def release(self, ticket: Ticket, charged: Optional[float] = None):
+        """
+        Free the slot and charge the user's bucket: charged seconds (the time
+        the request held its connection), by default the time since admission
+        """
+        now = time.monotonic()
+        with self._cond:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._in_flight -= 1
+            self._connections -= ticket.cost
+            self._decrement_locked(self._per_user, ticket.user)
+            self._decrement_locked(self._per_problem, ticket.problem)
+            self._refill_locked(ticket.user, now)
+            self._buckets[ticket.user].tokens -= now - ticket.admitted_at if charged is None else charged
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'in_flight': self._in_flight,
+                'connections': self._connections,
+                'queue_depth': self._waiting,
+                'max_queue_depth': self.max_queue_depth,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected),
+                'avg_wait': round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+                'max_wait': round(self.max_wait, 4),
+                'users_in_debt': sum(1 for b in self._buckets.values() if b.tokens <= 0),
+            }
+
+    # ------------------------------------------------------------------
+
+    def _can_run_locked(self, problem: Hashable, cost: int) -> bool:
+        return (self._connections + cost <= self.max_concurrent
+                and self._per_problem.get(problem, 0) < self.max_per_problem)
+
+    def _refill_locked(self, user: Hashable, now: float) -> float:
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            bucket = self._buckets[user] = _Bucket(self.budget)
+            if len(self._buckets) > 10000:
+                self._prune_locked(now)
+            return bucket.tokens
+        bucket.tokens = min(self.budget, bucket.tokens + (now - bucket.updated_at) * self.refill_rate)
+        bucket.updated_at = now
+        return bucket.tokens
+
+    def _prune_locked(self, now: float):
+        # Full buckets carry no state worth keeping
+        for user in [u for u, b in self._buckets.items()
+                     if u not in self._per_user
+                     and b.tokens + (now - b.updated_at) * self.refill_rate >= self.budget]:
+            del self._buckets[user]
+
+    @staticmethod
+    def _decrement_locked(counts: Dict[Hashable, int], key: Hashable):
+        remaining = counts.get(key, 0) - 1
+        if remaining > 0:
+            counts[key] = remaining
+        else:
+            counts.pop(key, None)
+
+
+def client_ip(request) -> Optional[str]:
+    """
+    The client's address: REMOTE_ADDR, or the nearest X-Forwarded-For entry
+    that isn't a trusted proxy when the request came through one
+    """
+    trusted = getattr(settings, 'SQL_ADMISSION_TRUSTED_PROXIES', ())
+    remote = request.META.get('REMOTE_ADDR')
+    if remote not in trusted:
+        return remote
+    # Proxies append: the right-most entries were added by our own proxies
+    for address in reversed(request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')):
+        address = address.strip()
+        if address and address not in trusted:
+            return address
+    return remote
+
+
+def request_user_key(request) -> Hashable:
+    """Admission key for the requesting user: session user, else session/client IP"""
+    user_id = request.session.get('user_id')
+    if user_id:
+        return ('user', user_id)
+    if request.session.session_key:
+        return ('session', request.session.session_key)
+    return ('ip', client_ip(request))
+
+
+admission = AdmissionController(
+    enabled=getattr(settings, 'SQL_ADMISSION_ENABLED', True),
+    max_concurrent=getattr(settings, 'SQL_MAX_CONCURRENT_QUERIES', 10),
+    max_per_user=getattr(settings, 'SQL_MAX_QUERIES_PER_USER', 2),
+    max_per_problem=getattr(settings, 'SQL_MAX_QUERIES_PER_PROBLEM', 10),
+    max_queue=getattr(settings, 'SQL_ADMISSION_QUEUE_SIZE', 100),
+    queue_timeout=getattr(settings, 'SQL_ADMISSION_QUEUE_TIMEOUT', 5.0),
+    budget=getattr(settings, 'SQL_USER_EXECUTION_BUDGET', 30.0),
+    refill_rate=getattr(settings, 'SQL_USER_EXECUTION_REFILL', 0.5),
+)
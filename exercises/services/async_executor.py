@@ -0,0 +1,300 @@
+"""
+Async execution path for the ASGI views.
+
+Problem-database queries run on aiomysql, so an ASGI worker waits for Cloud
+SQL without holding a thread and one process can keep hundreds of student
+requests in flight. Validation, the shared result cache, limits, the
+QueryResult format and metrics are the same as SQLExecutor's.
+
+Backends without an async driver (embedded SQLite, the Django connection), or
+a missing aiomysql, run the sync executor in a worker thread instead.
+"""
+import asyncio
+import time
+from typing import Dict, Tuple
+
+import pymysql
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .capture import FETCH_CHUNK_ROWS, ResultCapture
+from .checksum import build_checksum_query, build_columns_query, format_checksum
+from .cost_guard import cost_guard, explain_key
+from .data_version import data_versions
+from .result import QueryResult
+from .pool import COM_RESET_CONNECTION
+from .result_cache import make_key as result_cache_key, result_cache
+from .timeouts import error_type, watchdog, with_time_limit
+
+try:
+    import aiomysql
+except ImportError:  # 可选依赖：未安装时异步视图在线程中运行同步执行器
+    aiomysql = None
+
+# Client-side backstop behind the server-side MAX_EXECUTION_TIME hint
+CLIENT_GRACE = 1.0
+
+# aiomysql pools are bound to an event loop: one per (loop, host, port, user)
+_pools: Dict[Tuple, object] = {}
+
+
+def is_async_capable(executor) -> bool:
+    return aiomysql is not None and executor.engine == 'mysql'
+
+
+async def _get_pool(db_config: Dict):
+    loop = asyncio.get_running_loop()
+    port = int(db_config.get('PORT') or 3306)
+    key = (id(loop), db_config['HOST'], port, db_config['USER'])
+    pool = _pools.get(key)
+    if pool is None:
+        options = db_config.get('OPTIONS', {})
+        pool = await aiomysql.create_pool(
+            minsize=getattr(settings, 'SQL_POOL_MIN_SIZE', 1),
+            maxsize=getattr(settings, 'SQL_POOL_MAX_SIZE', 10),
+            pool_recycle=int(getattr(settings, 'SQL_POOL_IDLE_TIMEOUT', 300)),
+            host=db_config['HOST'],
+            port=port,
+            user=db_config['USER'],
+            password=db_config['PASSWORD'],
+            charset=options.get('charset', 'utf8mb4'),
+            init_command=options.get('init_command'),
+            autocommit=True,
+            connect_timeout=10,
+        )
+        existing = _pools.setdefault(key, pool)
+        if existing is not pool:
+            # Another request created it first
+            pool.close()
+            pool = existing
+    return pool
+
+
+class _SideConnections:
+    """The watchdog's pool argument: KILL QUERY goes over a short-lived pymysql connection"""
+
+    def __init__(self, db_config: Dict):
+        self.db_config = db_config
+
+    def open_side_connection(self) -> pymysql.connections.Connection:
+        options = self.db_config.get('OPTIONS', {})
+        return pymysql.connect(
+            host=self.db_config['HOST'],
+            port=int(self.db_config.get('PORT') or 3306),
+            user=self.db_config['USER'],
+            password=self.db_config['PASSWORD'],
+            charset=options.get('charset', 'utf8mb4'),
+            connect_timeout=5,
+            read_timeout=5,
+        )
+
+
+async def _reset_session(conn):
+    """ConnectionPool._reset_session() on aiomysql: nothing a previous checkout did reaches this one"""
+    await conn._execute_command(COM_RESET_CONNECTION, b'')
+    await conn._read_ok_packet()
+    # Session variables are back at the server defaults: restore the pool's
+    await conn.set_charset(conn.charset)
+    if conn.init_command is not None:
+        await conn.query(conn.init_command)
+    await conn.autocommit(True)
+
+
+async def _prepare(conn, db_name: str):
+    """Clean session on the right schema; a connection that fails the reset is reconnected"""
+    if getattr(conn, '_chatsql_used', False):
+        try:
+            await _reset_session(conn)
+        except Exception:
+            # Never run on a session whose state is unknown
+            conn.close()
+            await conn.ping(reconnect=True)
+            conn._chatsql_schema = None
+    conn._chatsql_used = True
+    if getattr(conn, '_chatsql_schema', None) != db_name:
+        await conn.select_db(db_name)
+        conn._chatsql_schema = db_name
+
+
+async def _run(db_config: Dict, statements, timeout: float, cursor_class=None):
+    """
+    Run statements (coroutine functions taking a cursor) on a pooled
+    connection switched to db_config['NAME']; returns the last one's result.
+    A connection left mid-statement (timeout, task cancelled) or mid-result
+    (unbuffered rows past the cap) is closed. Statements the client stopped
+    waiting for are stopped on the server as well (watchdog KILL QUERY).
+    """
+    pool = await _get_pool(db_config)
+    conn = await pool.acquire()
+    clean = False
+    watch = None
+    try:
+        await _prepare(conn, db_config['NAME'])
+        watch = watchdog.start(conn.thread_id(), _SideConnections(db_config), timeout)
+        cursor = await (conn.cursor(cursor_class) if cursor_class is not None else conn.cursor())
+        result = None
+        for statement in statements:
+            result = await asyncio.wait_for(statement(cursor), timeout + CLIENT_GRACE)
+        if getattr(cursor._result, 'unbuffered_active', False):
+            # SSCursor.close() would read (and drop) every remaining row
+            return result
+        await cursor.close()
+        clean = True
+        return result
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        # Closing the socket doesn't stop the statement on the server
+        if watch is not None:
+            watchdog.kill_now(watch)
+        raise
+    finally:
+        # Never wait for an in-flight KILL on the event loop: drop the connection instead
+        if watch is not None and watchdog.finish(watch):
+            clean = False
+        if not clean:
+            conn.close()
+        pool.release(conn)
+
+
+async def execute_async(executor, query: str) -> QueryResult:
+    """Async SQLExecutor.execute()"""
+    if not is_async_capable(executor):
+        return await sync_to_async(executor.execute, thread_sensitive=False)(query)
+
+    is_valid, error = executor.validate_query(query)
+    if not is_valid:
+        return QueryResult.failure(error)
+
+    # Cache keys carry the data version; it is never read from the event loop itself
+    await data_versions.refresh_async()
+    cache_key = result_cache_key(executor.db_name, query) if executor.result_cacheable else None
+    if cache_key is not None:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            result = cached.copy()
+            result['cached'] = True
+            return result
+
+    timeout = executor.MAX_EXECUTION_TIME
+    max_rows = executor.MAX_ROWS
+
+    verdict = await _cost_check(executor, query)
+    if verdict is not None and verdict.rejected:
+        return QueryResult.failure(verdict.message, 'too_expensive')
+
+    capture = ResultCapture(max_rows)
+
+    async def fetch(cursor):
+        await cursor.execute(with_time_limit(query, timeout))
+        capture.start([desc[0] for desc in cursor.description] if cursor.description else [])
+        while capture.remaining > 0:
+            chunk = await cursor.fetchmany(min(FETCH_CHUNK_ROWS, capture.remaining))
+            if not chunk:
+                return
+            if not capture.add_rows(chunk):
+                break
+        # At the cap: one more read tells whether rows are left (ResultCapture.fetch_from)
+        await cursor.fetchmany(1)
+
+    start_time = time.time()
+    try:
+        # Unbuffered cursor: only the captured rows are held in memory
+        await _run(executor.db_config, [fetch], timeout, aiomysql.SSCursor)
+        result = capture.result(round(time.time() - start_time, 3))
+        if verdict is not None:
+            result['warning'] = verdict.message
+        if cache_key is not None:
+            result_cache.put(cache_key, result.copy())
+    except asyncio.TimeoutError:
+        result = QueryResult.failure(_timeout_message(timeout), 'timeout', round(time.time() - start_time, 3))
+    except pymysql.MySQLError as e:
+        kind = error_type(e)
+        message = _timeout_message(timeout) if kind == 'timeout' else str(e)
+        result = QueryResult.failure(message, kind, round(time.time() - start_time, 3))
+    executor.backend.metrics.record(result)
+    return result
+
+
+async def checksum_async(executor, query: str) -> Dict:
+    """Async SQLExecutor.checksum()"""
+    if not is_async_capable(executor):
+        return await sync_to_async(executor.checksum, thread_sensitive=False)(query)
+
+    is_valid, error = executor.validate_query(query)
+    if not is_valid:
+        return executor.checksum(query)  # in-process validation failure, no I/O
+
+    await data_versions.refresh_async()
+    timeout = executor.MAX_EXECUTION_TIME
+    columns = []
+
+    verdict = await _cost_check(executor, query)
+    if verdict is not None and verdict.rejected:
+        return {
+            'success': False,
+            'error': verdict.message,
+            'error_type': 'too_expensive',
+            'columns': [],
+            'row_count': 0,
+            'checksum': None,
+            'execution_time': 0
+        }
+
+    async def probe(cursor):
+        # Column names first (LIMIT 0 probe), then the aggregate
+        await cursor.execute(build_columns_query(query))
+        columns.extend(desc[0] for desc in cursor.description or ())
+
+    async def aggregate(cursor):
+        await cursor.execute(with_time_limit(build_checksum_query(query, columns), timeout))
+        return await cursor.fetchone()
+
+    start_time = time.time()
+    try:
+        row_count, hi, lo = await _run(executor.db_config, [probe, aggregate], timeout)
+        result = {
+            'success': True,
+            'columns': columns,
+            'row_count': row_count,
+            'checksum': format_checksum(row_count, hi, lo),
+            'execution_time': round(time.time() - start_time, 3),
+            'error': None
+        }
+        if verdict is not None:
+            result['warning'] = verdict.message
+        return result
+    except (asyncio.TimeoutError, pymysql.MySQLError) as e:
+        kind = 'timeout' if isinstance(e, asyncio.TimeoutError) else error_type(e)
+        return {
+            'success': False,
+            'error': _timeout_message(timeout) if kind == 'timeout' else str(e),
+            'error_type': kind,
+            'columns': [],
+            'row_count': 0,
+            'checksum': None,
+            'execution_time': round(time.time() - start_time, 3)
+        }
+
+
+async def _cost_check(executor, query: str):
+    """Async SQLExecutor.cost_check(): EXPLAIN on the aiomysql pool"""
+    if not cost_guard.enabled:
+        return None
+    key = explain_key(executor.db_name, query)
+    estimate = cost_guard.get(key)
+    if estimate is None:
+        async def explain(cursor):
+            await cursor.execute(f'EXPLAIN FORMAT=JSON {with_time_limit(query, executor.MAX_EXECUTION_TIME)}')
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+        try:
+            plan = await _run(executor.db_config, [explain], executor.MAX_EXECUTION_TIME)
+        except (asyncio.TimeoutError, pymysql.MySQLError):
+            # Syntax errors etc. are reported when the query itself runs
+            plan = None
+        estimate = cost_guard.put(key, plan)
+    return cost_guard.judge(estimate)
+
+
+def _timeout_message(timeout: float) -> str:
+    return f"Query exceeded the time limit of {timeout} seconds"
@@ -0,0 +1,424 @@
+"""
+Execution backends.
+
+SQLExecutor validates queries, applies the shared result cache and grades;
+the backend only runs an already validated statement. Every backend gets the
+same row and byte budget (capture.py), time limit, timing, QueryResult format
+(with fingerprint) and metrics from ExecutionBackend.execute(), so pooling,
+caching and streaming changes land in one place:
+
+- MySQLPoolBackend:      pooled pymysql connections + server-side time limits
+- DjangoDBBackend:       a Django database connection (SQLite in local
+                         development, chatsql_system for the AI tutor)
+- EmbeddedSQLiteBackend: in-memory copy of a DatabaseSchema (sqlite_engine)
+"""
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import pymysql
+from django.db import DatabaseError, connections
+
+from .capture import ResultCapture, clip_row
+from .checksum import build_checksum_query, build_columns_query, format_checksum
+from .pool import get_pool
+from .result import QueryResult
+from .sqlite_engine import embedded_engine
+from .timeouts import SERVER_INTERRUPT_ERRORS, error_type, watchdog, with_time_limit
+
+# SQLite VM instructions between time-limit checks (progress handler)
+SQLITE_PROGRESS_STEPS = 10000
+
+# Largest result the default checksum() (fetch + fingerprint) grades
+FALLBACK_CHECKSUM_MAX_ROWS = 100000
+
+# Socket read timeout of a stream beyond its own time limit: the server-side
+# limit and the watchdog end the statement first
+STREAM_READ_GRACE = 5
+
+
+def _sqlite_interrupt(deadline: float, cancellation):
+    """Progress handler: a non-zero return aborts the statement ('interrupted')"""
+    def handler():
+        if time.monotonic() > deadline or (cancellation is not None and cancellation.cancelled):
+            return 1
+        return 0
+    return handler
+
+
+class BackendError(Exception):
+    """A statement failed; message is shown to the user"""
+
+    def __init__(self, message: str, error_type: str = 'error'):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+class BackendMetrics:
+    """Per-backend counters (exposed via backend_stats())"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.rows = 0
+        self.total_time = 0.0
+
+    def record(self, result: QueryResult):
+        with self._lock:
+            self.queries += 1
+            self.total_time += result.execution_time
+            if result.success:
+                self.rows += result.row_count
+            elif result.error_type == 'timeout':
+                self.timeouts += 1
+            elif result.error_type == 'cancelled':
+                self.cancelled += 1
+            else:
+                self.errors += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'queries': self.queries,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'cancelled': self.cancelled,
+                'rows': self.rows,
+                'avg_execution_time': round(self.total_time / self.queries, 4) if self.queries else 0.0,
+            }
+
+
+_metrics: Dict[str, BackendMetrics] = {}
+_metrics_lock = threading.Lock()
+
+
+def _metrics_for(name: str) -> BackendMetrics:
+    with _metrics_lock:
+        if name not in _metrics:
+            _metrics[name] = BackendMetrics()
+        return _metrics[name]
+
+
+def backend_stats() -> Dict[str, Dict]:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    return {name: m.stats() for name, m in metrics.items()}
+
+
+class ExecutionBackend:
+    """Runs validated statements; subclasses implement _fetch()"""
+
+    name = 'base'
+    supports_checksum = False
+    supports_explain = False
+
+    def __init__(self):
+        self.metrics = _metrics_for(self.name)
+
+    def execute(self, query: str, max_rows: int, timeout: float, cancellation=None,
+                max_bytes: Optional[int] = None, max_cell_bytes: Optional[int] = None) -> QueryResult:
+        """Run query; at most max_rows rows are read and max_bytes kept (capture.py)"""
+        start_time = time.time()
+        capture = ResultCapture(max_rows, max_bytes, max_cell_bytes)
+        try:
+            self._fetch(query, capture, timeout, cancellation)
+            result = capture.result(round(time.time() - start_time, 3))
+        except BackendError as e:
+            result = QueryResult.failure(str(e), e.error_type, execution_time=round(time.time() - start_time, 3))
+        self.metrics.record(result)
+        return result
+
+    def stream(self, query: str, chunk_rows: int, max_rows: int, timeout: float) -> Iterator[Tuple[str, object]]:
+        """
+        Yield ('header', columns), ('rows', chunk)..., then ('stats', {...}) or
+        ('error', {...}). Default: run once (capped) and replay the result.
+        """
+        result = self.execute(query, max_rows + 1, timeout)
+        if not result.success:
+            yield 'error', {'error': result.error, 'error_type': result.error_type}
+            return
+        rows = result.rows[:max_rows]
+        yield 'header', result.columns
+        for i in range(0, len(rows), chunk_rows):
+            yield 'rows', [list(row) for row in rows[i:i + chunk_rows]]
+        yield 'stats', {
+            'row_count': min(result.row_count, max_rows),
+            'execution_time': result.execution_time,
+            'truncated': result.row_count > max_rows or result.truncated
+        }
+
+    def checksum(self, query: str, timeout: float, cancellation=None) -> Dict:
+        """
+        Row count + order-independent hash of the whole result (SQLExecutor.checksum).
+        Default: every row is read and fingerprinted, none is kept.
+        """
+        result = self.execute(query, FALLBACK_CHECKSUM_MAX_ROWS + 1, timeout, cancellation, max_bytes=0)
+        if result.success and result.row_count > FALLBACK_CHECKSUM_MAX_ROWS:
+            result = QueryResult.failure(f"Result too large to checksum (over {FALLBACK_CHECKSUM_MAX_ROWS} rows)",
+                                         execution_time=result.execution_time)
+        if not result.success:
+            return {
+                'success': False,
+                'error': result.error,
+                'error_type': result.error_type,
+                'columns': [],
+                'row_count': 0,
+                'checksum': None,
+                'execution_time': result.execution_time
+            }
+        return {
+            'success': True,
+            'columns': result.columns,
+            'row_count': result.row_count,
+            'checksum': f"{result.row_count}:{result.fingerprint}",
+            'execution_time': result.execution_time,
+            'error': None
+        }
+
+    def explain(self, query: str, timeout: float) -> Optional[str]:
+        """EXPLAIN FORMAT=JSON document, or None if the plan can't be read (default: no plans)"""
+        return None
+
+    def _fetch(self, query: str, capture: ResultCapture, timeout: float, cancellation):
+        """Run query and feed its columns and rows to capture, or raise BackendError"""
+        raise NotImplementedError
+
+    @staticmethod
+    def _timeout_message(timeout: float) -> str:
+        return f"Query exceeded the time limit of {timeout} seconds"
+
+    @classmethod
+    def _interrupted(cls, e: Exception, cancellation, timeout: float) -> BackendError:
+        """SQLite progress handler abort: cancelled or timed out"""
+        if cancellation is not None and cancellation.cancelled:
+            return BackendError("Query was cancelled", 'cancelled')
+        return BackendError(cls._timeout_message(timeout), 'timeout')
+
+
+class MySQLPoolBackend(ExecutionBackend):
+    """Pooled pymysql connections; MAX_EXECUTION_TIME hint + watchdog KILL QUERY"""
+
+    name = 'mysql'
+    supports_checksum = True
+    supports_explain = True
+
+    def __init__(self, db_config: Dict, read_timeout: int):
+        super().__init__()
+        self.db_config = db_config
+        self.read_timeout = read_timeout
+
+    @property
+    def pool(self):
+        return get_pool(self.db_config, read_timeout=self.read_timeout)
+
+    def _fetch(self, query, capture, timeout, cancellation):
+        watch = None
+        pool = self.pool
+        conn = None
+        finished = False
+        try:
+            # Check out a pooled connection (already switched to this database)
+            conn = pool.acquire(self.db_config['NAME'])
+            with watchdog.watch(conn.raw, pool, timeout, cancellation) as watch:
+                # Unbuffered: only the captured rows are held in memory
+                cursor = conn.raw.cursor(pymysql.cursors.SSCursor)
+                cursor.execute(with_time_limit(query, timeout))
+                capture.start([desc[0] for desc in cursor.description] if cursor.description else [])
+                if capture.fetch_from(cursor):
+                    cursor.close()
+                    finished = True
+        except pymysql.MySQLError as e:
+            # The server ended the statement with an error: the connection is
+            # still usable unless the error was at the connection level
+            finished = not isinstance(e, pymysql.err.OperationalError) or bool(
+                e.args and e.args[0] in SERVER_INTERRUPT_ERRORS)
+            raise self._error(e, watch, timeout)
+        finally:
+            if conn is not None:
+                # Rows left past max_rows: SSCursor.close() would read every one
+                # of them (under the watchdog), so close the connection instead
+                pool.release(conn, discard=not finished)
+
+    def stream(self, query, chunk_rows, max_rows, timeout):
+        """Unbuffered server-side cursor: memory use doesn't depend on the result size"""
+        start_time = time.time()
+        watch = None
+        pool = self.pool
+        conn = None
+        finished = False
+
+        try:
+            # Streams may run longer than the pool's read_timeout (sized for
+            # /execute): a quiet stretch must not drop the connection
+            read_timeout = max(timeout + STREAM_READ_GRACE, self.read_timeout or 0)
+            conn = pool.acquire(self.db_config['NAME'], read_timeout=read_timeout)
+            with watchdog.watch(conn.raw, pool, timeout) as watch:
+                cursor = conn.raw.cursor(pymysql.cursors.SSCursor)
+                cursor.execute(with_time_limit(query, timeout))
+                yield 'header', [desc[0] for desc in cursor.description] if cursor.description else []
+
+                row_count = 0
+                truncated = False
+                while True:
+                    chunk = cursor.fetchmany(min(chunk_rows, max_rows - row_count))
+                    if not chunk:
+                        break
+                    row_count += len(chunk)
+                    yield 'rows', [clip_row(row) for row in chunk]
+                    if row_count >= max_rows:
+                        # Exactly max_rows rows isn't a truncated result
+                        truncated = bool(cursor.fetchmany(1))
+                        break
+
+                if not truncated:
+                    # Fully read: the connection can go back to the pool
+                    cursor.close()
+                    finished = True
+
+                stats = {
+                    'row_count': row_count,
+                    'execution_time': round(time.time() - start_time, 3),
+                    'truncated': truncated
+                }
+            self.metrics.record(QueryResult(True, rows=(), execution_time=stats['execution_time']))
+            yield 'stats', stats
+
+        except pymysql.MySQLError as e:
+            error = self._error(e, watch, timeout)
+            self.metrics.record(QueryResult.failure(str(error), error.error_type, round(time.time() - start_time, 3)))
+            yield 'error', {'error': str(error), 'error_type': error.error_type}
+
+        finally:
+            if conn is not None:
+                # An unbuffered cursor that wasn't read to the end (row cap,
+                # client disconnect, error) leaves the connection mid-result;
+                # close it rather than draining the rest of the rows
+                pool.release(conn, discard=not finished)
+
+    def checksum(self, query, timeout, cancellation=None):
+        """Row count + order-independent hash computed inside MySQL (see checksum.py)"""
+        start_time = time.time()
+        watch = None
+        try:
+            pool = self.pool
+            with pool.connection(self.db_config['NAME']) as connection, \
+                    watchdog.watch(connection, pool, timeout, cancellation) as watch:
+                with connection.cursor() as cursor:
+                    # Column names first (LIMIT 0 probe), then the aggregate
+                    cursor.execute(build_columns_query(query))
+                    columns = [desc[0] for desc in cursor.description] if cursor.description else []
+
+                    cursor.execute(with_time_limit(build_checksum_query(query, columns), timeout))
+                    row_count, hi, lo = cursor.fetchone()
+
+                    return {
+                        'success': True,
+                        'columns': columns,
+                        'row_count': row_count,
+                        'checksum': format_checksum(row_count, hi, lo),
+                        'execution_time': round(time.time() - start_time, 3),
+                        'error': None
+                    }
+        except pymysql.MySQLError as e:
+            # e.g. duplicate column names can't be wrapped in a derived table
+            error = self._error(e, watch, timeout)
+            return {
+                'success': False,
+                'error': str(error),
+                'error_type': error.error_type,
+                'columns': [],
+                'row_count': 0,
+                'checksum': None,
+                'execution_time': round(time.time() - start_time, 3)
+            }
+
+    def explain(self, query, timeout):
+        """Plan only; the statement itself doesn't run, but planning can still be slow"""
+        try:
+            pool = self.pool
+            with pool.connection(self.db_config['NAME']) as connection, \
+                    watchdog.watch(connection, pool, timeout):
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN FORMAT=JSON {with_time_limit(query, timeout)}')
+                    row = cursor.fetchone()
+                    return row[0] if row else None
+        except pymysql.MySQLError:
+            # Syntax errors etc. are reported when the query itself runs
+            return None
+
+    def _error(self, e: Exception, watch, timeout: float) -> BackendError:
+        kind = error_type(e, watch)
+        if kind == 'timeout':
+            return BackendError(self._timeout_message(timeout), kind)
+        if kind == 'cancelled':
+            return BackendError("Query was cancelled", kind)
+        return BackendError(str(e), kind)
+
+
+class DjangoDBBackend(ExecutionBackend):
+    """
+    A Django database connection. Used for databases that aren't configured
+    (local development: the default SQLite database) and for chatsql_system.
+    """
+
+    name = 'django'
+
+    def __init__(self, alias: str = 'default'):
+        super().__init__()
+        self.alias = alias
+
+    def _fetch(self, query, capture, timeout, cancellation):
+        connection = connections[self.alias]
+        deadline = time.monotonic() + timeout
+        raw = None
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'sqlite':
+                    raw = connection.connection
+                    raw.set_progress_handler(_sqlite_interrupt(deadline, cancellation), SQLITE_PROGRESS_STEPS)
+                elif connection.vendor == 'mysql':
+                    query = with_time_limit(query, timeout)
+                cursor.execute(query)
+                capture.start([col[0] for col in cursor.description] if cursor.description else [])
+                capture.fetch_from(cursor)
+        except DatabaseError as e:
+            if str(e) == 'interrupted':
+                raise self._interrupted(e, cancellation, timeout)
+            raise BackendError(str(e), error_type(e))
+        finally:
+            if raw is not None:
+                raw.set_progress_handler(None, 0)
+
+
+class EmbeddedSQLiteBackend(ExecutionBackend):
+    """Private in-memory copy of a DatabaseSchema per statement (sqlite_engine)"""
+
+    name = 'embedded'
+
+    def __init__(self, db_name: str):
+        super().__init__()
+        self.db_name = db_name
+
+    def _fetch(self, query, capture, timeout, cancellation):
+        deadline = time.monotonic() + timeout
+        connection = None
+        try:
+            connection = embedded_engine.clone(self.db_name)
+            connection.set_progress_handler(_sqlite_interrupt(deadline, cancellation), SQLITE_PROGRESS_STEPS)
+            cursor = connection.execute(query)
+            capture.start([desc[0] for desc in cursor.description] if cursor.description else [])
+            capture.fetch_from(cursor)
+        except sqlite3.Error as e:
+            if str(e) == 'interrupted':
+                raise self._interrupted(e, cancellation, timeout)
+            raise BackendError(str(e))
+        except ValueError as e:
+            # Schema deleted since the executor was created
+            raise BackendError(str(e))
+        finally:
+            if connection is not None:
+                connection.close()
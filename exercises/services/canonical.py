@@ -0,0 +1,447 @@
+"""
+Canonical form of simple SELECT queries.
+
+Many correct submissions are the reference solution written differently:
+other formatting, other table aliases, predicates in another order, an
+ORDER BY the grader ignores anyway. canonicalize() parses the common subset of
+SELECT (one query block, inner/outer joins, WHERE / GROUP BY / HAVING /
+ORDER BY / LIMIT, no subqueries or set operations) and rewrites it so
+equivalent spellings produce the same string:
+
+- keywords and function names upper-cased, whitespace and comments dropped
+- table aliases replaced by the table name (t#2, t#3 for repeated tables);
+  qualifiers dropped entirely when there is only one table
+- select items sorted, each labelled with the column name MySQL would return
+  (results are compared by column name, not position)
+- inner joins (comma, JOIN, INNER JOIN, CROSS JOIN) flattened: tables sorted,
+  ON conditions merged into WHERE
+- AND / OR operands sorted; `a = b` and `b = a`, `a < b` and `b > a` the same
+- GROUP BY items sorted; ORDER BY dropped unless there is a LIMIT
+
+Parentheses and CASE ... END are nesting: nothing inside a CASE expression is
+reordered. Anything outside the subset returns None. Every rewrite must keep
+the result the same, since grading accepts a matching form without running
+it; exercises/tests.py checks forms against real results on SQLite.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .sql_lexer import COMMENT, OP, QUOTED_IDENT, SEMICOLON, STRING, UNTERMINATED, WORD, Token, tokenize
+from .sql_normalize import KEYWORDS, normalize_tokens
+
+_CLAUSES = ('SELECT', 'FROM', 'WHERE', 'GROUP', 'HAVING', 'ORDER', 'LIMIT')
+_UNSUPPORTED = frozenset(['UNION', 'INTERSECT', 'EXCEPT', 'INTO', 'WITH', 'FOR', 'WINDOW', 'LOCK', 'NATURAL',
+                          'STRAIGHT_JOIN', 'USE', 'IGNORE', 'FORCE', 'PARTITION', 'LATERAL'])
+_INNER_JOINS = (('JOIN',), ('INNER', 'JOIN'), ('CROSS', 'JOIN'))
+_OUTER_JOINS = (('LEFT', 'JOIN'), ('LEFT', 'OUTER', 'JOIN'), ('RIGHT', 'JOIN'), ('RIGHT', 'OUTER', 'JOIN'))
+_SYMMETRIC = frozenset(['=', '<>', '!=', '<=>'])
+_FLIPPED = {'<': '>', '>': '<', '<=': '>=', '>=': '<='}
+# Boolean operators the AND/OR rewriting doesn't model; such conditions are kept as written
+_OPAQUE_OPERATORS = frozenset(['||', '&&', '!', ':='])
+# Keywords that may appear in a comparison operand without changing how it parses
+_OPERAND_KEYWORDS = frozenset(['NULL', 'TRUE', 'FALSE', 'DIV', 'MOD', 'BINARY'])
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def canonicalize(query: str) -> Optional[str]:
+    """Canonical form of query, or None if it is outside the supported subset"""
+    tokens = [t for t in tokenize(query) if t.type != COMMENT]
+    while tokens and tokens[-1].type == SEMICOLON:
+        tokens.pop()
+    try:
+        return _Query(query, tokens).canonical()
+    except _Unsupported:
+        return None
+
+
+def _is_word(token: Token, *values: str) -> bool:
+    return token.type == WORD and token.upper in values
+
+
+def _is_identifier(token: Token) -> bool:
+    return token.type == QUOTED_IDENT or (token.type == WORD and token.upper not in KEYWORDS)
+
+
+def _unquote(token: Token) -> str:
+    if token.type == QUOTED_IDENT:
+        return token.value[1:-1].replace('``', '`')
+    if token.type == STRING:
+        return token.value[1:-1]
+    return token.value
+
+
+def _opens(token: Token) -> bool:
+    """( and CASE start a nested expression (AND/OR inside it aren't top-level)"""
+    return token.value == '(' or _is_word(token, 'CASE')
+
+
+def _closes(token: Token) -> bool:
+    return token.value == ')' or _is_word(token, 'END')
+
+
+def _split(tokens: Sequence[Token], is_separator) -> List[List[Token]]:
+    """Split at depth-0 tokens for which is_separator(tokens, i) is true"""
+    parts: List[List[Token]] = [[]]
+    depth = 0
+    for i, token in enumerate(tokens):
+        if _opens(token):
+            depth += 1
+        elif _closes(token):
+            depth -= 1
+        elif depth == 0 and is_separator(tokens, i):
+            parts.append([])
+            continue
+        parts[-1].append(token)
+    return parts
+
+
+def _comma(tokens, i) -> bool:
+    return tokens[i].value == ','
+
+
+def _or(tokens, i) -> bool:
+    return _is_word(tokens[i], 'OR')
+
+
+def _and(tokens, i) -> bool:
+    if not _is_word(tokens[i], 'AND'):
+        return False
+    # The AND of `x BETWEEN a AND b` belongs to the BETWEEN
+    depth = 0
+    for token in reversed(tokens[:i]):
+        if _closes(token):
+            depth += 1
+        elif _opens(token):
+            depth -= 1
+        elif depth == 0 and _is_word(token, 'AND', 'OR'):
+            return True
+        elif depth == 0 and _is_word(token, 'BETWEEN'):
+            return False
+    return True
+
+
+def _wrapped(tokens: Sequence[Token]) -> bool:
+    """tokens is one parenthesized group: ( ... )"""
+    if len(tokens) < 2 or tokens[0].value != '(' or tokens[-1].value != ')':
+        return False
+    depth = 0
+    for i, token in enumerate(tokens):
+        if token.value == '(':
+            depth += 1
+        elif token.value == ')':
+            depth -= 1
+            if depth == 0 and i != len(tokens) - 1:
+                return False
+    return True
+
+
+def _has_top_level(tokens: Sequence[Token], predicate) -> bool:
+    depth = 0
+    for token in tokens:
+        if _opens(token):
+            depth += 1
+        elif _closes(token):
+            depth -= 1
+        elif depth == 0 and predicate(token):
+            return True
+    return False
+
+
+def _plain_operand(tokens: Sequence[Token]) -> bool:
+    """Operand of a comparison that binds tighter than the comparison itself"""
+    return bool(tokens) and not _has_top_level(tokens, lambda t: (
+        (t.type == WORD and t.upper in KEYWORDS and t.upper not in _OPERAND_KEYWORDS)
+        or t.value in _OPAQUE_OPERATORS
+    ))
+
+
+def _ends_operand(token: Token) -> bool:
+    """token can end an expression, so an identifier after it is an alias"""
+    if token.type == OP:
+        return token.value == ')'
+    if token.type == WORD and token.upper in KEYWORDS:
+        return token.upper in ('END', 'NULL', 'TRUE', 'FALSE')
+    return True
+
+
+class _Query:
+    def __init__(self, query: str, tokens: List[Token]):
+        self.query = query
+        self.tokens = tokens
+        self.tables: List[str] = []          # canonical name per table reference
+        self.aliases: Dict[str, str] = {}    # alias / table name -> canonical name
+
+    def canonical(self) -> str:
+        clauses = self._clauses()
+        joins, on_conditions = self._from(clauses.get('FROM', []))
+        single_table = len(self.tables) == 1
+
+        select = clauses['SELECT']
+        distinct = bool(select) and _is_word(select[0], 'DISTINCT')
+        if distinct:
+            select = select[1:]
+        items = [self._select_item(item, single_table) for item in _split(select, _comma)]
+        names = [name for name, _ in items]
+        if len(set(names)) != len(names):
+            raise _Unsupported()  # same-named columns are matched by position
+        items = sorted(text for _, text in items)
+
+        parts = ['SELECT ' + ('DISTINCT ' if distinct else '') + ', '.join(items)]
+        if joins:
+            parts.append('FROM ' + joins)
+        conditions = on_conditions + (self._conjuncts(clauses['WHERE'], single_table) if 'WHERE' in clauses else [])
+        if conditions:
+            parts.append('WHERE ' + ' AND '.join(sorted(conditions)))
+        if 'GROUP' in clauses:
+            items = [self._expr(item, single_table) for item in _split(self._by(clauses['GROUP']), _comma)]
+            parts.append('GROUP BY ' + ', '.join(sorted(items)))
+        if 'HAVING' in clauses:
+            parts.append('HAVING ' + ' AND '.join(sorted(self._conjuncts(clauses['HAVING'], single_table))))
+        if 'LIMIT' in clauses:
+            # Row order only matters when it decides which rows are returned
+            if 'ORDER' in clauses:
+                parts.append('ORDER BY ' + self._expr(self._by(clauses['ORDER']), single_table))
+            parts.append('LIMIT ' + self._expr(clauses['LIMIT'], single_table))
+        return ' '.join(parts)
+
+    # Clauses
+
+    def _clauses(self) -> Dict[str, List[Token]]:
+        tokens = self.tokens
+        if not tokens or not _is_word(tokens[0], 'SELECT'):
+            raise _Unsupported()
+        clauses: Dict[str, List[Token]] = {}
+        current = None
+        depth = 0
+        for i, token in enumerate(tokens):
+            kind = token.type
+            if kind == SEMICOLON or kind == UNTERMINATED:
+                raise _Unsupported()
+            if _opens(token):
+                depth += 1
+            elif _closes(token):
+                depth -= 1
+            elif kind == WORD:
+                upper = token.upper
+                if upper in _UNSUPPORTED or (upper == 'SELECT' and i > 0):
+                    raise _Unsupported()  # subqueries, set operations, hints
+                if depth == 0 and upper in _CLAUSES:
+                    if upper in clauses:
+                        raise _Unsupported()
+                    current = upper
+                    clauses[current] = []
+                    continue
+            clauses[current].append(token)
+        if depth != 0:
+            raise _Unsupported()
+        return clauses
+
+    @staticmethod
+    def _by(tokens: List[Token]) -> List[Token]:
+        if not tokens or not _is_word(tokens[0], 'BY'):
+            raise _Unsupported()
+        return tokens[1:]
+
+    # FROM
+
+    def _from(self, tokens: List[Token]) -> Tuple[str, List[str]]:
+        """(canonical FROM clause, ON conditions to merge into WHERE)"""
+        if not tokens:
+            return '', []
+        refs: List[Tuple[str, List[Token], List[Token]]] = []  # (join type, table tokens, ON tokens)
+        join = ','
+        i = 0
+        while i < len(tokens):
+            start = i
+            while i < len(tokens) and tokens[i].value != ',' and not self._join_at(tokens, i) \
+                    and not _is_word(tokens[i], 'ON', 'USING'):
+                i += 1
+            table = tokens[start:i]
+            on: List[Token] = []
+            if i < len(tokens) and _is_word(tokens[i], 'USING'):
+                raise _Unsupported()
+            if i < len(tokens) and _is_word(tokens[i], 'ON'):
+                i += 1
+                start = i
+                depth = 0
+                while i < len(tokens):
+                    if _opens(tokens[i]):
+                        depth += 1
+                    elif _closes(tokens[i]):
+                        depth -= 1
+                    elif depth == 0 and (tokens[i].value == ',' or self._join_at(tokens, i)):
+                        break
+                    i += 1
+                on = tokens[start:i]
+            refs.append((join, table, on))
+            if i < len(tokens):
+                if tokens[i].value == ',':
+                    join = ','
+                    i += 1
+                else:
+                    words = self._join_at(tokens, i)
+                    join = ' '.join(words)
+                    i += len(words)
+
+        joins = {join for join, _, _ in refs[1:]}
+        if ',' in joins and len(joins) > 1:
+            # The comma binds looser than JOIN: `t1, t2 JOIN t3 ON t1.x = t3.x` is
+            # t1, (t2 JOIN t3), whose ON can't see t1 (an error in MySQL)
+            raise _Unsupported()
+
+        names = []
+        for _, table, _ in refs:
+            names.append(self._table(table))
+        counts: Dict[str, int] = {}
+        for name, alias in names:
+            counts[name] = counts.get(name, 0) + 1
+        seen: Dict[str, int] = {}
+        for name, alias in names:
+            if counts[name] > 1:
+                seen[name] = seen.get(name, 0) + 1
+                canonical = f"{name}#{seen[name]}"
+            else:
+                canonical = name
+            self.tables.append(canonical)
+            key = alias or name
+            if key in self.aliases:
+                raise _Unsupported()  # ambiguous reference
+            self.aliases[key] = canonical
+        single_table = len(self.tables) == 1
+
+        inner = all(join == ',' or tuple(join.split()) in _INNER_JOINS for join, _, _ in refs)
+        if inner:
+            conditions = []
+            for _, _, on in refs:
+                if on:
+                    conditions.extend(self._conjuncts(on, single_table))
+            return ', '.join(sorted(self.tables)), conditions
+        # Outer joins: order and ON placement matter, keep the structure
+        parts = []
+        for (join, _, on), canonical in zip(refs, self.tables):
+            if parts:
+                parts.append(', ' if join == ',' else f' {join} ')
+            parts.append(canonical)
+            if on:
+                parts.append(' ON ' + ' AND '.join(sorted(self._conjuncts(on, single_table))))
+        return ''.join(parts), []
+
+    @staticmethod
+    def _join_at(tokens: List[Token], i: int) -> Tuple[str, ...]:
+        for words in _INNER_JOINS + _OUTER_JOINS:
+            if all(i + k < len(tokens) and _is_word(tokens[i + k], w) for k, w in enumerate(words)):
+                return words
+        return ()
+
+    @staticmethod
+    def _table(tokens: List[Token]) -> Tuple[str, Optional[str]]:
+        """(table name, alias) of `name [AS] [alias]`"""
+        if tokens and _is_identifier(tokens[0]):
+            name = _unquote(tokens[0])
+            rest = tokens[1:]
+            if len(rest) == 2 and _is_word(rest[0], 'AS') and _is_identifier(rest[1]):
+                return name, _unquote(rest[1])
+            if len(rest) == 1 and _is_identifier(rest[0]):
+                return name, _unquote(rest[0])
+            if not rest:
+                return name, None
+        raise _Unsupported()
+
+    # Expressions
+
+    def _select_item(self, tokens: List[Token], single_table: bool) -> Tuple[str, str]:
+        """(column name, canonical text)"""
+        if not tokens:
+            raise _Unsupported()
+        alias = None
+        if len(tokens) >= 3 and _is_word(tokens[-2], 'AS') and (_is_identifier(tokens[-1]) or tokens[-1].type == STRING):
+            alias, tokens = _unquote(tokens[-1]), tokens[:-2]
+        elif len(tokens) >= 2 and _is_identifier(tokens[-1]) and _ends_operand(tokens[-2]):
+            alias, tokens = _unquote(tokens[-1]), tokens[:-1]
+        if alias is None:
+            alias = self._column_name(tokens)
+        return alias, f"{self._expr(tokens, single_table)} AS `{alias}`"
+
+    def _column_name(self, tokens: List[Token]) -> str:
+        """Name MySQL gives an unaliased select item"""
+        if len(tokens) == 1 and _is_identifier(tokens[0]):
+            return _unquote(tokens[0])
+        if len(tokens) == 3 and _is_identifier(tokens[0]) and tokens[1].value == '.' and _is_identifier(tokens[2]):
+            return _unquote(tokens[2])
+        if any(t.value == '*' for t in tokens) and len(tokens) in (1, 3):
+            return '*'
+        # Expressions are named after their source text
+        last = tokens[-1]
+        return self.query[tokens[0].start:last.start + len(last.value)]
+
+    def _expr(self, tokens: Sequence[Token], single_table: bool) -> str:
+        """Normalized text with table references replaced by their canonical names"""
+        out: List[Token] = []
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if i + 1 < len(tokens) and tokens[i + 1].value == '.' and _is_identifier(token) \
+                    and (not out or out[-1].value != '.'):
+                canonical = self.aliases.get(_unquote(token))
+                if canonical is None:
+                    raise _Unsupported()  # db.table.column or unknown qualifier
+                if not single_table:
+                    out.append(Token(QUOTED_IDENT, f"`{canonical}`", token.start))
+                    out.append(tokens[i + 1])
+                i += 2
+                continue
+            if token.type == QUOTED_IDENT:
+                inner = _unquote(token)
+                if inner.isidentifier() and inner.upper() not in KEYWORDS:
+                    token = Token(WORD, inner, token.start)
+            out.append(token)
+            i += 1
+        return normalize_tokens(out)
+
+    def _conjuncts(self, tokens: List[Token], single_table: bool) -> List[str]:
+        """Canonical AND operands (nested ANDs flattened)"""
+        if not tokens:
+            raise _Unsupported()
+        if _has_top_level(tokens, lambda t: _is_word(t, 'XOR') or t.value in _OPAQUE_OPERATORS):
+            return [self._expr(tokens, single_table)]
+        # OR binds loosest
+        disjuncts = _split(tokens, _or)
+        if len(disjuncts) > 1:
+            alternatives = sorted(' AND '.join(sorted(self._conjuncts(d, single_table))) for d in disjuncts)
+            return ['(' + ' OR '.join(f'({a})' for a in alternatives) + ')']
+        result: List[str] = []
+        for part in _split(tokens, _and):
+            if _wrapped(part):
+                result.extend(self._conjuncts(part[1:-1], single_table))
+            else:
+                result.append(self._comparison(part, single_table))
+        return result
+
+    def _comparison(self, tokens: List[Token], single_table: bool) -> str:
+        depth = 0
+        operators = []
+        for i, token in enumerate(tokens):
+            if _opens(token):
+                depth += 1
+            elif _closes(token):
+                depth -= 1
+            elif depth == 0 and token.type == OP and (token.value in _SYMMETRIC or token.value in _FLIPPED):
+                operators.append(i)
+        if len(operators) != 1:
+            return self._expr(tokens, single_table)
+        i = operators[0]
+        if not (_plain_operand(tokens[:i]) and _plain_operand(tokens[i + 1:])):
+            # e.g. `a = b IS NULL` is `(a = b) IS NULL`: don't reorder it
+            return self._expr(tokens, single_table)
+        op = tokens[i].value
+        left = self._expr(tokens[:i], single_table)
+        right = self._expr(tokens[i + 1:], single_table)
+        if op == '!=':
+            op = '<>'
+        if op in _SYMMETRIC:
+            left, right = sorted((left, right))
+        elif right < left:
+            left, right, op = right, left, _FLIPPED[op]
+        return f"{left} {op} {right}"
@@ -0,0 +1,138 @@
+"""
+Byte-budgeted result capture.
+
+MAX_ROWS caps rows, not bytes: `SELECT *` over LONGTEXT/BLOB columns could
+still push megabytes per request through Python and JSON. Backends feed
+fetched chunks into a ResultCapture, which
+
+- clips every cell to max_cell_bytes, with a truncation marker
+- stops keeping rows once max_bytes are captured (the result says
+  truncated: true; row_count is still the number of rows the query produced)
+- fingerprints every row on its original values, so grading is unaffected by
+  what was kept for display
+
+Rows are still read up to max_rows, so memory per request is bounded by
+max_bytes (plus one fetch chunk) whatever the schema contains.
+"""
+from typing import List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .fingerprint import ResultFingerprint
+from .result import QueryResult
+
+MAX_RESULT_BYTES = getattr(settings, 'SQL_RESULT_MAX_BYTES', 4 * 1024 * 1024)
+MAX_CELL_BYTES = getattr(settings, 'SQL_RESULT_MAX_CELL_BYTES', 16 * 1024)
+
+# Rows per fetchmany() while capturing
+FETCH_CHUNK_ROWS = 200
+
+TRUNCATION_MARKER = '… [truncated, {size} bytes]'
+
+# Rough size of a cell that isn't text or binary (numbers, dates, NULL)
+_SCALAR_BYTES = 8
+
+
+def cell_size(value) -> int:
+    if isinstance(value, str):
+        return len(value) if value.isascii() else len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return _SCALAR_BYTES
+
+
+def clip_cell(value, max_bytes: int):
+    """value cut to max_bytes plus a marker; (value, clipped)"""
+    size = cell_size(value)
+    if size <= max_bytes:
+        return value, False
+    marker = TRUNCATION_MARKER.format(size=size)
+    if isinstance(value, str):
+        head = value.encode('utf-8')[:max_bytes].decode('utf-8', 'ignore')
+        return head + marker, True
+    return bytes(value[:max_bytes]) + marker.encode('utf-8'), True
+
+
+def clip_row(row: Sequence, max_cell_bytes: int = MAX_CELL_BYTES) -> List:
+    """Row as a list with every cell clipped (streaming)"""
+    return [clip_cell(value, max_cell_bytes)[0] for value in row]
+
+
+class ResultCapture:
+    """Accumulates one result within the row/byte budget"""
+
+    __slots__ = ('max_rows', 'max_bytes', 'max_cell_bytes', 'columns', 'rows',
+                 'row_count', 'bytes', 'truncated', '_exhausted', '_fingerprint')
+
+    def __init__(self, max_rows: int, max_bytes: Optional[int] = None, max_cell_bytes: Optional[int] = None):
+        self.max_rows = max_rows
+        self.max_bytes = MAX_RESULT_BYTES if max_bytes is None else max_bytes
+        self.max_cell_bytes = MAX_CELL_BYTES if max_cell_bytes is None else max_cell_bytes
+        self.columns: List[str] = []
+        self.rows: List[Tuple] = []
+        self.row_count = 0
+        self.bytes = 0
+        self.truncated = False
+        self._exhausted = False
+        self._fingerprint = ResultFingerprint(())
+
+    def start(self, columns: Sequence[str]):
+        self.columns = list(columns)
+        self._fingerprint = ResultFingerprint(self.columns)
+
+    @property
+    def remaining(self) -> int:
+        """Rows still wanted (0: stop fetching)"""
+        return self.max_rows - self.row_count
+
+    def add_rows(self, rows: Sequence[Sequence]) -> bool:
+        """Add a fetched chunk; False once max_rows rows have been seen"""
+        fingerprint = self._fingerprint
+        for row in rows[:self.remaining]:
+            fingerprint.add_row(row)
+            self.row_count += 1
+            if self._exhausted:
+                continue  # budget spent: only counted and fingerprinted
+            size = 0
+            clipped = None
+            for i, value in enumerate(row):
+                n = cell_size(value)
+                if n > self.max_cell_bytes:
+                    if clipped is None:
+                        clipped = list(row)
+                    clipped[i], _ = clip_cell(value, self.max_cell_bytes)
+                    n = self.max_cell_bytes
+                    self.truncated = True
+                size += n
+            if self.bytes + size > self.max_bytes:
+                self._exhausted = True
+                self.truncated = True
+                continue
+            self.bytes += size
+            self.rows.append(tuple(clipped) if clipped is not None else row)
+        return self.remaining > 0
+
+    def fetch_from(self, cursor, chunk_rows: int = FETCH_CHUNK_ROWS):
+        """
+        Read a DB-API cursor in chunks until it is exhausted or max_rows is
+        reached; True if the cursor was read to the end
+        """
+        while self.remaining > 0:
+            chunk = cursor.fetchmany(min(chunk_rows, self.remaining))
+            if not chunk:
+                return True
+            if not self.add_rows(chunk):
+                break
+        # Exactly max_rows rows, or more? One more read tells (and ends an exhausted result)
+        return not cursor.fetchmany(1)
+
+    def result(self, execution_time: float) -> QueryResult:
+        return QueryResult(
+            True,
+            columns=self.columns,
+            rows=self.rows,
+            execution_time=execution_time,
+            fingerprint=self._fingerprint.hexdigest(),
+            row_count=self.row_count,
+            truncated=self.truncated
+        )
@@ -0,0 +1,260 @@
+"""
+In-process problem catalog.
+
+Every detail / execute / submit / AI request needs its problem from
+chatsql_system.problems, and problems change rarely. The catalog loads all of
+them once and serves by-id lookups from memory as immutable records
+(read-only mappings with the same keys get_problem_from_gcp always returned).
+
+Freshness:
+- a full reload every PROBLEM_CATALOG_TTL seconds
+- in between, at most once per PROBLEM_CATALOG_PROBE_INTERVAL seconds, a
+  cheap version probe (COUNT(*), MAX(id), MAX(created_at)); a changed
+  version triggers a reload. problems has no updated_at column, so edits to
+  existing rows made by other processes are picked up by the TTL.
+- saving/deleting a Problem in this process invalidates right away
+  (models.py), as does a write through the instructor AI (ai_tutor).
+
+Each loaded version is a CatalogSnapshot indexed by id, difficulty and tag,
+so list filters and keyset pages (page()) don't scan the whole catalog.
+
+load_problem_tables() fetches the problem_tables rows of any number of
+problems in one IN (...) query, so list pages don't do a lookup per problem.
+"""
+import bisect
+import logging
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+
+from chatsql.routers import system_cursor
+
+logger = logging.getLogger(__name__)
+
+PROBLEM_COLUMNS = ('id, title, difficulty, tag, description, database_name, '
+                   'expected_query, expected_result, created_at')
+TABLE_COLUMNS = 'problem_id, table_name, table_schema, sample_data, display_order'
+
+
+def problem_record(row) -> Mapping:
+    """Read-only problem dict for a `SELECT PROBLEM_COLUMNS FROM problems` row"""
+    return MappingProxyType({
+        'id': row[0],
+        'title': row[1],
+        'difficulty': row[2].lower() if row[2] else 'easy',  # Convert Easy -> easy
+        'tag': row[3] or '',
+        'description': row[4] or '',
+        'database_name': row[5] or '',
+        'expected_query': row[6] or '',
+        'expected_result': row[7],
+        'created_at': row[8]
+    })
+
+
+def load_problem_tables(problem_ids: Iterable) -> Dict[int, List[Dict]]:
+    """problem_tables rows (ordered by display_order) of many problems in one query, by problem id"""
+    ids = list(dict.fromkeys(int(problem_id) for problem_id in problem_ids))
+    tables: Dict[int, List[Dict]] = {problem_id: [] for problem_id in ids}
+    if not ids:
+        return tables
+    placeholders = ', '.join(['%s'] * len(ids))
+    with system_cursor() as cursor:
+        cursor.execute(
+            f'SELECT {TABLE_COLUMNS} FROM problem_tables '
+            f'WHERE problem_id IN ({placeholders}) ORDER BY problem_id, display_order',
+            ids
+        )
+        for row in cursor.fetchall():
+            tables[row[0]].append({
+                'table_name': row[1],
+                'table_schema': row[2],
+                'sample_data': row[3],
+                'display_order': row[4]
+            })
+    return tables
+
+
+class ProblemPage(NamedTuple):
+    problems: Tuple[Mapping, ...]
+    total: int                  # problems matching the filters
+    next_after_id: Optional[int]  # None on the last page
+
+
+class CatalogSnapshot:
+    """One loaded version of the catalog with its lookup indexes (never modified)"""
+
+    # Filtered id lists kept per (difficulty, tag); tags are free text, so bounded
+    MAX_FILTERS = 256
+
+    def __init__(self, problems: Tuple[Mapping, ...]):
+        self.problems = problems
+        self.ids = [p['id'] for p in problems]
+        self.by_id = dict(zip(self.ids, problems))
+        self.by_difficulty: Dict[str, List[Mapping]] = {}
+        self.by_tag: Dict[str, List[Mapping]] = {}
+        for problem in problems:
+            self.by_difficulty.setdefault(problem['difficulty'], []).append(problem)
+            self.by_tag.setdefault(problem['tag'].lower(), []).append(problem)
+        self._filtered: Dict[Tuple[str, str], Tuple[Tuple[Mapping, ...], List[int]]] = {}
+
+    def filter(self, difficulty: str = '', tag: str = '') -> Tuple[Tuple[Mapping, ...], List[int]]:
+        """
+        (problems, their ids) ordered by id: difficulty matches exactly and tag
+        is a substring of the problem's tag (both case-insensitive)
+        """
+        key = ((difficulty or '').lower(), (tag or '').lower())
+        cached = self._filtered.get(key)
+        if cached is not None:
+            return cached
+        difficulty, tag = key
+        if tag:
+            # Distinct tags are few; only the matching groups are visited
+            matched = sorted((p for name, group in self.by_tag.items() if tag in name for p in group),
+                             key=lambda p: p['id'])
+            if difficulty:
+                matched = [p for p in matched if p['difficulty'] == difficulty]
+        elif difficulty:
+            matched = self.by_difficulty.get(difficulty, [])
+        else:
+            matched = self.problems
+        problems = tuple(matched)
+        cached = (problems, [p['id'] for p in problems])
+        if len(self._filtered) < self.MAX_FILTERS:
+            self._filtered[key] = cached
+        return cached
+
+    def page(self, difficulty: str = '', tag: str = '', after_id: Optional[int] = None,
+             limit: Optional[int] = None) -> ProblemPage:
+        """Keyset page of filter(): up to limit problems with id > after_id"""
+        problems, ids = self.filter(difficulty, tag)
+        start = bisect.bisect_right(ids, after_id) if after_id is not None else 0
+        end = len(problems) if limit is None else min(start + limit, len(problems))
+        next_after_id = ids[end - 1] if end < len(problems) and end > start else None
+        return ProblemPage(problems[start:end], len(problems), next_after_id)
+
+
+class ProblemCatalog:
+    """Thread-safe in-memory copy of chatsql_system.problems"""
+
+    def __init__(self, ttl: float = 300, probe_interval: float = 5):
+        self.ttl = ttl
+        self.probe_interval = probe_interval
+        self._snapshot = CatalogSnapshot(())
+        self._version: Optional[Tuple] = None
+        self._expires_at = 0.0      # next full reload
+        self._probe_at = 0.0        # next version probe
+        self._stale = True
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.probes = 0
+
+    def get(self, problem_id) -> Optional[Mapping]:
+        try:
+            problem_id = int(problem_id)
+        except (TypeError, ValueError):
+            return None
+        self._refresh()
+        return self._snapshot.by_id.get(problem_id)
+
+    def all(self) -> Tuple[Mapping, ...]:
+        """All problems ordered by id"""
+        self._refresh()
+        return self._snapshot.problems
+
+    def filter(self, difficulty: str = '', tag: str = '') -> Tuple[Mapping, ...]:
+        """Problems of a difficulty and/or containing tag, ordered by id"""
+        self._refresh()
+        return self._snapshot.filter(difficulty, tag)[0]
+
+    def page(self, difficulty: str = '', tag: str = '', after_id: Optional[int] = None,
+             limit: Optional[int] = None) -> ProblemPage:
+        """Keyset page of filter(): up to limit problems with id > after_id"""
+        self._refresh()
+        return self._snapshot.page(difficulty, tag, after_id, limit)
+
+    def snapshot(self) -> CatalogSnapshot:
+        """Current version; a new object whenever the catalog changes"""
+        self._refresh()
+        return self._snapshot
+
+    def peek(self, problem_id) -> Optional[Mapping]:
+        """Current record if the catalog is loaded; never touches the database"""
+        return self._snapshot.by_id.get(problem_id)
+
+    def replace(self, problem_id, **fields):
+        """Swap in a copy of a loaded record with fields changed (this process wrote them)"""
+        with self._lock:
+            snapshot = self._snapshot
+            record = snapshot.by_id.get(problem_id)
+            if record is None:
+                return
+            record = MappingProxyType({**record, **fields})
+            self._snapshot = CatalogSnapshot(tuple(record if p['id'] == problem_id else p
+                                                   for p in snapshot.problems))
+
+    def invalidate(self):
+        """Reload on the next lookup"""
+        with self._lock:
+            self._stale = True
+
+    def _refresh(self):
+        now = time.monotonic()
+        if not self._stale and now < self._probe_at:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not self._stale and now < self._probe_at:
+                return
+            if self._stale or now >= self._expires_at:
+                self._load(now)
+                return
+            self._probe_at = now + self.probe_interval
+            version = self._probe()
+            if version is not None and version != self._version:
+                self._load(now)
+
+    def _load(self, now: float):
+        with system_cursor() as cursor:
+            version = self._read_version(cursor)
+            cursor.execute(f'SELECT {PROBLEM_COLUMNS} FROM problems ORDER BY id')
+            records = tuple(problem_record(row) for row in cursor.fetchall())
+        # Readers see either the old or the new snapshot, never a half-built one
+        self._snapshot = CatalogSnapshot(records)
+        self._version = version
+        self._stale = False
+        self._expires_at = now + self.ttl
+        self._probe_at = now + self.probe_interval
+        self.loads += 1
+
+    def _probe(self) -> Optional[Tuple]:
+        self.probes += 1
+        try:
+            with system_cursor() as cursor:
+                return self._read_version(cursor)
+        except Exception as e:
+            # Keep serving the loaded catalog; the TTL still bounds staleness
+            logger.warning(f"Problem catalog version probe failed: {e}")
+            return None
+
+    @staticmethod
+    def _read_version(cursor) -> Tuple:
+        cursor.execute('SELECT COUNT(*), MAX(id), MAX(created_at) FROM problems')
+        return tuple(cursor.fetchone())
+
+    def stats(self) -> Dict:
+        return {
+            'problems': len(self._snapshot.problems),
+            'loads': self.loads,
+            'probes': self.probes,
+            'ttl': self.ttl,
+            'probe_interval': self.probe_interval,
+        }
+
+
+problem_catalog = ProblemCatalog(
+    ttl=getattr(settings, 'PROBLEM_CATALOG_TTL', 300),
+    probe_interval=getattr(settings, 'PROBLEM_CATALOG_PROBE_INTERVAL', 5),
+)
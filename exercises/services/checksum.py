@@ -0,0 +1,58 @@
+"""
+Server-side result checksums.
+
+Wraps a SELECT in an aggregate that MySQL evaluates itself, so grading
+receives one row per query no matter how large the result is:
+
+    SELECT COUNT(*), SUM(<hi 64 bits of row md5>), SUM(<lo 64 bits of row md5>)
+    FROM (<query>) AS _chatsql_q
+
+Each row is hashed on its columns in name order (same alignment as
+fingerprint.py), with NULL mapped to a marker distinct from any string.
+Summing row hashes is order-independent but keeps duplicate rows; SUM over
+BIGINT UNSIGNED returns DECIMAL, so it does not overflow.
+
+Checksums are computed with MySQL's own CAST(... AS CHAR) canonicalization,
+so they are only comparable with other server-side checksums, never with the
+Python fingerprints.
+"""
+from typing import Sequence
+
+from .fingerprint import column_order
+
+ALIAS = '_chatsql_q'
+
+
+def strip_statement(query: str) -> str:
+    """Remove the optional trailing semicolon so the query can be nested"""
+    query = query.strip()
+    if query.endswith(';'):
+        query = query[:-1].rstrip()
+    return query
+
+
+def quote_identifier(name: str) -> str:
+    return '`' + name.replace('`', '``') + '`'
+
+
+def build_columns_query(query: str) -> str:
+    """Zero-row probe that yields the column names of query"""
+    return f"SELECT * FROM ({strip_statement(query)}) AS {ALIAS} LIMIT 0"
+
+
+def build_checksum_query(query: str, columns: Sequence[str]) -> str:
+    cells = ', '.join(
+        f"IFNULL(CAST({ALIAS}.{quote_identifier(columns[i])} AS CHAR), X'00')"
+        for i in column_order(columns)
+    )
+    row_md5 = f"MD5(CONCAT_WS(CHAR(31), {cells}))" if cells else "MD5('')"
+    return (
+        f"SELECT COUNT(*), "
+        f"SUM(CAST(CONV(LEFT({row_md5}, 16), 16, 10) AS UNSIGNED)), "
+        f"SUM(CAST(CONV(RIGHT({row_md5}, 16), 16, 10) AS UNSIGNED)) "
+        f"FROM ({strip_statement(query)}) AS {ALIAS}"
+    )
+
+
+def format_checksum(row_count: int, hi, lo) -> str:
+    return f"{row_count}:{hi or 0}:{lo or 0}"
@@ -0,0 +1,222 @@
+"""
+EXPLAIN-based cost guard.
+
+Accidental cartesian products (`FROM a, b, c` without a join condition) run
+until the time limit. Before a student query runs on MySQL, its
+`EXPLAIN FORMAT=JSON` plan is read on the pooled connection and the number of
+rows the optimizer expects to examine is estimated:
+
+- SQL_COST_GUARD_MODE = 'reject': queries above SQL_COST_GUARD_MAX_ROWS fail
+  with an explanation instead of running
+- 'warn': they run, and the result carries a 'warning'
+- 'off': no EXPLAIN at all
+
+Estimates are cached by (database, data version, normalized SQL), so repeated
+queries don't pay for the EXPLAIN round trip. Reference solutions are trusted
+and never checked.
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from .data_version import get_data_version, on_data_version_change
+from .sql_normalize import fingerprint
+
+MODES = ('reject', 'warn', 'off')
+
+# Sub-plans that are walked like any other node
+_SCALAR_KEYS = frozenset(['cost_info', 'used_columns', 'possible_keys', 'key', 'used_key_parts', 'ref'])
+
+
+class CostEstimate:
+    """Rows the optimizer expects to examine (None: no usable plan)"""
+
+    __slots__ = ('rows', 'unjoined_tables')
+
+    def __init__(self, rows: Optional[float], unjoined_tables: Tuple[str, ...] = ()):
+        self.rows = rows
+        self.unjoined_tables = unjoined_tables
+
+
+class CostVerdict:
+    """A query above the ceiling; rejected, or allowed with a warning"""
+
+    __slots__ = ('rejected', 'message', 'estimated_rows')
+
+    def __init__(self, rejected: bool, message: str, estimated_rows: float):
+        self.rejected = rejected
+        self.message = message
+        self.estimated_rows = estimated_rows
+
+
+def explain_key(db_name: str, query: str) -> Tuple[str, str, int]:
+    """(database, data version, sql_normalize fingerprint)"""
+    return db_name, get_data_version(db_name), fingerprint(query)
+
+
+def estimate_from_plan(plan) -> CostEstimate:
+    """Estimate rows examined from an EXPLAIN FORMAT=JSON document (str or dict)"""
+    if isinstance(plan, (str, bytes)):
+        try:
+            plan = json.loads(plan)
+        except ValueError:
+            return CostEstimate(None)
+    if not isinstance(plan, dict):
+        return CostEstimate(None)
+    unjoined: List[str] = []
+    rows = _walk(plan, unjoined)
+    return CostEstimate(rows, tuple(dict.fromkeys(unjoined)))
+
+
+def _walk(node, unjoined: List[str]) -> float:
+    if isinstance(node, list):
+        return sum(_walk(item, unjoined) for item in node)
+    if not isinstance(node, dict):
+        return 0.0
+    if 'nested_loop' in node:
+        total = _nested_loop(node['nested_loop'], unjoined)
+    elif isinstance(node.get('table'), dict):
+        total = _nested_loop([node], unjoined)
+    else:
+        total = 0.0
+    for key, value in node.items():
+        if key not in ('nested_loop', 'table') and key not in _SCALAR_KEYS:
+            total += _walk(value, unjoined)
+    return total
+
+
+def _nested_loop(items, unjoined: List[str]) -> float:
+    """Each table is scanned once per row produced by the tables before it"""
+    examined = 0.0
+    prefix = 1.0
+    for position, item in enumerate(items):
+        table = item.get('table') if isinstance(item, dict) else None
+        if not isinstance(table, dict):
+            examined += _walk(item, unjoined)
+            continue
+        per_scan = _number(table.get('rows_examined_per_scan'))
+        examined += prefix * per_scan
+        produced = table.get('rows_produced_per_join')
+        prefix = _number(produced) if produced is not None else prefix * per_scan
+        if position > 0 and table.get('access_type') == 'ALL' and 'attached_condition' not in table:
+            # Full scan joined with no condition at all: a cartesian product
+            unjoined.append(table.get('table_name', '?'))
+        # Derived tables / subqueries attached to this table
+        examined += _walk({k: v for k, v in table.items() if k not in _SCALAR_KEYS}, unjoined)
+    return examined
+
+
+def _number(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class CostGuard:
+    """Thread-safe EXPLAIN estimate cache + the reject/warn decision"""
+
+    def __init__(self, mode: str = 'reject', max_rows: float = 10_000_000, cache_size: int = 4096):
+        if mode not in MODES:
+            raise ValueError(f"SQL_COST_GUARD_MODE must be one of {', '.join(MODES)}")
+        self.mode = mode
+        self.max_rows = max_rows
+        self.cache_size = cache_size
+        self._entries: 'OrderedDict[Tuple, CostEstimate]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.warned = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'off'
+
+    def check(self, backend, db_name: str, query: str, timeout: float) -> Optional[CostVerdict]:
+        """Verdict for a validated query, or None if it may run as is"""
+        if not self.enabled or not getattr(backend, 'supports_explain', False):
+            return None
+        key = explain_key(db_name, query)
+        estimate = self.get(key)
+        if estimate is None:
+            estimate = self.put(key, backend.explain(query, timeout))
+        return self.judge(estimate)
+
+    def get(self, key: Tuple) -> Optional[CostEstimate]:
+        with self._lock:
+            estimate = self._entries.get(key)
+            if estimate is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return estimate
+
+    def put(self, key: Tuple, plan) -> CostEstimate:
+        """Cache the estimate for an EXPLAIN plan (None: EXPLAIN failed)"""
+        estimate = estimate_from_plan(plan) if plan is not None else CostEstimate(None)
+        with self._lock:
+            self._entries[key] = estimate
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.cache_size:
+                self._entries.popitem(last=False)
+        return estimate
+
+    def judge(self, estimate: CostEstimate) -> Optional[CostVerdict]:
+        if estimate.rows is None or estimate.rows <= self.max_rows:
+            return None
+        rejected = self.mode == 'reject'
+        with self._lock:
+            if rejected:
+                self.rejected += 1
+            else:
+                self.warned += 1
+        return CostVerdict(rejected, self._message(estimate, rejected), estimate.rows)
+
+    def _message(self, estimate: CostEstimate, rejected: bool) -> str:
+        lead = "This query was not run" if rejected else "This query may be very slow"
+        message = (f"{lead}: MySQL estimates it would examine about {estimate.rows:,.0f} rows "
+                   f"(limit {self.max_rows:,.0f}).")
+        if estimate.unjoined_tables:
+            names = ', '.join(estimate.unjoined_tables)
+            message += (f" Table(s) {names} are joined without any condition, so every row is paired "
+                        f"with every row of the other tables. Add a JOIN ... ON (or WHERE) condition "
+                        f"that links them.")
+        else:
+            message += " Check your join conditions and filter rows with WHERE before joining."
+        return message
+
+    def invalidate_database(self, db_name: str):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == db_name]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'mode': self.mode,
+                'max_rows': self.max_rows,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'rejected': self.rejected,
+                'warned': self.warned,
+            }
+
+
+cost_guard = CostGuard(
+    mode=getattr(settings, 'SQL_COST_GUARD_MODE', 'reject'),
+    max_rows=getattr(settings, 'SQL_COST_GUARD_MAX_ROWS', 10_000_000),
+    cache_size=getattr(settings, 'SQL_COST_GUARD_CACHE_SIZE', 4096),
+)
+on_data_version_change(cost_guard.invalidate_database)
@@ -0,0 +1,118 @@
+"""
+Data versions for the practice databases.
+
+Problem databases are read-only practice data, so anything derived from them
+(expected results, cached query results) stays valid until the database is
+reseeded. Caches put get_data_version(db_name) into their keys; reseeding
+calls bump_data_version(db_name), which changes the version and notifies the
+registered caches so they can drop their entries right away.
+
+Reseeds usually happen in another process (manage.py apply_seed), so the
+versions live in the data_versions table (DataVersion) shared by every
+process. Each process re-reads the whole table at most once per
+DATA_VERSION_TTL seconds; a version that changed meanwhile notifies the local
+caches as well.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, Dict, List
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+class DataVersions:
+    """Thread-safe copy of the data_versions table, re-read every ttl seconds"""
+
+    def __init__(self, ttl: float = 5):
+        self.ttl = ttl
+        self._versions: Dict[str, int] = {}
+        self._listeners: List[Callable[[str], None]] = []
+        self._loaded = False
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def get(self, db_name: str) -> int:
+        # Never query from an event loop; the async paths refresh through refresh_async()
+        if self.stale() and not _in_event_loop():
+            self.refresh()
+        return self._versions.get(db_name, 0)
+
+    def stale(self) -> bool:
+        return time.monotonic() >= self._expires_at
+
+    def refresh(self):
+        """Re-read every version; caches of a database whose version changed are notified"""
+        from exercises.models import DataVersion
+        try:
+            versions = dict(DataVersion.objects.values_list('db_name', 'version'))
+        except Exception as e:
+            # Keep the known versions (e.g. before migrate); retried after the TTL
+            logger.warning(f"Could not read data versions: {e}")
+            with self._lock:
+                self._expires_at = time.monotonic() + self.ttl
+            return
+        with self._lock:
+            changed = [name for name in set(versions) | set(self._versions)
+                       if versions.get(name, 0) != self._versions.get(name, 0)] if self._loaded else []
+            self._versions = versions
+            self._loaded = True
+            self._expires_at = time.monotonic() + self.ttl
+            self.loads += 1
+            listeners = list(self._listeners)
+        for name in changed:
+            for listener in listeners:
+                listener(name)
+
+    async def refresh_async(self):
+        if self.stale():
+            await sync_to_async(self.refresh)()
+
+    def bump(self, db_name: str):
+        from exercises.models import DataVersion
+        if not DataVersion.objects.filter(db_name=db_name).update(version=F('version') + 1):
+            _, created = DataVersion.objects.get_or_create(db_name=db_name, defaults={'version': 1})
+            if not created:
+                # Created by a concurrent bump
+                DataVersion.objects.filter(db_name=db_name).update(version=F('version') + 1)
+        self.refresh()
+
+    def subscribe(self, listener: Callable[[str], None]):
+        with self._lock:
+            self._listeners.append(listener)
+
+
+data_versions = DataVersions(ttl=getattr(settings, 'DATA_VERSION_TTL', 5))
+
+
+def get_data_version(db_name: str) -> str:
+    """
+    Current version of a practice database: PROBLEM_DATA_VERSION (shared by
+    all processes through the environment) plus the database's reseed count.
+    """
+    base = getattr(settings, 'PROBLEM_DATA_VERSION', '1')
+    return f"{base}.{data_versions.get(db_name)}"
+
+
+def bump_data_version(db_name: str):
+    """Mark a practice database as reseeded (in every process) and notify the caches"""
+    data_versions.bump(db_name)
+
+
+def on_data_version_change(listener: Callable[[str], None]):
+    """Register a callback that receives the db_name whenever its version changes"""
+    data_versions.subscribe(listener)
@@ -1,8 +1,13 @@
-import pymysql
-import time
 import os
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, Tuple
 from django.conf import settings
+from .backends import DjangoDBBackend, EmbeddedSQLiteBackend, MySQLPoolBackend
+from .cost_guard import cost_guard
+from .fingerprint import aligned_columns, canonical_rows, diff_rows, fingerprint_rows
+from .sql_lexer import VerdictCache, check_tokens, tokenize
+from .result import QueryResult
+from .result_cache import make_key as result_cache_key, result_cache
+from .sqlite_engine import embedded_engine
 
 class SQLExecutor:
     """Secure SQL query executor for practice databases"""
@@ -14,6 +19,17 @@ class SQLExecutor:
     
     MAX_EXECUTION_TIME = 5  # seconds
     MAX_ROWS = 1000
+    # Client-side read_timeout is only a last resort behind the server-side
+    # MAX_EXECUTION_TIME hint and the watchdog's KILL QUERY
+    READ_TIMEOUT = MAX_EXECUTION_TIME + 3
+    
+    # Streaming mode: rows go straight from MySQL to the client in chunks
+    STREAM_CHUNK_ROWS = 500
+    STREAM_MAX_ROWS = getattr(settings, 'SQL_STREAM_MAX_ROWS', 100000)
+    STREAM_MAX_EXECUTION_TIME = getattr(settings, 'SQL_STREAM_MAX_EXECUTION_TIME', 30)  # seconds
+    
+    # Validation verdicts, shared by all executors
+    _verdicts = VerdictCache(getattr(settings, 'SQL_VALIDATION_CACHE_SIZE', 4096))
     
     def __init__(self, db_name: str):
         """
@@ -25,8 +41,13 @@ class SQLExecutor:
         """
         # 检查是否是GCP环境
         gcp_db_host = os.getenv('GCP_DB_HOST')
+        self.db_name = db_name
+        self.db_config = None
         
-        if gcp_db_host:
+        if getattr(settings, 'EMBEDDED_SQL_ENGINE', False) and embedded_engine.has_schema(db_name):
+            # 内嵌SQLite：由DatabaseSchema的schema_sql/seed_sql构建，无网络往返
+            self.backend = EmbeddedSQLiteBackend(db_name)
+        elif gcp_db_host:
             # GCP Cloud SQL环境：动态构建数据库配置
             if db_name.startswith('chatsql_problem_'):
                 # 动态题目数据库
@@ -36,13 +57,25 @@ class SQLExecutor:
                 self.db_config = settings.DATABASES[db_name]
             else:
                 raise ValueError(f"Invalid database for GCP: {db_name}")
-        else:
+            self.backend = MySQLPoolBackend(self.db_config, self.READ_TIMEOUT)
+        elif db_name in settings.DATABASES:
             # 传统环境：从settings.DATABASES获取
-            if db_name not in settings.DATABASES:
-                raise ValueError(f"Invalid database: {db_name}")
             self.db_config = settings.DATABASES[db_name]
+            self.backend = MySQLPoolBackend(self.db_config, self.READ_TIMEOUT)
+        elif embedded_engine.has_schema(db_name):
+            # 本地开发：数据库未配置时用内嵌SQLite
+            self.backend = EmbeddedSQLiteBackend(db_name)
+        else:
+            # 本地开发：最后退回到Django默认数据库（SQLite）
+            self.backend = DjangoDBBackend('default')
         
-        self.db_name = db_name
+        self.engine = self.backend.name
+        # Only the read-only practice databases go through the shared result cache
+        self.result_cacheable = (
+            self.engine == 'mysql'
+            and getattr(settings, 'QUERY_RESULT_CACHE_ENABLED', True)
+            and db_name.startswith(('chatsql_problem_', 'practice_'))
+        )
     
     def _get_gcp_db_config(self, db_name: str) -> Dict:
         """动态生成GCP Cloud SQL数据库配置"""
@@ -64,104 +97,148 @@ class SQLExecutor:
         Validate SQL query for security
         Returns: (is_valid, error_message)
         """
-        query_upper = query.strip().upper()
+        keywords = frozenset(self.DANGEROUS_KEYWORDS)
+        key = VerdictCache.key(query, keywords)
+        verdict = self._verdicts.get(key)
+        if verdict is None:
+            # One pass over the text; keywords inside strings, quoted
+            # identifiers or longer names (created_at) don't count
+            verdict = check_tokens(tokenize(query), keywords)
+            self._verdicts.put(key, verdict)
+        return verdict
+    
+    def execute(self, query: str, cancellation=None, guard: bool = True) -> QueryResult:
+        """
+        Execute SQL query and return results
+        Args:
+            cancellation: optional timeouts.Cancellation; cancelling it kills the statement
+            guard: apply the EXPLAIN cost guard (False for trusted reference solutions)
+        Returns: QueryResult, read like a dict: {
+            'success': bool,
+            'columns': List[str],
+            'rows': Sequence[Tuple],
+            'row_count': int (rows the query produced, up to MAX_ROWS),
+            'truncated': bool (cells clipped or rows dropped by the byte budget, see capture.py),
+            'execution_time': float,
+            'fingerprint': str (order-insensitive hash of all row_count rows),
+            'error': str (if failed),
+            'error_type': 'timeout' | 'cancelled' | 'too_expensive' | 'error' (if failed),
+            'warning': str (cost guard in 'warn' mode, if the query looks expensive)
+        }
+        """
+        # Validate query
+        is_valid, error = self.validate_query(query)
+        if not is_valid:
+            return QueryResult.failure(error)
         
-        # Must start with SELECT
-        if not query_upper.startswith('SELECT'):
-            return False, "Only SELECT queries are allowed"
+        if cancellation is not None and cancellation.cancelled:
+            return QueryResult.failure("Query was cancelled", 'cancelled')
         
-        # Check for dangerous keywords
-        for keyword in self.DANGEROUS_KEYWORDS:
-            if keyword in query_upper:
-                return False, f"Keyword '{keyword}' is not allowed"
+        # Practice databases are read-only: identical queries share one result
+        cache_key = result_cache_key(self.db_name, query) if self.result_cacheable else None
+        if cache_key is not None:
+            cached = result_cache.get(cache_key)
+            if cached is not None:
+                result = cached.copy()
+                result['cached'] = True
+                return result
         
-        # Check for comment-based injection
-        if '--' in query or '/*' in query or '*/' in query:
-            return False, "Comments are not allowed in queries"
+        verdict = self.cost_check(query) if guard else None
+        if verdict is not None and verdict.rejected:
+            return QueryResult.failure(verdict.message, 'too_expensive')
         
-        # Check for semicolon (multiple statements)
-        if query.count(';') > 1:
-            return False, "Multiple statements are not allowed"
+        result = self.backend.execute(query, self.MAX_ROWS, self.MAX_EXECUTION_TIME, cancellation)
+        if verdict is not None:
+            result['warning'] = verdict.message
+        if cache_key is not None and result.success:
+            result_cache.put(cache_key, result.copy())
+        return result
+    
+    def stream(self, query: str) -> Iterator[Tuple[str, object]]:
+        """
+        Execute SQL query and yield events as rows arrive (on MySQL through an
+        unbuffered server-side cursor, so memory use doesn't depend on the result size):
+            ('header', List[str])            column names, first
+            ('rows', List[List])             up to STREAM_CHUNK_ROWS rows each
+            ('stats', Dict)                  row_count / execution_time / truncated, last
+            ('error', Dict)                  error / error_type, instead of stats
+            ('warning', Dict)                warning (cost guard), before the header
+        """
+        is_valid, error = self.validate_query(query)
+        if not is_valid:
+            yield 'error', {'error': error, 'error_type': 'error'}
+            return
         
-        return True, ""
+        verdict = self.cost_check(query, self.STREAM_MAX_EXECUTION_TIME)
+        if verdict is not None:
+            if verdict.rejected:
+                yield 'error', {'error': verdict.message, 'error_type': 'too_expensive'}
+                return
+            yield 'warning', {'warning': verdict.message}
+        
+        yield from self.backend.stream(query, self.STREAM_CHUNK_ROWS, self.STREAM_MAX_ROWS,
+                                       self.STREAM_MAX_EXECUTION_TIME)
     
-    def execute(self, query: str) -> Dict:
+    def checksum(self, query: str, cancellation=None, guard: bool = True) -> Dict:
         """
-        Execute SQL query and return results
+        Grade-only execution: MySQL computes row count plus an order-independent
+        hash of the result, so no rows are transferred and results larger than
+        MAX_ROWS are graded in full.
         Returns: {
             'success': bool,
             'columns': List[str],
-            'rows': List[List],
             'row_count': int,
+            'checksum': str,
             'execution_time': float,
-            'error': str (if failed)
+            'error': str (if failed),
+            'error_type': 'timeout' | 'cancelled' | 'error' (if failed)
         }
         """
-        # Validate query
         is_valid, error = self.validate_query(query)
+        if is_valid and not self.backend.supports_checksum:
+            is_valid, error = False, "Checksum grading is only available on MySQL"
         if not is_valid:
             return {
                 'success': False,
                 'error': error,
                 'columns': [],
-                'rows': [],
                 'row_count': 0,
+                'checksum': None,
                 'execution_time': 0
             }
         
-        connection = None
-        start_time = time.time()
-        
-        try:
-            # Connect to database
-            connection = pymysql.connect(
-                host=self.db_config['HOST'],
-                user=self.db_config['USER'],
-                password=self.db_config['PASSWORD'],
-                database=self.db_config['NAME'],
-                port=int(self.db_config.get('PORT', 3306)),
-                connect_timeout=5,
-                read_timeout=self.MAX_EXECUTION_TIME,
-                cursorclass=pymysql.cursors.DictCursor
-            )
-            
-            with connection.cursor() as cursor:
-                # Execute query with timeout
-                cursor.execute(query)
-                
-                # Fetch results (limited)
-                rows = cursor.fetchmany(self.MAX_ROWS)
-                
-                # Get column names
-                columns = [desc[0] for desc in cursor.description] if cursor.description else []
-                
-                # Convert to list of lists for JSON serialization
-                row_list = [list(row.values()) for row in rows]
-                
-                execution_time = time.time() - start_time
-                
-                return {
-                    'success': True,
-                    'columns': columns,
-                    'rows': row_list,
-                    'row_count': len(row_list),
-                    'execution_time': round(execution_time, 3),
-                    'error': None
-                }
+        if cancellation is not None and cancellation.cancelled:
+            return {
+                'success': False,
+                'error': "Query was cancelled",
+                'error_type': 'cancelled',
+                'columns': [],
+                'row_count': 0,
+                'checksum': None,
+                'execution_time': 0
+            }
         
-        except pymysql.MySQLError as e:
+        verdict = self.cost_check(query) if guard else None
+        if verdict is not None and verdict.rejected:
             return {
                 'success': False,
-                'error': str(e),
+                'error': verdict.message,
+                'error_type': 'too_expensive',
                 'columns': [],
-                'rows': [],
                 'row_count': 0,
-                'execution_time': round(time.time() - start_time, 3)
+                'checksum': None,
+                'execution_time': 0
             }
         
-        finally:
-            if connection:
-                connection.close()
+        result = self.backend.checksum(query, self.MAX_EXECUTION_TIME, cancellation)
+        if verdict is not None:
+            result['warning'] = verdict.message
+        return result
+    
+    def cost_check(self, query: str, timeout: float = None):
+        """cost_guard verdict for a validated query (None: OK or not checkable)"""
+        return cost_guard.check(self.backend, self.db_name, query,
+                                self.MAX_EXECUTION_TIME if timeout is None else timeout)
     
     def compare_results(self, user_result: Dict, expected_result: Dict) -> Dict:
         """
@@ -201,11 +278,54 @@ class SQLExecutor:
                 'diff': None
             }
         
-        # Compare actual data (normalize for comparison)
-        user_data_normalized = self._normalize_result(user_result)
-        expected_data_normalized = self._normalize_result(expected_result)
+        # Compare fingerprints (row order and column order don't matter,
+        # duplicate rows do). Rows are only looked at when they differ.
+        if self.result_fingerprint(user_result) != self.result_fingerprint(expected_result):
+            return {
+                'correct': False,
+                'message': 'Query results do not match expected output',
+                'diff': self._row_diff(user_result, expected_result)
+            }
         
-        if user_data_normalized != expected_data_normalized:
+        return {
+            'correct': True,
+            'message': 'Correct! Well done!',
+            'diff': None
+        }
+    
+    def compare_checksums(self, user_checksum: Dict, expected_checksum: Dict) -> Dict:
+        """
+        Compare two results of checksum()
+        Returns the same shape as compare_results (diff only for column mismatches)
+        """
+        if not user_checksum['success']:
+            return {
+                'correct': False,
+                'message': 'Query execution failed',
+                'diff': None
+            }
+        
+        user_cols = set(user_checksum['columns'])
+        expected_cols = set(expected_checksum['columns'])
+        
+        if user_cols != expected_cols:
+            return {
+                'correct': False,
+                'message': 'Column names do not match',
+                'diff': {
+                    'missing_columns': list(expected_cols - user_cols),
+                    'extra_columns': list(user_cols - expected_cols)
+                }
+            }
+        
+        if user_checksum['row_count'] != expected_checksum['row_count']:
+            return {
+                'correct': False,
+                'message': f"Row count mismatch: expected {expected_checksum['row_count']}, got {user_checksum['row_count']}",
+                'diff': None
+            }
+        
+        if user_checksum['checksum'] != expected_checksum['checksum']:
             return {
                 'correct': False,
                 'message': 'Query results do not match expected output',
@@ -218,11 +338,24 @@ class SQLExecutor:
             'diff': None
         }
     
-    def _normalize_result(self, result: Dict) -> set:
-        """Normalize result for comparison (handle row order)"""
-        rows = []
-        for row in result['rows']:
-            # Convert each row to tuple (hashable) and sort
-            row_tuple = tuple(sorted(str(val) for val in row))
-            rows.append(row_tuple)
-        return set(rows)
+    @staticmethod
+    def result_fingerprint(result: Dict) -> str:
+        """Fingerprint computed during execute(), or computed now for results built elsewhere"""
+        fingerprint = result.get('fingerprint')
+        if fingerprint is None:
+            fingerprint = fingerprint_rows(result['columns'], result['rows'])
+        return fingerprint
+    
+    @staticmethod
+    def _row_diff(user_result: Dict, expected_result: Dict):
+        """Row-level diff for a mismatch; None if the rows aren't available (or were truncated)"""
+        if user_result.get('truncated') or expected_result.get('truncated'):
+            return None
+        expected_rows = expected_result.get('canonical_rows')
+        if expected_rows is None:
+            if not expected_result.get('rows') and expected_result['row_count']:
+                return None
+            expected_rows = canonical_rows(expected_result['columns'], expected_result['rows'])
+        diff = diff_rows(expected_rows, canonical_rows(user_result['columns'], user_result['rows']))
+        diff['columns'] = aligned_columns(expected_result['columns'])
+        return diff
@@ -0,0 +1,281 @@
+"""
+Cache of expected-query results.
+
+The reference solution of a problem always returns the same rows, so it is
+executed once and then served from:
+1. a process-local LRU
+2. the problems.expected_result column (shared by every process)
+
+Entries are keyed by problem id + hash of expected_query + data version of the
+problem database, so editing the expected query or reseeding the database
+never serves a stale result. Hidden dataset variants (variants.py) get their
+own keys and are only cached in-process.
+
+The same keys, extended with the hidden variants graded alongside and their
+data versions, hold the canonical query forms known to be correct (the
+expected query's and those of submissions graded correct), so grading can
+accept a rewritten reference solution without running it (grading.py).
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional
+
+from django.conf import settings
+
+from chatsql.routers import system_cursor
+
+from .canonical import canonicalize
+from .catalog import problem_catalog
+from .data_version import get_data_version, on_data_version_change
+from .fingerprint import canonical_rows
+from .variants import hidden_variants
+
+logger = logging.getLogger(__name__)
+
+
+class ExpectedResultCache:
+    """Thread-safe LRU of expected results (in compare-ready form)"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Dict]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: Dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_problem(self, problem_id):
+        prefix = f"{problem_id}:"
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+    def invalidate_database(self, db_name: str):
+        with self._lock:
+            for key in [k for k, v in self._entries.items() if v.get('database_name') == db_name]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CorrectForms:
+    """
+    Thread-safe LRU of canonical query forms known to be correct, per cache
+    key (problem + expected query + data version + hidden variants): the
+    expected query's own form plus forms of submissions the database graded
+    correct.
+    """
+
+    def __init__(self, max_keys: int = 256, max_forms: int = 64):
+        self.max_keys = max_keys
+        self.max_forms = max_forms
+        self._entries: 'OrderedDict[str, FrozenSet[str]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[FrozenSet[str]]:
+        with self._lock:
+            forms = self._entries.get(key)
+            if forms is not None:
+                self._entries.move_to_end(key)
+            return forms
+
+    def add(self, key: str, *forms: str) -> FrozenSet[str]:
+        with self._lock:
+            current = self._entries.get(key, frozenset())
+            if len(current) < self.max_forms:
+                current = current.union(f for f in forms if f is not None)
+            self._entries[key] = current
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+            return current
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = ExpectedResultCache(getattr(settings, 'EXPECTED_RESULT_CACHE_SIZE', 256))
+on_data_version_change(_cache.invalidate_database)
+_correct_forms = CorrectForms(getattr(settings, 'EXPECTED_RESULT_CACHE_SIZE', 256))
+
+
+def make_cache_key(problem: Dict, engine: str = 'mysql') -> str:
+    """problem id + hash of expected_query + data version (+ variant, + engine if not MySQL)"""
+    query_hash = hashlib.sha1((problem.get('expected_query') or '').encode('utf-8')).hexdigest()[:16]
+    key = f"{problem['id']}:{query_hash}:{get_data_version(problem.get('database_name') or '')}"
+    if problem.get('variant'):
+        key = f"{key}:{problem['variant']}"
+    # Other engines render values differently (e.g. DECIMAL); never mix them
+    return key if engine == 'mysql' else f"{key}:{engine}"
+
+
+def get_expected_result(problem: Dict, executor, cancellation=None) -> Dict:
+    """
+    Return the expected result for a problem, executing expected_query only on
+    a cache miss. The returned dict has the same shape as SQLExecutor.execute()
+    (including 'fingerprint', which compare_results compares directly) plus
+    'canonical_rows' for building a diff when a submission is wrong.
+    """
+    key = make_cache_key(problem, executor.engine)
+
+    entry = _cache.get(key)
+    if entry is not None:
+        return entry
+
+    entry = _load_stored(problem, key, 'fetch')
+    if entry is not None:
+        _cache.put(key, entry)
+        return entry
+
+    result = executor.execute(problem['expected_query'], cancellation=cancellation, guard=False)
+    if not result['success']:
+        # Never cache failures; the next submit retries
+        return result
+
+    result['canonical_rows'] = canonical_rows(result['columns'], result['rows'])
+    result['database_name'] = problem.get('database_name')
+    _cache.put(key, result)
+    if executor.engine == 'mysql':
+        _store(problem, key, 'fetch', {
+            'columns': result['columns'],
+            'row_count': result['row_count'],
+            'fingerprint': result['fingerprint'],
+            'canonical_rows': result['canonical_rows'],
+            'truncated': result['truncated'],
+        })
+    return result
+
+
+def get_expected_checksum(problem: Dict, executor, cancellation=None) -> Dict:
+    """Same as get_expected_result, for the server-side checksum (SQLExecutor.checksum)"""
+    key = make_cache_key(problem, executor.engine)
+    cache_key = f"{key}:checksum"
+
+    entry = _cache.get(cache_key)
+    if entry is not None:
+        return entry
+
+    entry = _load_stored(problem, key, 'checksum')
+    if entry is not None:
+        _cache.put(cache_key, entry)
+        return entry
+
+    result = executor.checksum(problem['expected_query'], cancellation=cancellation, guard=False)
+    if not result['success']:
+        return result
+
+    result['database_name'] = problem.get('database_name')
+    _cache.put(cache_key, result)
+    _store(problem, key, 'checksum', {
+        'columns': result['columns'],
+        'row_count': result['row_count'],
+        'checksum': result['checksum'],
+    })
+    return result
+
+
+def correct_forms(problem: Dict, executor) -> FrozenSet[str]:
+    """Canonical forms (canonical.py) that are graded correct for this problem"""
+    key = _forms_key(problem, executor)
+    forms = _correct_forms.get(key)
+    if forms is None:
+        forms = _correct_forms.add(key, canonicalize(problem.get('expected_query') or ''))
+    return forms
+
+
+def remember_correct_form(problem: Dict, executor, form: Optional[str]):
+    """A submission with this canonical form was graded correct by the database"""
+    if form is not None:
+        _correct_forms.add(_forms_key(problem, executor), form)
+
+
+def _forms_key(problem: Dict, executor) -> str:
+    """
+    make_cache_key() plus every hidden variant and its data version: a form
+    was only graded correct on the datasets that existed at the time
+    (variant discovery may query the database)
+    """
+    variants = ','.join(f"{name}@{get_data_version(name)}" for name in hidden_variants(executor))
+    return f"{make_cache_key(problem, executor.engine)}|{variants}"
+
+
+def invalidate_problem(problem_id):
+    """Drop the cached expected result of a problem (called when it changes)"""
+    _cache.invalidate_problem(problem_id)
+
+
+def _parse_stored(raw, key: str) -> Dict:
+    """Materialized payload for this key, or {} if absent/stale/not ours"""
+    if not raw:
+        return {}
+    try:
+        stored = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    if not isinstance(stored, dict) or stored.get('cache_key') != key:
+        return {}
+    return stored
+
+
+def _load_stored(problem: Dict, key: str, mode: str) -> Optional[Dict]:
+    """Parse problems.expected_result if it was materialized for this key"""
+    stored = _parse_stored(problem.get('expected_result'), key).get(mode)
+    if not stored:
+        return None
+
+    entry = {
+        'success': True,
+        'columns': stored['columns'],
+        'row_count': stored['row_count'],
+        'execution_time': 0,
+        'error': None,
+        'database_name': problem.get('database_name'),
+    }
+    if mode == 'checksum':
+        entry['checksum'] = stored['checksum']
+    else:
+        entry['rows'] = []
+        entry['fingerprint'] = stored['fingerprint']
+        entry['canonical_rows'] = [tuple(row) for row in stored['canonical_rows']]
+        entry['truncated'] = stored.get('truncated', False)
+    return entry
+
+
+def _store(problem: Dict, key: str, mode: str, data: Dict):
+    """Materialize an expected result into problems.expected_result"""
+    if problem.get('variant'):
+        # The column holds the visible dataset's result only
+        return
+    # The catalog's record is newer than the caller's if another mode was stored since
+    current = problem_catalog.peek(problem['id']) or problem
+    stored = _parse_stored(current.get('expected_result'), key)
+    stored['cache_key'] = key
+    stored[mode] = data
+    payload = json.dumps(stored)
+    try:
+        with system_cursor() as cursor:
+            cursor.execute('UPDATE problems SET expected_result = %s WHERE id = %s', [payload, problem['id']])
+        # Keep the catalog (and a mutable caller copy) in sync so the other mode merges into it
+        problem_catalog.replace(problem['id'], expected_result=payload)
+        if isinstance(problem, dict):
+            problem['expected_result'] = payload
+    except Exception as e:
+        # The in-process cache still works; the next process will recompute
+        logger.warning(f"Failed to store expected_result for problem {problem['id']}: {e}")
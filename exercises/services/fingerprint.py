@@ -0,0 +1,98 @@
+"""
+Order-insensitive result fingerprints.
+
+A fingerprint identifies a result set independent of row order and column
+order while still counting duplicate rows:
+
+- columns are aligned by name, so `SELECT a, b` and `SELECT b, a` match
+- each row is hashed on its aligned, canonicalized cells
+- row hashes are summed modulo 2**128, which is commutative (row order does not
+  matter) but not idempotent (duplicate rows are counted)
+
+The fingerprint is built incrementally with add_row() while rows are fetched,
+so comparing two results costs O(1) memory. Only a mismatch needs the rows
+themselves (see diff_rows).
+"""
+import hashlib
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+_MASK = (1 << 128) - 1
+_NULL = '\x00NULL'
+_SEP = '\x1f'
+
+
+def canonical_cell(value) -> str:
+    """String form used for comparison (NULL is distinct from the string 'None')"""
+    if value is None:
+        return _NULL
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def column_order(columns: Sequence[str]) -> List[int]:
+    """Indexes of columns sorted by name (duplicates keep their relative order)"""
+    return sorted(range(len(columns)), key=lambda i: (columns[i], i))
+
+
+def aligned_columns(columns: Sequence[str]) -> List[str]:
+    return [columns[i] for i in column_order(columns)]
+
+
+class ResultFingerprint:
+    """Incremental, column-aligned, multiset-preserving hash of a result set"""
+
+    __slots__ = ('_order', '_acc', 'row_count')
+
+    def __init__(self, columns: Sequence[str]):
+        self._order = column_order(columns)
+        self._acc = 0
+        self.row_count = 0
+
+    def add_row(self, row: Sequence):
+        key = _SEP.join([canonical_cell(row[i]) for i in self._order])
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        self._acc = (self._acc + int.from_bytes(digest, 'big')) & _MASK
+        self.row_count += 1
+
+    def add_rows(self, rows: Iterable[Sequence]):
+        for row in rows:
+            self.add_row(row)
+
+    def hexdigest(self) -> str:
+        return f"{self.row_count}:{self._acc:032x}"
+
+
+def fingerprint_rows(columns: Sequence[str], rows: Iterable[Sequence]) -> str:
+    fp = ResultFingerprint(columns)
+    fp.add_rows(rows)
+    return fp.hexdigest()
+
+
+def canonical_rows(columns: Sequence[str], rows: Iterable[Sequence]) -> List[Tuple[str, ...]]:
+    """Rows as tuples of canonical cells in aligned column order (for diffs/storage)"""
+    order = column_order(columns)
+    return [tuple(canonical_cell(row[i]) for i in order) for row in rows]
+
+
+def diff_rows(expected: List[Tuple[str, ...]], actual: List[Tuple[str, ...]], limit: int = 5) -> Dict:
+    """
+    Multiset difference of two canonical row lists.
+    Returns up to `limit` missing and extra rows plus their full counts.
+    """
+    expected_counts = Counter(expected)
+    actual_counts = Counter(actual)
+    missing = list((expected_counts - actual_counts).elements())
+    extra = list((actual_counts - expected_counts).elements())
+    return {
+        'missing_rows': [display_row(row) for row in missing[:limit]],
+        'extra_rows': [display_row(row) for row in extra[:limit]],
+        'missing_count': len(missing),
+        'extra_count': len(extra),
+    }
+
+
+def display_row(row: Tuple[str, ...]) -> List:
+    """Canonical row back to displayable cells (NULL restored, the rest stays text)"""
+    return [None if cell == _NULL else cell for cell in row]
@@ -0,0 +1,403 @@
+"""
+Submission grading.
+
+Two grading modes (settings.SQL_GRADING_MODE):
+- 'checksum': both queries are reduced to a checksum inside MySQL
+  (SQLExecutor.checksum), so results of any size are graded in full with one
+  row per query on the wire. The fetched rows are only used to build a diff.
+- 'fetch': rows (capped at MAX_ROWS) are fetched and fingerprinted in Python.
+
+If the checksum can't be computed (e.g. duplicate column names in the user
+query, or the embedded SQLite engine) grading falls back to 'fetch'.
+
+A query whose canonical form (canonical.py) matches the expected query's, or
+one the database already graded correct, is accepted without running it
+(settings.SQL_CANONICAL_GRADING); the expected result is shown as its result.
+
+The user's query, its checksum and the expected query run concurrently on a
+small shared thread pool, each on its own pooled connection, under one overall
+deadline of MAX_EXECUTION_TIME. If one side fails the other is cancelled (a statement
+that is already running is stopped with KILL QUERY, see timeouts.py).
+grade_submission_async() is the same for the ASGI views, with the user's
+query on the async driver (async_executor.py).
+
+Hidden dataset variants of the problem database (variants.py) are graded on
+the same pool at the same time, each against its own cached expected result.
+The first failing variant cancels the others; the visible dataset still
+finishes so the student sees their result, but the answer is incorrect.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .async_executor import checksum_async, execute_async
+from .canonical import canonicalize
+from .data_version import data_versions
+from .expected_cache import correct_forms, get_expected_checksum, get_expected_result, remember_correct_form
+from .fingerprint import aligned_columns, display_row
+from .result import QueryResult
+from .timeouts import Cancellation
+from .variants import hidden_variants, variant_targets
+
+logger = logging.getLogger(__name__)
+
+_workers: Optional[ThreadPoolExecutor] = None
+_workers_lock = threading.Lock()
+
+
+def get_workers() -> ThreadPoolExecutor:
+    """Shared, bounded grading thread pool (created on first use)"""
+    global _workers
+    if _workers is None:
+        with _workers_lock:
+            if _workers is None:
+                _workers = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'SQL_GRADING_WORKERS', 8),
+                    thread_name_prefix='grading',
+                )
+    return _workers
+
+
+def run_in_worker(fn, *args):
+    """Worker wrapper: Django DB connections opened by fn are not left behind"""
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+
+
+def grading_connections(executor) -> int:
+    """Pooled connections one grading may hold at once (its admission cost)"""
+    # User query (and its checksum) and expected side, plus one per hidden variant
+    return 2 + _checksum_mode(executor) + len(hidden_variants(executor))
+
+
+def _checksum_mode(executor) -> bool:
+    return (
+        getattr(settings, 'SQL_GRADING_MODE', 'checksum') == 'checksum'
+        and executor.backend.supports_checksum
+    )
+
+
+def grade_submission(executor, problem: Dict, query: str) -> Tuple[Dict, Dict]:
+    """
+    Run the user's query and grade it against the problem's expected query.
+    Returns: (user_result, comparison)
+    """
+    # Validation is in-process; an invalid query never reaches the database
+    is_valid, _ = executor.validate_query(query)
+    if not is_valid:
+        return _failed(executor.execute(query))
+
+    form = _canonical_form(query)
+    if form is not None:
+        graded = _grade_canonical(executor, problem, form)
+        if graded is not None:
+            return graded
+
+    checksum_mode = _checksum_mode(executor)
+    deadline = time.monotonic() + executor.MAX_EXECUTION_TIME
+    workers = get_workers()
+
+    user_cancel = Cancellation()
+    expected_cancel = Cancellation()
+    user_future = workers.submit(run_in_worker, _run_user_side, executor, query, user_cancel)
+    expected_future = workers.submit(run_in_worker, _run_expected_side, executor, problem, checksum_mode, expected_cancel)
+    cancellations = {user_future: user_cancel, expected_future: expected_cancel}
+    checksum_future = None
+    if checksum_mode:
+        # The displayed rows and the checksum each get the whole deadline
+        checksum_cancel = Cancellation()
+        checksum_future = workers.submit(run_in_worker, _run_user_checksum, executor, query, checksum_cancel)
+        cancellations[checksum_future] = checksum_cancel
+    variant_futures = set()
+    for variant_executor, variant_problem in variant_targets(executor, problem):
+        variant_cancel = Cancellation()
+        future = workers.submit(run_in_worker, _grade_variant, variant_executor, variant_problem,
+                                query, checksum_mode, variant_cancel)
+        cancellations[future] = variant_cancel
+        variant_futures.add(future)
+
+    pending = set(cancellations)
+    hidden_failed = False
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        crashed = next((future for future in done if future.exception() is not None), None)
+        if crashed is not None:
+            # Not a query error (pool timeout, lost connection...): no verdict is possible
+            _cancel_all(pending, cancellations)
+            return _grading_error(problem, crashed.exception())
+        if user_future in done and not user_future.result()['success']:
+            _cancel_all(pending, cancellations)
+            return _failed(user_future.result())
+        if expected_future in done and not expected_future.result()['success']:
+            _cancel_all(pending, cancellations)
+            error = expected_future.result().get('error')
+            logger.error(f"Expected query failed for problem {problem.get('id')}: {error}")
+            return _failed(_error_result(f"Could not compute the expected result: {error}"))
+        if any(future.result() is False for future in done & variant_futures):
+            # Early exit: the other variants can't change the verdict
+            hidden_failed = True
+            _cancel_all(pending & variant_futures, cancellations)
+            pending -= variant_futures
+
+    if pending:
+        _cancel_all(pending, cancellations)
+        result = _error_result(f"Query exceeded the time limit of {executor.MAX_EXECUTION_TIME} seconds")
+        result['error_type'] = 'timeout'
+        return _failed(result)
+
+    user_result = user_future.result()
+    user_checksum = checksum_future.result() if checksum_future is not None else None
+    comparison = _compare(executor, problem, user_result, user_checksum, expected_future.result())
+    if comparison['correct'] and hidden_failed:
+        comparison = _hidden_failure()
+    if comparison['correct']:
+        remember_correct_form(problem, executor, form)
+    return user_result, comparison
+
+
+async def grade_submission_async(executor, problem: Dict, query: str) -> Tuple[Dict, Dict]:
+    """
+    grade_submission() for the ASGI views: the user's query runs on the async
+    driver in the event loop, the (usually cached) expected side in a worker thread.
+    """
+    is_valid, _ = executor.validate_query(query)
+    if not is_valid:
+        return _failed(executor.execute(query))
+
+    # Cache keys below carry the data version (not read from the event loop itself)
+    await data_versions.refresh_async()
+    form = _canonical_form(query)
+    if form is not None:
+        # Variant discovery / an expected-result miss may need database I/O
+        graded = await sync_to_async(run_in_worker, thread_sensitive=False)(
+            _grade_canonical, executor, problem, form
+        )
+        if graded is not None:
+            return graded
+
+    checksum_mode = _checksum_mode(executor)
+    deadline = time.monotonic() + executor.MAX_EXECUTION_TIME
+
+    expected_cancel = Cancellation()
+    user_task = asyncio.ensure_future(execute_async(executor, query))
+    # In parallel, on its own connection: the checksum doesn't wait for the rows
+    checksum_task = asyncio.ensure_future(checksum_async(executor, query)) if checksum_mode else None
+    loop_tasks = {user_task} | ({checksum_task} if checksum_task is not None else set())
+    expected_task = asyncio.ensure_future(sync_to_async(run_in_worker, thread_sensitive=False)(
+        _run_expected_side, executor, problem, checksum_mode, expected_cancel
+    ))
+    # Worker threads can't be cancelled from the loop; their Cancellation stops them
+    cancellations = {expected_task: expected_cancel}
+    targets = await sync_to_async(variant_targets, thread_sensitive=False)(executor, problem)
+    variant_tasks = set()
+    for variant_executor, variant_problem in targets:
+        variant_cancel = Cancellation()
+        task = asyncio.ensure_future(sync_to_async(run_in_worker, thread_sensitive=False)(
+            _grade_variant, variant_executor, variant_problem, query, checksum_mode, variant_cancel
+        ))
+        cancellations[task] = variant_cancel
+        variant_tasks.add(task)
+
+    pending = loop_tasks | {expected_task} | variant_tasks
+    hidden_failed = False
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            crashed = next((task for task in done if task.exception() is not None), None)
+            if crashed is not None:
+                return _grading_error(problem, crashed.exception())
+            if user_task in done and not user_task.result()['success']:
+                return _failed(user_task.result())
+            if expected_task in done and not expected_task.result()['success']:
+                error = expected_task.result().get('error')
+                logger.error(f"Expected query failed for problem {problem.get('id')}: {error}")
+                return _failed(_error_result(f"Could not compute the expected result: {error}"))
+            if any(task.result() is False for task in done & variant_tasks):
+                # Early exit: the other variants can't change the verdict
+                hidden_failed = True
+                for task in pending & variant_tasks:
+                    cancellations[task].cancel()
+                pending -= variant_tasks
+
+        if pending:
+            result = _error_result(f"Query exceeded the time limit of {executor.MAX_EXECUTION_TIME} seconds")
+            result['error_type'] = 'timeout'
+            return _failed(result)
+    finally:
+        # Whatever is still running is no longer needed
+        for task in loop_tasks:
+            if not task.done():
+                task.cancel()
+        for task, cancellation in cancellations.items():
+            if not task.done():
+                cancellation.cancel()
+
+    user_result = user_task.result()
+    user_checksum = checksum_task.result() if checksum_task is not None else None
+    # A wrong answer may need the expected rows for the diff (database I/O)
+    comparison = await sync_to_async(run_in_worker, thread_sensitive=False)(
+        _compare, executor, problem, user_result, user_checksum, expected_task.result()
+    )
+    if comparison['correct'] and hidden_failed:
+        comparison = _hidden_failure()
+    if comparison['correct']:
+        await sync_to_async(remember_correct_form, thread_sensitive=False)(problem, executor, form)
+    return user_result, comparison
+
+
+def _canonical_form(query: str) -> Optional[str]:
+    if not getattr(settings, 'SQL_CANONICAL_GRADING', True):
+        return None
+    return canonicalize(query)
+
+
+def _grade_canonical(executor, problem: Dict, form: str) -> Optional[Tuple[Dict, Dict]]:
+    """
+    Correct without running the user's query if form is known to be correct;
+    None if it isn't (or the expected result is unavailable)
+    """
+    if form not in correct_forms(problem, executor):
+        return None
+    expected = get_expected_result(problem, executor)
+    if not expected['success']:
+        return None
+    if expected.get('rows') or not expected.get('canonical_rows'):
+        columns, rows = expected['columns'], expected['rows']
+    else:
+        # Materialized in problems.expected_result: canonical (text) cells only
+        columns = aligned_columns(expected['columns'])
+        rows = [tuple(display_row(row)) for row in expected['canonical_rows']]
+    user_result = QueryResult(
+        True,
+        columns=columns,
+        rows=rows,
+        fingerprint=expected.get('fingerprint'),
+        row_count=expected['row_count'],
+        truncated=expected.get('truncated', False)
+    )
+    user_result['graded_by'] = 'canonical'
+    return user_result, {
+        'correct': True,
+        'message': 'Correct! Well done!',
+        'diff': None
+    }
+
+
+def _compare(executor, problem: Dict, user_result: Dict, user_checksum: Optional[Dict], expected: Dict) -> Dict:
+    if user_checksum is not None and user_checksum['success'] and 'checksum' in expected:
+        comparison = executor.compare_checksums(user_checksum, expected)
+        if not comparison['correct'] and comparison['diff'] is None:
+            # Wrong answer: the fetch path builds the row-level diff
+            expected_result = get_expected_result(problem, executor)
+            if expected_result['success']:
+                comparison['diff'] = executor.compare_results(user_result, expected_result).get('diff')
+        return comparison
+
+    if 'checksum' in expected:
+        logger.info(f"Checksum grading unavailable, falling back to fetch: {user_checksum and user_checksum['error']}")
+        expected = get_expected_result(problem, executor)
+    return executor.compare_results(user_result, expected)
+
+
+def _grade_variant(executor, problem: Dict, query: str, checksum_mode: bool,
+                   cancellation: Cancellation) -> Optional[bool]:
+    """Whether the query is correct on one hidden variant (None: can't tell, ignored)"""
+    expected = _run_expected_side(executor, problem, checksum_mode, cancellation)
+    if cancellation.cancelled:
+        return None
+    if not expected['success']:
+        logger.warning(f"Expected query failed on {problem['variant']} for problem {problem.get('id')}: "
+                       f"{expected.get('error')}")
+        return None
+    if 'checksum' in expected:
+        # Only the verdict matters here: the checksum alone, no rows and no diff
+        user_checksum = executor.checksum(query, cancellation=cancellation)
+        if cancellation.cancelled:
+            return None
+        if user_checksum['success']:
+            return executor.compare_checksums(user_checksum, expected)['correct']
+        # Not checksummable (or failing): fetch and fingerprint instead
+        expected = get_expected_result(problem, executor, cancellation=cancellation)
+        if cancellation.cancelled or not expected['success']:
+            return None
+    user_result = executor.execute(query, cancellation=cancellation)
+    if cancellation.cancelled:
+        return None
+    if not user_result['success']:
+        return False
+    return executor.compare_results(user_result, expected)['correct']
+
+
+def _run_user_side(executor, query: str, cancellation: Cancellation) -> Dict:
+    return executor.execute(query, cancellation=cancellation)
+
+
+def _run_user_checksum(executor, query: str, cancellation: Cancellation) -> Dict:
+    return executor.checksum(query, cancellation=cancellation)
+
+
+def _run_expected_side(executor, problem: Dict, checksum_mode: bool, cancellation: Cancellation) -> Dict:
+    if checksum_mode:
+        expected = get_expected_checksum(problem, executor, cancellation=cancellation)
+        if expected['success'] or cancellation.cancelled:
+            return expected
+    return get_expected_result(problem, executor, cancellation=cancellation)
+
+
+def _cancel(future: Future, cancellation: Cancellation):
+    # Not started yet: dropped. Already running: its statement is killed.
+    if not future.cancel():
+        cancellation.cancel()
+
+
+def _cancel_all(futures, cancellations: Dict):
+    for future in futures:
+        _cancel(future, cancellations[future])
+
+
+def _hidden_failure() -> Dict:
+    return {
+        'correct': False,
+        'message': 'Your query returns the right rows for the sample data, but not for a hidden test dataset. '
+                   'Avoid relying on specific values in the sample data.',
+        'diff': None
+    }
+
+
+def _grading_error(problem: Dict, e: BaseException) -> Tuple[Dict, Dict]:
+    logger.error(f"Grading failed for problem {problem.get('id')}: {e!r}", exc_info=e)
+    return _failed(_error_result("Could not grade the query right now, please try again"))
+
+
+def _error_result(error: str) -> Dict:
+    return {
+        'success': False,
+        'error': error,
+        'columns': [],
+        'rows': [],
+        'row_count': 0,
+        'execution_time': 0
+    }
+
+
+def _failed(user_result: Dict) -> Tuple[Dict, Dict]:
+    return user_result, {
+        'correct': False,
+        'message': 'Query execution failed',
+        'diff': None
+    }
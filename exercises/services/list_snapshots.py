@@ -0,0 +1,158 @@
+"""
+Pre-rendered exercise list responses.
+
+The exercise list is the same for every student (completion comes from a
+small per-user payload, ExerciseCompletionView), so each variant of it
+(filters, page, fields) is rendered once per catalog version to JSON bytes
+plus their gzip encoding, with a strong ETag. When a new catalog snapshot is
+seen the full list and each difficulty are rendered right away (one
+problem_tables query for all of them); other variants on first request.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+from rest_framework.renderers import JSONRenderer
+
+from .catalog import CatalogSnapshot, load_problem_tables
+
+FIELDS = ('id', 'title', 'description', 'difficulty', 'schema', 'tags', 'completed')
+
+
+class ListKey(NamedTuple):
+    difficulty: str
+    tag: str
+    after_id: Optional[int]
+    limit: Optional[int]
+    fields: Tuple[str, ...]
+    paginated: bool
+
+
+class RenderedList:
+    """One list response: JSON bytes, gzip bytes and their strong ETags"""
+
+    __slots__ = ('body', 'gzipped', '_digest')
+
+    def __init__(self, data):
+        # Same bytes DRF's JSONRenderer produced for Response(data)
+        self.body = JSONRenderer().render(data)
+        self.gzipped = gzip.compress(self.body, mtime=0)
+        self._digest = hashlib.sha1(self.body).hexdigest()
+
+    def etag(self, gzipped: bool) -> str:
+        # Each encoding is its own representation, so it gets its own strong ETag
+        return f'"{self._digest}-gzip"' if gzipped else f'"{self._digest}"'
+
+
+def exercise_list_item(problem: Mapping, tables_by_problem: Dict[int, List[Dict]], fields: Iterable[str]) -> Dict:
+    item = {}
+    for field in fields:
+        if field == 'schema':
+            # 构建schema信息
+            tag_display = problem.get('tag', '').strip() if problem.get('tag') else 'Database'
+            item['schema'] = {
+                'id': problem['id'],
+                'name': problem['database_name'].replace('chatsql_problem_', 'problem_'),
+                'display_name': f"Problem {problem['id']} {tag_display}",
+                'db_name': problem['database_name'],
+                'tables': [t['table_name'] for t in tables_by_problem[problem['id']]]
+            }
+        elif field == 'tags':
+            # 将tag字符串转换为数组
+            item['tags'] = [problem['tag']] if problem.get('tag') else []
+        elif field == 'completed':
+            # Per-user completion is overlaid by the client (ExerciseCompletionView)
+            item['completed'] = False
+        else:
+            item[field] = problem[field]
+    return item
+
+
+def render_list(snapshot: CatalogSnapshot, key: ListKey, next_url: Callable[[int], str],
+                tables_by_problem: Optional[Dict[int, List[Dict]]] = None) -> RenderedList:
+    """Render one list variant; tables_by_problem may already hold every problem's tables"""
+    page = snapshot.page(key.difficulty, key.tag, key.after_id, key.limit)
+    if 'schema' not in key.fields:
+        tables_by_problem = {}
+    elif tables_by_problem is None:
+        # 所有题目的problem_tables一次查询取回
+        tables_by_problem = load_problem_tables(p['id'] for p in page.problems)
+    data = [exercise_list_item(problem, tables_by_problem, key.fields) for problem in page.problems]
+    if not key.paginated:
+        return RenderedList(data)
+    return RenderedList({
+        'count': page.total,
+        'next': next_url(page.next_after_id) if page.next_after_id is not None else None,
+        'results': data,
+    })
+
+
+class ListSnapshots:
+    """Thread-safe LRU of rendered list variants for the current catalog snapshot"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._entries: 'OrderedDict[ListKey, RenderedList]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.renders = 0
+
+    def get(self, snapshot: CatalogSnapshot, key: ListKey, next_url: Callable[[int], str]) -> RenderedList:
+        with self._lock:
+            if snapshot is self._snapshot:
+                rendered = self._entries.get(key)
+                if rendered is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return rendered
+        if snapshot is not self._snapshot:
+            self._prerender(snapshot)
+            with self._lock:
+                rendered = self._entries.get(key) if snapshot is self._snapshot else None
+            if rendered is not None:
+                return rendered
+        rendered = render_list(snapshot, key, next_url)
+        self._put(snapshot, {key: rendered})
+        return rendered
+
+    def _prerender(self, snapshot: CatalogSnapshot):
+        """The full list and one list per difficulty, from a single problem_tables query"""
+        tables_by_problem = load_problem_tables(p['id'] for p in snapshot.problems)
+        keys = [ListKey('', '', None, None, FIELDS, False)]
+        keys += [ListKey(difficulty, '', None, None, FIELDS, False) for difficulty in snapshot.by_difficulty]
+        self._put(snapshot, {
+            key: render_list(snapshot, key, None, tables_by_problem) for key in keys
+        }, replace=True)
+
+    def _put(self, snapshot: CatalogSnapshot, renders: Dict[ListKey, RenderedList], replace: bool = False):
+        with self._lock:
+            if replace and snapshot is not self._snapshot:
+                # A new catalog version: everything rendered for the old one is stale
+                self._snapshot = snapshot
+                self._entries.clear()
+            elif snapshot is not self._snapshot:
+                return
+            self.renders += len(renders)
+            self._entries.update(renders)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'renders': self.renders,
+                'bytes': sum(len(r.body) + len(r.gzipped) for r in self._entries.values()),
+            }
+
+
+list_snapshots = ListSnapshots()
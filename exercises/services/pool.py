@@ -0,0 +1,320 @@
+"""
+Thread-safe pymysql connection pool for the practice databases.
+
+Every chatsql_problem_N schema lives on the same Cloud SQL instance, so pools
+are keyed by (host, port, user) instead of by database. A checkout switches
+schema with ``select_db`` only when the pooled connection is currently on a
+different one.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import pymysql
+from django.conf import settings
+
+from .timeouts import SERVER_INTERRUPT_ERRORS
+
+# pymysql has no constant (or method) for it; MySQL 5.7.3+
+COM_RESET_CONNECTION = 0x1f
+
+
+class PoolTimeoutError(pymysql.err.OperationalError):
+    """Raised when no connection becomes available before the checkout timeout"""
+
+
+class PooledConnection:
+    """A raw pymysql connection plus the bookkeeping the pool needs"""
+
+    __slots__ = ('raw', 'schema', 'created_at', 'last_used')
+
+    def __init__(self, raw: pymysql.connections.Connection, schema: Optional[str]):
+        now = time.monotonic()
+        self.raw = raw
+        self.schema = schema
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Bounded pool of pymysql connections for one host/user pair.
+
+    - min_size connections are kept even when idle
+    - at most max_size connections exist at any time; extra callers wait
+    - connections idle for longer than idle_timeout are closed
+    - every checkout gets a clean session: COM_RESET_CONNECTION (which also
+      checks the connection is alive), then the right schema
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str,
+                 min_size: int = 1, max_size: int = 10, idle_timeout: float = 300,
+                 connect_timeout: int = 5,
+                 read_timeout: Optional[int] = None, charset: str = 'utf8mb4',
+                 init_command: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.charset = charset
+        self.init_command = init_command
+
+        self._idle: List[PooledConnection] = []
+        self._size = 0  # idle + checked out + being created
+        self._cond = threading.Condition(threading.Lock())
+        self._closed = False
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def connection(self, db_name: Optional[str] = None, timeout: Optional[float] = None):
+        """
+        Check out a connection switched to db_name and return it afterwards.
+        The connection is discarded instead of returned if the block raised a
+        connection-level error or left the socket closed.
+        """
+        conn = self.acquire(db_name, timeout=timeout)
+        discard = False
+        try:
+            yield conn.raw
+        except pymysql.err.OperationalError as e:
+            # A statement stopped by the server (time limit / KILL QUERY)
+            # leaves the connection usable; anything else may not
+            discard = not (e.args and e.args[0] in SERVER_INTERRUPT_ERRORS)
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def acquire(self, db_name: Optional[str] = None, timeout: Optional[float] = None,
+                read_timeout: Optional[float] = None) -> PooledConnection:
+        """
+        Check out a live connection; blocks up to timeout when the pool is full.
+        read_timeout overrides the pool's socket read timeout for this checkout
+        only (release() restores it).
+        """
+        if timeout is None:
+            timeout = self.connect_timeout
+        deadline = time.monotonic() + timeout
+
+        conn = None
+        with self._cond:
+            self._evict_idle_locked()
+            while True:
+                if self._closed:
+                    raise pymysql.err.InterfaceError('Connection pool is closed')
+                if self._idle:
+                    conn = self._pop_idle_locked(db_name)
+                    break
+                if self._size < self.max_size:
+                    # Reserve the slot now, connect outside the lock
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        2003, f"Timed out waiting for a database connection ({self.max_size} in use)"
+                    )
+                self._cond.wait(remaining)
+
+        try:
+            if conn is None:
+                conn = self._connect(db_name)
+            else:
+                conn = self._prepare(conn, db_name)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        if read_timeout is not None:
+            # pymysql applies _read_timeout to the socket before every read
+            conn.raw._read_timeout = read_timeout
+        return conn
+
+    def release(self, conn: PooledConnection, discard: bool = False):
+        """Return a connection to the pool (or close it if discard / broken)"""
+        if discard or self._closed or not conn.raw.open:
+            self._close_quietly(conn)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        conn.raw._read_timeout = self.read_timeout
+        conn.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close(self):
+        """Close all idle connections; checked-out ones are closed on release"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def open_side_connection(self) -> pymysql.connections.Connection:
+        """Unpooled connection with the same credentials (e.g. for KILL QUERY)"""
+        return pymysql.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            port=self.port,
+            charset=self.charset,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.connect_timeout,
+        )
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'max_size': self.max_size,
+            }
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _pop_idle_locked(self, db_name: Optional[str]) -> PooledConnection:
+        # Prefer a connection already on the requested schema (saves a
+        # COM_INIT_DB round trip); otherwise take the most recently used one.
+        for i in range(len(self._idle) - 1, -1, -1):
+            if self._idle[i].schema == db_name:
+                return self._idle.pop(i)
+        return self._idle.pop()
+
+    def _evict_idle_locked(self):
+        if self.idle_timeout is None or len(self._idle) == 0:
+            return
+        now = time.monotonic()
+        keep = []
+        evicted = []
+        # Oldest first, so the newest connections are the ones that survive
+        for conn in self._idle:
+            if now - conn.last_used > self.idle_timeout and self._size - len(evicted) > self.min_size:
+                evicted.append(conn)
+            else:
+                keep.append(conn)
+        if evicted:
+            self._idle = keep
+            self._size -= len(evicted)
+            for conn in evicted:
+                self._close_quietly(conn)
+
+    def _connect(self, db_name: Optional[str]) -> PooledConnection:
+        raw = pymysql.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=db_name,
+            port=self.port,
+            charset=self.charset,
+            init_command=self.init_command,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            autocommit=True,
+        )
+        return PooledConnection(raw, db_name)
+
+    def _prepare(self, conn: PooledConnection, db_name: Optional[str]) -> PooledConnection:
+        """Session reset for a connection taken from the idle list (a broken one is replaced)"""
+        try:
+            self._reset_session(conn.raw)
+            if db_name and conn.schema != db_name:
+                conn.raw.select_db(db_name)
+                conn.schema = db_name
+            return conn
+        except Exception:
+            # Never hand out (or leak) a connection whose state is unknown
+            self._close_quietly(conn)
+            return self._connect(db_name)
+
+    def _reset_session(self, raw: pymysql.connections.Connection):
+        """
+        Nothing the previous checkout did may reach the next one: COM_RESET_CONNECTION
+        rolls back, drops temporary tables, user variables, prepared statements
+        and GET_LOCK() locks, and restores session variables from the globals.
+        """
+        raw._execute_command(COM_RESET_CONNECTION, b'')
+        raw._read_ok_packet()
+        # Session variables are back at the server defaults: restore this pool's
+        raw.set_character_set(raw.charset, getattr(raw, 'collation', None))
+        if self.init_command:
+            with raw.cursor() as cursor:
+                cursor.execute(self.init_command)
+        raw.autocommit(True)
+
+    @staticmethod
+    def _close_quietly(conn: PooledConnection):
+        try:
+            conn.raw.close()
+        except Exception:
+            pass
+
+
+_pools: Dict[Tuple[str, int, str], ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_config: Dict, read_timeout: Optional[int] = None) -> ConnectionPool:
+    """
+    Return the shared pool for a settings.DATABASES-style config dict.
+    One pool per (host, port, user); the database name is chosen per checkout.
+    read_timeout only applies when the pool is first created.
+    """
+    port = int(db_config.get('PORT') or 3306)
+    key = (db_config['HOST'], port, db_config['USER'])
+
+    pool = _pools.get(key)
+    if pool is not None:
+        return pool
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            options = db_config.get('OPTIONS', {})
+            pool = ConnectionPool(
+                host=db_config['HOST'],
+                port=port,
+                user=db_config['USER'],
+                password=db_config['PASSWORD'],
+                min_size=getattr(settings, 'SQL_POOL_MIN_SIZE', 1),
+                max_size=getattr(settings, 'SQL_POOL_MAX_SIZE', 10),
+                idle_timeout=getattr(settings, 'SQL_POOL_IDLE_TIMEOUT', 300),
+                connect_timeout=5,
+                read_timeout=read_timeout,
+                charset=options.get('charset', 'utf8mb4'),
+                init_command=options.get('init_command'),
+            )
+            _pools[key] = pool
+        return pool
+
+
+def pool_stats() -> Dict[str, Dict]:
+    """Stats of every pool, keyed by user@host:port"""
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {f"{user}@{host}:{port}": pool.stats() for (host, port, user), pool in pools}
+
+
+def close_all_pools():
+    """Close every pool (used on shutdown and in tests)"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
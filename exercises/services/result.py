@@ -0,0 +1,89 @@
+"""
+Compact query result.
+
+Rows are kept exactly as the pymysql cursor returns them (tuples), with the
+column names stored once, instead of building a dict per row (DictCursor) and
+then a list per row. QueryResult still behaves like the result dicts used
+throughout the views (result['rows'], result.get('error'), dict(result)), so
+DRF renders it directly.
+"""
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+class QueryResult(Mapping):
+    """Result of SQLExecutor.execute(); read it like the old result dict"""
+
+    __slots__ = ('success', 'columns', 'rows', 'row_count', 'truncated', 'execution_time',
+                 'error', 'error_type', 'fingerprint', '_extra')
+
+    _FIELDS = ('success', 'columns', 'rows', 'row_count', 'truncated', 'execution_time', 'error')
+    _OPTIONAL = ('error_type', 'fingerprint')
+
+    def __init__(self, success: bool, columns: Sequence[str] = (), rows: Sequence[Tuple] = (),
+                 execution_time: float = 0, error: Optional[str] = None,
+                 error_type: Optional[str] = None, fingerprint: Optional[str] = None,
+                 row_count: Optional[int] = None, truncated: bool = False):
+        self.success = success
+        self.columns = list(columns)
+        self.rows = rows
+        # Rows the query produced; more than len(rows) when the capture was truncated
+        self.row_count = len(rows) if row_count is None else row_count
+        self.truncated = truncated
+        self.execution_time = execution_time
+        self.error = error
+        self.error_type = error_type
+        self.fingerprint = fingerprint
+        self._extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def failure(cls, error: str, error_type: str = 'error', execution_time: float = 0) -> 'QueryResult':
+        return cls(False, execution_time=execution_time, error=error, error_type=error_type)
+
+    # Mapping interface (compatibility with the result dicts)
+
+    def __getitem__(self, key: str):
+        if key in self._FIELDS or (key in self._OPTIONAL and getattr(self, key) is not None):
+            return getattr(self, key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        if key in self._FIELDS or key in self._OPTIONAL:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self._FIELDS
+        for key in self._OPTIONAL:
+            if getattr(self, key) is not None:
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        if self.success:
+            return f"<QueryResult {self.row_count} rows x {len(self.columns)} columns>"
+        return f"<QueryResult error={self.error!r}>"
+
+    def copy(self) -> 'QueryResult':
+        """Shallow copy; rows are shared (they are never modified in place)"""
+        other = QueryResult(self.success, self.columns, self.rows, self.execution_time,
+                            self.error, self.error_type, self.fingerprint,
+                            self.row_count, self.truncated)
+        if self._extra:
+            other._extra = dict(self._extra)
+        return other
+
+    def columnar(self) -> List[Tuple]:
+        """Column-major view of the rows (one tuple per column)"""
+        if not self.rows:
+            return [() for _ in self.columns]
+        return list(zip(*self.rows))
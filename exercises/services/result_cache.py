@@ -0,0 +1,151 @@
+"""
+Shared query-result cache for the read-only practice databases.
+
+Hundreds of students in a class run the same queries (`SELECT * FROM
+Products`) against the same chatsql_problem_N data, which never changes
+between reseeds. Results are cached across users, keyed by
+(database_name, data version, hash of the exact query text). Not the
+sql_normalize fingerprint: MySQL names columns after the select-list source
+text, so `count(*)` and `COUNT(*)` (or `a+b` and `a + b`) return different
+column names and must not share an entry.
+
+- bounded by total (estimated) bytes, least recently used evicted first
+- entries expire after a TTL
+- reseeding a database (data_version.bump_data_version) drops its entries
+- hit/miss/eviction counters are exposed via stats()
+
+Queries calling non-deterministic functions (NOW(), RAND(), ...) are never
+cached.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+from .data_version import get_data_version, on_data_version_change
+from .sql_lexer import WORD, tokenize
+
+NON_DETERMINISTIC_FUNCTIONS = frozenset([
+    'NOW', 'SYSDATE', 'CURDATE', 'CURTIME', 'UNIX_TIMESTAMP', 'UTC_DATE',
+    'UTC_TIME', 'UTC_TIMESTAMP', 'RAND', 'UUID', 'UUID_SHORT', 'CONNECTION_ID',
+    'USER', 'SESSION_USER', 'SYSTEM_USER', 'LAST_INSERT_ID', 'FOUND_ROWS',
+    'ROW_COUNT', 'SLEEP', 'BENCHMARK',
+])
+# These may also be written without parentheses
+NON_DETERMINISTIC_KEYWORDS = frozenset([
+    'CURRENT_DATE', 'CURRENT_TIME', 'CURRENT_TIMESTAMP', 'LOCALTIME',
+    'LOCALTIMESTAMP', 'CURRENT_USER',
+])
+
+
+def make_key(db_name: str, query: str) -> Optional[Tuple[str, str, bytes]]:
+    """Cache key for a query, or None if its result must not be cached"""
+    tokens = tokenize(query)
+    for i, token in enumerate(tokens):
+        if token.type == WORD:
+            name = token.upper
+            if name in NON_DETERMINISTIC_KEYWORDS:
+                return None
+            if name in NON_DETERMINISTIC_FUNCTIONS and i + 1 < len(tokens) and tokens[i + 1].value == '(':
+                return None
+    text = query.strip().rstrip(';').rstrip()
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    return db_name, get_data_version(db_name), digest
+
+
+def estimate_size(result) -> int:
+    """Rough in-memory size of a result in bytes (computed once per entry)"""
+    size = 256 + 64 * len(result['columns'])
+    for row in result['rows']:
+        size += 56 + 8 * len(row)
+        for value in row:
+            if isinstance(value, (str, bytes)):
+                size += 49 + len(value)
+            else:
+                size += 32
+    return size
+
+
+class QueryResultCache:
+    """Thread-safe LRU bounded by bytes, with TTL and per-database invalidation"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: 'OrderedDict[Tuple, Tuple[float, int, object]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, result = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: Tuple, result):
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (time.monotonic() + self.ttl, size, result)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate_database(self, db_name: str):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == db_name]:
+                self._bytes -= self._entries.pop(key)[1]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+result_cache = QueryResultCache(
+    max_bytes=getattr(settings, 'QUERY_RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+    ttl=getattr(settings, 'QUERY_RESULT_CACHE_TTL', 600),
+)
+on_data_version_change(result_cache.invalidate_database)
@@ -0,0 +1,105 @@
+"""
+SQL normalization and fingerprints.
+
+Cost-guard estimates, submission dedupe, grouping wrong answers and the
+slow-query log all need one identity per query that doesn't change with
+formatting. (Not the result cache: column names follow the exact text.) normalize()
+rewrites a query from its tokens (sql_lexer.tokenize, one pass):
+
+- keywords and function names upper-cased; identifiers, strings and numbers
+  kept as written
+- whitespace collapsed, comments and a trailing semicolon dropped
+- optionally literals replaced by '?' (IN lists become IN (...))
+
+fingerprint() is a stable signed 64-bit hash of the normalized text (fits a
+BIGINT column); template() is the literal-stripped form, so
+`WHERE price > 10` and `where price>20 ;` share a template.
+"""
+import hashlib
+import re
+from typing import List, NamedTuple, Sequence
+
+from .sql_lexer import COMMENT, NUMBER, SEMICOLON, STRING, WORD, Token, tokenize
+
+KEYWORDS = frozenset('''
+    ALL AND ANY AS ASC BETWEEN BINARY BY CASE CAST COLLATE CROSS CURRENT_DATE
+    CURRENT_TIME CURRENT_TIMESTAMP DESC DISTINCT DISTINCTROW DIV ELSE END ESCAPE
+    EXCEPT EXISTS FALSE FIRST FOLLOWING FOR FROM FULL GROUP HAVING IF IGNORE IN
+    INDEX INNER INTERSECT INTERVAL IS JOIN KEY LAST LATERAL LEFT LIKE LIMIT MOD
+    NATURAL NOT NULL NULLS OF OFFSET ON OR ORDER OUTER OVER PARTITION PRECEDING
+    RANGE RECURSIVE REGEXP RIGHT RLIKE ROLLUP ROW ROWS SELECT SEPARATOR SOME
+    STRAIGHT_JOIN THEN TRUE UNBOUNDED UNION UNKNOWN USE USING VALUES WHEN WHERE
+    WINDOW WITH XOR
+'''.split())
+
+PLACEHOLDER = '?'
+
+# No space before these / after these when the tokens are joined again
+_NO_SPACE_BEFORE = frozenset([',', ')', '.'])
+_NO_SPACE_AFTER = frozenset(['(', '.'])
+
+_IN_LIST_RE = re.compile(r'\bIN \(\?(?:, \?)*\)')
+
+
+class NormalizedQuery(NamedTuple):
+    text: str                   # normalized query
+    fingerprint: int            # 64-bit hash of text
+    template: str               # normalized with literals replaced by '?'
+    template_fingerprint: int   # 64-bit hash of template
+
+
+def normalize_tokens(tokens: Sequence[Token], strip_literals: bool = False) -> str:
+    tokens = [t for t in tokens if t.type != COMMENT and t.type != SEMICOLON]
+    parts: List[str] = []
+    call = False  # previous token was a function name
+    for i, token in enumerate(tokens):
+        kind = token.type
+        if kind == WORD:
+            upper = token.upper
+            # Keywords and function names are case-insensitive
+            is_call = upper not in KEYWORDS and i + 1 < len(tokens) and tokens[i + 1].value == '('
+            value = upper if upper in KEYWORDS or is_call else token.value
+        elif strip_literals and (kind == STRING or kind == NUMBER):
+            value = PLACEHOLDER
+            is_call = False
+        else:
+            value = token.value
+            is_call = False
+        if parts and not call and value not in _NO_SPACE_BEFORE and parts[-1] not in _NO_SPACE_AFTER:
+            parts.append(' ')
+        parts.append(value)
+        call = is_call
+    text = ''.join(parts)
+    if strip_literals:
+        text = _IN_LIST_RE.sub('IN (...)', text)
+    return text
+
+
+def normalize(query: str, strip_literals: bool = False) -> str:
+    return normalize_tokens(tokenize(query), strip_literals)
+
+
+def hash64(text: str) -> int:
+    """Stable signed 64-bit hash (same value in every process and release)"""
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def fingerprint(query: str) -> int:
+    return hash64(normalize(query))
+
+
+def fingerprint_tokens(tokens: Sequence[Token]) -> int:
+    return hash64(normalize_tokens(tokens))
+
+
+def template(query: str) -> str:
+    return normalize(query, strip_literals=True)
+
+
+def analyze(query: str) -> NormalizedQuery:
+    """Normalized text, template and both fingerprints (tokenizes once)"""
+    tokens = tokenize(query)
+    text = normalize_tokens(tokens)
+    stripped = normalize_tokens(tokens, strip_literals=True)
+    return NormalizedQuery(text, hash64(text), stripped, hash64(stripped))
@@ -0,0 +1,142 @@
+"""
+Embedded in-memory SQLite engine for practice databases.
+
+DatabaseSchema rows already carry schema_sql and seed_sql. For each schema
+this engine builds one in-memory SQLite database (the template) and serves
+every query from a private copy made with the sqlite3 backup API. Small
+practice datasets are then answered without any network round trip, and the
+engine doubles as a zero-dependency local backend for tests and benchmarks.
+
+- templates are keyed by db_name and rebuilt after the schema is saved or
+  its data version is bumped (reseed)
+- statements run through backends.EmbeddedSQLiteBackend (time limit via
+  set_progress_handler)
+- templates are evicted least-recently-used once their total size exceeds
+  EMBEDDED_SQL_MAX_BYTES
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from django.conf import settings
+
+from .data_version import on_data_version_change
+
+
+class _Template:
+    __slots__ = ('db_name', 'connection', 'size', 'lock')
+
+    def __init__(self, db_name: str, connection: sqlite3.Connection, size: int):
+        self.db_name = db_name
+        self.connection = connection
+        self.size = size
+        self.lock = threading.Lock()
+
+
+class EmbeddedSQLiteEngine:
+    """Per-schema in-memory SQLite templates plus per-request clones"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._templates: 'OrderedDict[str, _Template]' = OrderedDict()
+        self._missing: Dict[str, float] = {}  # db_name -> time of last failed lookup
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Templates
+    # ------------------------------------------------------------------
+
+    def has_schema(self, db_name: str) -> bool:
+        """True if a DatabaseSchema exists for db_name (negative lookups cached for 60 s)"""
+        with self._lock:
+            if db_name in self._templates:
+                return True
+            missing_since = self._missing.get(db_name)
+        if missing_since is not None and time.monotonic() - missing_since < 60:
+            return False
+        return self._template(db_name) is not None
+
+    def _template(self, db_name: str) -> Optional[_Template]:
+        with self._lock:
+            template = self._templates.get(db_name)
+            if template is not None:
+                self._templates.move_to_end(db_name)
+                return template
+
+        # Build outside the main lock; one build at a time is plenty
+        with self._build_lock:
+            with self._lock:
+                template = self._templates.get(db_name)
+            if template is not None:
+                return template
+            template = self._build(db_name)
+            with self._lock:
+                if template is None:
+                    self._missing[db_name] = time.monotonic()
+                    return None
+                self._missing.pop(db_name, None)
+                self._templates[db_name] = template
+                self._bytes += template.size
+                self._evict_locked()
+            return template
+
+    @staticmethod
+    def _build(db_name: str) -> Optional[_Template]:
+        from exercises.models import DatabaseSchema
+
+        schema = DatabaseSchema.objects.filter(db_name=db_name).order_by('-updated_at').first()
+        if schema is None:
+            return None
+
+        connection = sqlite3.connect(':memory:', check_same_thread=False)
+        if schema.schema_sql:
+            connection.executescript(schema.schema_sql)
+        if schema.seed_sql:
+            connection.executescript(schema.seed_sql)
+        connection.commit()
+        page_count = connection.execute('PRAGMA page_count').fetchone()[0]
+        page_size = connection.execute('PRAGMA page_size').fetchone()[0]
+        return _Template(db_name, connection, page_count * page_size)
+
+    def _evict_locked(self):
+        while self._bytes > self.max_bytes and len(self._templates) > 1:
+            _, template = self._templates.popitem(last=False)
+            self._bytes -= template.size
+            template.connection.close()
+
+    def invalidate(self, db_name: str):
+        """Drop the template so the next query rebuilds it from DatabaseSchema"""
+        with self._lock:
+            template = self._templates.pop(db_name, None)
+            self._missing.pop(db_name, None)
+            if template is not None:
+                self._bytes -= template.size
+        if template is not None:
+            with template.lock:
+                template.connection.close()
+
+    def clone(self, db_name: str) -> sqlite3.Connection:
+        """Private in-memory copy of the template (sqlite3 backup API)"""
+        template = self._template(db_name)
+        if template is None:
+            raise ValueError(f"No DatabaseSchema for embedded database: {db_name}")
+        copy = sqlite3.connect(':memory:', check_same_thread=False)
+        with template.lock:
+            template.connection.backup(copy)
+        return copy
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'templates': len(self._templates),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+embedded_engine = EmbeddedSQLiteEngine(getattr(settings, 'EMBEDDED_SQL_MAX_BYTES', 64 * 1024 * 1024))
+on_data_version_change(embedded_engine.invalidate)
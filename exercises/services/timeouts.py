@@ -0,0 +1,210 @@
+"""
+Server-side statement timeouts.
+
+pymysql's read_timeout only makes the client stop waiting; MySQL keeps running
+the statement. Two layers stop it on the server:
+
+1. with_time_limit() adds a MAX_EXECUTION_TIME optimizer hint to the
+   statement, so MySQL aborts it itself (error 3024).
+2. QueryWatchdog is a single background thread that sends
+   `KILL QUERY <thread_id>` over a side connection when a statement is still
+   running a short grace period after its deadline (error 1317). Cancellation
+   uses the same mechanism to stop a statement that is no longer needed.
+
+Both errors come back from SQLExecutor as error_type 'timeout' (or
+'cancelled'), distinct from ordinary SQL errors.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+import pymysql
+
+logger = logging.getLogger(__name__)
+
+ER_QUERY_TIMEOUT = 3024      # maximum statement execution time exceeded
+ER_QUERY_INTERRUPTED = 1317  # KILL QUERY
+CR_SERVER_LOST = 2013        # client read_timeout fired
+
+# Server-side interrupts leave the connection usable
+SERVER_INTERRUPT_ERRORS = (ER_QUERY_TIMEOUT, ER_QUERY_INTERRUPTED)
+
+
+class QueryTimeoutError(pymysql.err.OperationalError):
+    """A statement was stopped because it ran past its time limit"""
+
+
+class QueryCancelledError(pymysql.err.OperationalError):
+    """A statement was stopped because its result was no longer needed"""
+
+
+def with_time_limit(query: str, seconds: float) -> str:
+    """
+    Insert `/*+ MAX_EXECUTION_TIME(ms) */` after the leading SELECT.
+    Only call this on validated queries (validate_query guarantees the SELECT).
+    """
+    stripped = query.lstrip()
+    if stripped[:6].upper() != 'SELECT':
+        return query
+    pos = len(query) - len(stripped) + 6
+    return f"{query[:pos]} /*+ MAX_EXECUTION_TIME({int(seconds * 1000)}) */{query[pos:]}"
+
+
+def error_type(e: Exception, watch: 'Watch' = None) -> str:
+    """'timeout', 'cancelled' or 'error' for an exception raised while executing"""
+    if isinstance(e, QueryCancelledError) or (watch is not None and watch.cancelled):
+        return 'cancelled'
+    if isinstance(e, QueryTimeoutError):
+        return 'timeout'
+    code = e.args[0] if e.args else None
+    if code in (ER_QUERY_TIMEOUT, ER_QUERY_INTERRUPTED, CR_SERVER_LOST):
+        return 'timeout'
+    return 'error'
+
+
+class Watch:
+    """One statement under watch; killed at its deadline or when cancelled"""
+
+    __slots__ = ('deadline', 'thread_id', 'pool', 'state', 'cancelled', '_done')
+
+    ARMED, FIRING, FINISHED = 'armed', 'firing', 'finished'
+
+    def __init__(self, deadline: float, thread_id: int, pool):
+        self.deadline = deadline
+        self.thread_id = thread_id
+        self.pool = pool
+        self.state = Watch.ARMED
+        self.cancelled = False
+        self._done = threading.Event()
+
+
+class QueryWatchdog:
+    """Background thread issuing KILL QUERY for statements past their deadline"""
+
+    def __init__(self, grace: float = 0.5):
+        self.grace = grace
+        self._heap: List = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition(threading.Lock())
+        self._thread: Optional[threading.Thread] = None
+
+    @contextmanager
+    def watch(self, connection, pool, timeout: float, cancellation: 'Cancellation' = None):
+        """
+        Watch the statements run on connection inside the block.
+        The connection must not be returned to the pool before the block exits:
+        exiting waits for an in-flight KILL so it can never hit a reused connection.
+        """
+        watch = self.start(connection.thread_id(), pool, timeout)
+        if cancellation is not None:
+            cancellation.attach(self, watch)
+        try:
+            yield watch
+        finally:
+            if cancellation is not None:
+                cancellation.detach(watch)
+            if self.finish(watch):
+                watch._done.wait()
+
+    def start(self, thread_id: int, pool, timeout: float) -> Watch:
+        """
+        Watch MySQL thread thread_id until finish(); pool.open_side_connection()
+        provides the connection the KILL is sent over
+        """
+        watch = Watch(time.monotonic() + timeout + self.grace, thread_id, pool)
+        with self._cond:
+            self._ensure_thread()
+            heapq.heappush(self._heap, (watch.deadline, next(self._seq), watch))
+            self._cond.notify()
+        return watch
+
+    def finish(self, watch: Watch) -> bool:
+        """
+        Stop watching. True if a KILL is in flight: the connection must not run
+        anything else until watch._done is set (or must be closed instead).
+        """
+        with self._cond:
+            firing = watch.state == Watch.FIRING
+            watch.state = Watch.FINISHED
+        return firing
+
+    def kill_now(self, watch: Watch):
+        """Kill the watched statement immediately (used for cancellation)"""
+        with self._cond:
+            if watch.state != Watch.ARMED:
+                return
+            watch.state = Watch.FIRING
+            watch.cancelled = True
+        threading.Thread(target=self._kill, args=(watch,), daemon=True).start()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='sql-watchdog', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    # Drop finished watches from the top of the heap
+                    while self._heap and self._heap[0][2].state != Watch.ARMED:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        watch = heapq.heappop(self._heap)[2]
+                        watch.state = Watch.FIRING
+                        break
+                    self._cond.wait(delay)
+            self._kill(watch)
+
+    def _kill(self, watch: Watch):
+        try:
+            side = watch.pool.open_side_connection()
+            try:
+                with side.cursor() as cursor:
+                    cursor.execute(f"KILL QUERY {int(watch.thread_id)}")
+            finally:
+                side.close()
+            logger.warning(f"Killed runaway query on MySQL thread {watch.thread_id}")
+        except pymysql.MySQLError as e:
+            # Statement already finished, or no permission; read_timeout still applies
+            logger.info(f"KILL QUERY {watch.thread_id} failed: {e}")
+        finally:
+            watch._done.set()
+
+
+class Cancellation:
+    """Lets one thread stop the statements another thread is running"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watches = {}
+        self.cancelled = False
+
+    def attach(self, watchdog: QueryWatchdog, watch: Watch):
+        with self._lock:
+            self._watches[watch] = watchdog
+            cancelled = self.cancelled
+        if cancelled:
+            watchdog.kill_now(watch)
+
+    def detach(self, watch: Watch):
+        with self._lock:
+            self._watches.pop(watch, None)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            watches = list(self._watches.items())
+        for watch, watchdog in watches:
+            watchdog.kill_now(watch)
+
+
+watchdog = QueryWatchdog()
@@ -0,0 +1,140 @@
+"""
+Hidden dataset variants.
+
+Grading only against the visible chatsql_problem_N data lets hard-coded or
+lucky queries pass. A problem database can have hidden siblings with the same
+schema and different rows, named `<database_name>__v<K>`:
+
+- MySQL: sibling schemas (chatsql_problem_1__v1, chatsql_problem_1__v2, ...)
+- embedded SQLite: DatabaseSchema snapshots with those db_names
+
+grading.py runs the submission against every variant concurrently with the
+visible dataset; each variant has its own cached expected result.
+Discovered variants are cached per database for SQL_GRADING_VARIANTS_TTL
+seconds (and dropped when a variant is reseeded).
+"""
+import logging
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pymysql
+from django.conf import settings
+
+from .data_version import on_data_version_change
+
+logger = logging.getLogger(__name__)
+
+VARIANT_SEPARATOR = '__v'
+_VARIANT_RE = re.compile(r'^(?P<base>.+)__v(?P<index>\d+)$')
+
+
+def variant_name(db_name: str, index: int) -> str:
+    return f"{db_name}{VARIANT_SEPARATOR}{index}"
+
+
+def base_database(db_name: str) -> Optional[str]:
+    """chatsql_problem_1 for chatsql_problem_1__v2; None if db_name isn't a variant"""
+    match = _VARIANT_RE.match(db_name)
+    return match.group('base') if match else None
+
+
+def _sorted_variants(db_name: str, names) -> List[str]:
+    indexed = []
+    for name in names:
+        match = _VARIANT_RE.match(name)
+        if match and match.group('base') == db_name:
+            indexed.append((int(match.group('index')), name))
+    return [name for _, name in sorted(indexed)]
+
+
+class VariantRegistry:
+    """Thread-safe TTL cache of the hidden variants of each database"""
+
+    def __init__(self, ttl: float = 300, max_variants: int = 4):
+        self.ttl = ttl
+        self.max_variants = max_variants
+        self._entries: Dict[Tuple[str, str], Tuple[float, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def variants(self, executor) -> List[str]:
+        """Variant database names for executor's database (same engine only)"""
+        key = (executor.engine, executor.db_name)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+        names = _sorted_variants(executor.db_name, self._discover(executor))[:self.max_variants]
+        with self._lock:
+            self._entries[key] = (now + self.ttl, names)
+        return names
+
+    def invalidate_database(self, db_name: str):
+        base = base_database(db_name) or db_name
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == base]:
+                del self._entries[key]
+
+    @staticmethod
+    def _discover(executor) -> List[str]:
+        prefix = f"{executor.db_name}{VARIANT_SEPARATOR}"
+        if executor.engine == 'mysql':
+            pattern = prefix.replace('\\', '\\\\').replace('_', '\\_').replace('%', '\\%') + '%'
+            try:
+                with executor.backend.pool.connection() as connection:
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            'SELECT SCHEMA_NAME FROM information_schema.SCHEMATA WHERE SCHEMA_NAME LIKE %s',
+                            [pattern]
+                        )
+                        return [row[0] for row in cursor.fetchall()]
+            except pymysql.MySQLError as e:
+                # Grading still works on the visible dataset
+                logger.warning(f"Could not list dataset variants of {executor.db_name}: {e}")
+                return []
+        if executor.engine == 'embedded':
+            from exercises.models import DatabaseSchema
+            return list(DatabaseSchema.objects.filter(db_name__startswith=prefix)
+                        .values_list('db_name', flat=True).distinct())
+        return []
+
+
+variant_registry = VariantRegistry(
+    ttl=getattr(settings, 'SQL_GRADING_VARIANTS_TTL', 300),
+    max_variants=getattr(settings, 'SQL_GRADING_VARIANTS_MAX', 4),
+)
+on_data_version_change(variant_registry.invalidate_database)
+
+
+def hidden_variants(executor) -> List[str]:
+    if not getattr(settings, 'SQL_GRADING_VARIANTS', True):
+        return []
+    return variant_registry.variants(executor)
+
+
+def variant_problem(problem: Dict, db_name: str) -> Dict:
+    """The problem as graded on one variant (expected result cached per variant)"""
+    return {
+        **problem,
+        'database_name': db_name,
+        'variant': db_name,
+        # problems.expected_result only materializes the visible dataset
+        'expected_result': None,
+    }
+
+
+def variant_targets(executor, problem: Dict) -> List[Tuple[object, Dict]]:
+    """(executor, problem) for each hidden variant graded alongside executor's database"""
+    targets = []
+    for name in hidden_variants(executor):
+        try:
+            variant_executor = type(executor)(name)
+        except ValueError as e:
+            logger.warning(f"Skipping dataset variant {name}: {e}")
+            continue
+        # Engines render values differently; a variant must be graded like the visible dataset
+        if variant_executor.engine == executor.engine:
+            targets.append((variant_executor, variant_problem(problem, name)))
+    return targets
@@ -0,0 +1,1075 @@
+import asyncio
+import gzip
+import itertools
+import json
+import sqlite3
+import threading
+import time
+import warnings
+from unittest import mock
+
+import pymysql
+from asgiref.sync import async_to_sync
+from django.db import connection, router
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from chatsql.routers import system_connection, system_db_alias
+from .models import DatabaseSchema, DataVersion, Problem
+from .services.canonical import canonicalize
+from .services.capture import ResultCapture
+from .services.cost_guard import CostGuard, estimate_from_plan
+from .services.data_version import DataVersions
+from .services import async_executor, grading
+from .services.backends import MySQLPoolBackend
+from .services.pool import COM_RESET_CONNECTION, ConnectionPool, PooledConnection, PoolTimeoutError
+from .services.admission import AdmissionController, AdmissionRejected, client_ip
+from .services.catalog import ProblemCatalog, problem_catalog
+from .services.executor import SQLExecutor
+from .services.expected_cache import get_expected_result, invalidate_problem
+from .services.fingerprint import fingerprint_rows
+from .services.grading import grade_submission
+from .services.result_cache import make_key as result_cache_key
+from .services.sql_lexer import tokenize
+from .services.sql_normalize import fingerprint
+from . import views
+from .views import _submissions_have_fingerprint, stream_query_response
+
+
+class ProblemCatalogTestCase(TestCase):
+    """Creates the chatsql_system tables the problem catalog reads"""
+
+    @classmethod
+    def setUpTestData(cls):
+        # problems / problem_tables live in chatsql_system and aren't managed by migrations;
+        # created inside the test transaction, so they are rolled back afterwards
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TABLE problems (id bigint PRIMARY KEY, title varchar(255), difficulty varchar(50), '
+                'tag varchar(255), description text, database_name varchar(255), expected_query text, '
+                'expected_result text, created_at datetime)'
+            )
+            cursor.execute(
+                'CREATE TABLE problem_tables (id integer PRIMARY KEY, problem_id bigint, '
+                'table_name varchar(255), table_schema text, sample_data text, display_order integer)'
+            )
+
+    def setUp(self):
+        problem_catalog.invalidate()
+        self.addCleanup(problem_catalog.invalidate)
+
+    def add_problems(self, count):
+        start = Problem.objects.count() + 1
+        with connection.cursor() as cursor:
+            for problem_id in range(start, start + count):
+                cursor.execute(
+                    'INSERT INTO problems (id, title, difficulty, tag, description, database_name, expected_query) '
+                    'VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                    [problem_id, f'Problem {problem_id}', ('Easy', 'Hard')[problem_id % 2], 'JOIN', 'description',
+                     f'chatsql_problem_{problem_id}', 'SELECT 1']
+                )
+                for order in (1, 2):
+                    cursor.execute(
+                        'INSERT INTO problem_tables (problem_id, table_name, table_schema, sample_data, display_order) '
+                        'VALUES (%s, %s, %s, %s, %s)',
+                        [problem_id, f'table_{problem_id}_{order}', '', '', order]
+                    )
+
+
+def add_database(db_name, seed_sql, schema_sql='CREATE TABLE t (id integer PRIMARY KEY, v integer);'):
+    """DatabaseSchema served by the embedded SQLite engine (no MySQL configured in tests)"""
+    DatabaseSchema.objects.create(name=db_name, display_name=db_name, description='', db_name=db_name,
+                                  schema_sql=schema_sql, seed_sql=seed_sql)
+
+
+class ExerciseListQueryCountTest(ProblemCatalogTestCase):
+    """The exercise list costs the same number of queries for any number of problems"""
+
+    def list_queries(self):
+        problem_catalog.invalidate()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/exercises/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_query_count_is_constant(self):
+        self.add_problems(3)
+        few, data = self.list_queries()
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[0]['schema']['tables'], ['table_1_1', 'table_1_2'])
+
+        self.add_problems(40)
+        many, data = self.list_queries()
+        self.assertEqual(len(data), 43)
+        self.assertEqual(few, many)
+
+    def test_catalog_is_reused(self):
+        self.add_problems(5)
+        self.list_queries()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/exercises/')
+        # Served from the pre-rendered snapshot of the in-memory catalog
+        self.assertEqual(len(queries), 0)
+
+
+class ExerciseListPaginationTest(ProblemCatalogTestCase):
+
+    def test_full_list_without_pagination_params(self):
+        self.add_problems(5)
+        data = self.client.get('/api/exercises/').json()
+        self.assertEqual([item['id'] for item in data], [1, 2, 3, 4, 5])
+
+    def test_keyset_pages(self):
+        self.add_problems(5)
+        page = self.client.get('/api/exercises/?limit=2').json()
+        self.assertEqual(page['count'], 5)
+        self.assertEqual([item['id'] for item in page['results']], [1, 2])
+        seen = [1, 2]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            seen += [item['id'] for item in page['results']]
+        self.assertEqual(seen, [1, 2, 3, 4, 5])
+
+        page = self.client.get('/api/exercises/?after_id=3').json()
+        self.assertEqual([item['id'] for item in page['results']], [4, 5])
+        self.assertIsNone(page['next'])
+
+    def test_filters_and_fields(self):
+        self.add_problems(6)
+        page = self.client.get('/api/exercises/?difficulty=hard&tag=jo&limit=2&fields=id,difficulty').json()
+        self.assertEqual(page['count'], 3)
+        self.assertEqual(page['results'], [{'id': 1, 'difficulty': 'hard'}, {'id': 3, 'difficulty': 'hard'}])
+        self.assertIn('after_id=3', page['next'])
+
+    def test_invalid_params(self):
+        self.assertEqual(self.client.get('/api/exercises/?fields=id,secret').status_code, 400)
+        self.assertEqual(self.client.get('/api/exercises/?after_id=x').status_code, 400)
+
+
+class ExerciseListSnapshotTest(ProblemCatalogTestCase):
+
+    def test_etag_and_not_modified(self):
+        self.add_problems(3)
+        response = self.client.get('/api/exercises/')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(self.client.get('/api/exercises/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # A new catalog version renders new bytes
+        self.add_problems(1)
+        problem_catalog.invalidate()
+        response = self.client.get('/api/exercises/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+
+    def test_gzip(self):
+        self.add_problems(3)
+        plain = self.client.get('/api/exercises/')
+        compressed = self.client.get('/api/exercises/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertNotEqual(compressed['ETag'], plain['ETag'])
+
+
+class SystemDatabaseTest(ProblemCatalogTestCase):
+    """chatsql_system is reached through its own alias, never by switching schemas with USE"""
+
+    def assertNoUse(self, queries):
+        self.assertEqual([q['sql'] for q in queries if q['sql'].lstrip().upper().startswith('USE ')], [])
+
+    def test_problem_model_is_routed(self):
+        self.assertEqual(router.db_for_read(Problem), system_db_alias())
+        self.assertEqual(router.db_for_write(Problem), system_db_alias())
+
+    def test_detail_is_one_query(self):
+        self.add_problems(2)
+        self.client.get('/api/exercises/')  # loads the catalog
+        with CaptureQueriesContext(system_connection()) as queries:
+            response = self.client.get('/api/exercises/2/')
+        self.assertEqual(response.status_code, 200)
+        # problem_tables only: the problem comes from the catalog, and no USE round trip
+        self.assertEqual(len(queries), 1)
+        self.assertNoUse(queries)
+
+    def test_catalog_and_completion_queries(self):
+        self.add_problems(2)
+        session = self.client.session
+        session['user_id'] = 1
+        session.save()
+        with CaptureQueriesContext(system_connection()) as queries:
+            self.client.get('/api/exercises/')
+            self.client.get('/api/exercises/completion/')
+        # version probe + problems + problem_tables, then the completion query
+        # (locally sessions share the connection; only system-table statements are counted)
+        system = [q for q in queries if any(t in q['sql'] for t in (' problems', ' problem_tables', ' submissions'))]
+        self.assertEqual(len(system), 4, [q['sql'] for q in system])
+        self.assertNoUse(queries)
+
+
+class CanonicalFormTest(SimpleTestCase):
+    """Queries with the same canonical form return the same rows (grading trusts a match without running it)"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Every combination of 0/1 for a..h, so any difference in logic shows up as a different row set
+        cls.db = sqlite3.connect(':memory:')
+        cls.db.execute('CREATE TABLE t (id integer PRIMARY KEY, a, b, c, d, e, f, g, h)')
+        cls.db.executemany('INSERT INTO t (a, b, c, d, e, f, g, h) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                           itertools.product((0, 1), repeat=8))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.db.close()
+        super().tearDownClass()
+
+    def rows(self, query):
+        return sorted(self.db.execute(query).fetchall())
+
+    def assertSameForm(self, first, second):
+        self.assertIsNotNone(canonicalize(first))
+        self.assertEqual(canonicalize(first), canonicalize(second))
+        self.assertEqual(self.rows(first), self.rows(second))
+
+    def assertDifferentForm(self, first, second):
+        self.assertNotEqual(canonicalize(first), canonicalize(second))
+        self.assertNotEqual(self.rows(first), self.rows(second))
+
+    def test_equivalent_spellings(self):
+        self.assertSameForm('select x.id from t x where x.b = 1 and x.a > 0 order by x.id',
+                            'SELECT id FROM t WHERE 0 < a AND 1 = b')
+        self.assertSameForm('SELECT id FROM t WHERE a = 1 OR (b = 1 AND c = 1)',
+                            'SELECT id FROM t WHERE c = 1 AND b = 1 OR a = 1')
+        self.assertSameForm('SELECT id FROM t WHERE a BETWEEN 1 AND 3 AND b = 1',
+                            'SELECT id FROM t WHERE b = 1 AND a BETWEEN 1 AND 3')
+
+    def test_precedence(self):
+        self.assertDifferentForm('SELECT id FROM t WHERE a = 1 OR b = 1 AND c = 1',
+                                 'SELECT id FROM t WHERE (a = 1 OR b = 1) AND c = 1')
+
+    def test_case_bodies_are_not_reordered(self):
+        # AND inside CASE ... END isn't top-level: moving operands between the CASEs changes the rows
+        self.assertDifferentForm(
+            'SELECT id FROM t WHERE CASE WHEN a = 1 THEN b = 1 AND c = 1 ELSE g = 1 END '
+            'AND CASE WHEN d = 1 THEN e = 1 AND f = 1 ELSE h = 1 END',
+            'SELECT id FROM t WHERE CASE WHEN a = 1 THEN b = 1 AND f = 1 ELSE h = 1 END '
+            'AND CASE WHEN d = 1 THEN e = 1 AND c = 1 ELSE g = 1 END'
+        )
+        self.assertDifferentForm('SELECT id FROM t WHERE CASE WHEN a = 1 THEN b ELSE c END = 1 OR d = 1',
+                                 'SELECT id FROM t WHERE CASE WHEN a = 1 THEN b ELSE d END = 1 OR c = 1')
+        # Whole CASE conditions are still sorted as top-level operands
+        self.assertSameForm('SELECT id FROM t WHERE CASE WHEN a = 1 THEN b ELSE c END = 1 AND d = 1',
+                            'SELECT id FROM t WHERE d = 1 AND 1 = CASE WHEN a = 1 THEN b ELSE c END')
+
+    def test_unsupported(self):
+        self.assertIsNone(canonicalize('SELECT id FROM t WHERE a IN (SELECT b FROM t)'))
+        self.assertIsNone(canonicalize('SELECT id FROM t UNION SELECT a FROM t'))
+        # Invalid in MySQL (the ON can't see t1), but would match the valid spelling below
+        self.assertIsNone(canonicalize('SELECT t1.a, t3.b FROM t t1, t t2 JOIN t t3 ON t1.id = t3.id'))
+        self.assertIsNotNone(canonicalize('SELECT t1.a, t3.b FROM t t1 JOIN t t2 JOIN t t3 ON t1.id = t3.id'))
+
+
+class AsyncStreamTest(SimpleTestCase):
+    """Async views stream chunks as they are read instead of buffering the whole result"""
+
+    class Executor:
+        def __init__(self):
+            self.read = 0
+
+        def stream(self, query):
+            yield 'header', ['id']
+            for i in range(3):
+                self.read += 1
+                yield 'rows', [[i]]
+            yield 'stats', {'row_count': 3, 'execution_time': 0, 'truncated': False}
+
+    def test_chunks_are_pulled_lazily(self):
+        executor = self.Executor()
+        closed = []
+        response = stream_query_response(executor, 'SELECT id FROM t', on_close=lambda held: closed.append(True),
+                                         asynchronous=True)
+        self.assertTrue(response.is_async)
+
+        async def first_two():
+            parts = []
+            async for part in response:
+                parts.append(part)
+                if len(parts) == 2:
+                    break
+            return parts
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')  # Django warns when it has to buffer a sync iterator
+            parts = async_to_sync(first_two)()
+        self.assertEqual(json.loads(parts[1]), {'type': 'rows', 'rows': [[0]]})
+        self.assertEqual(executor.read, 1)
+
+        response.close()
+        self.assertEqual(closed, [True])
+
+
+@override_settings(SQL_GRADING_VARIANTS=True)
+class VariantGradingTest(ProblemCatalogTestCase):
+    """Submissions are also graded on the hidden variants of the problem database"""
+
+    def setUp(self):
+        super().setUp()
+        schema_sql = 'CREATE TABLE t (id integer PRIMARY KEY, v integer);'
+        for db_name, seed_sql in (('practice_variant', 'INSERT INTO t VALUES (1, 10), (2, 20), (3, 30);'),
+                                  ('practice_variant__v1', 'INSERT INTO t VALUES (1, 16), (2, 15), (3, 40);')):
+            DatabaseSchema.objects.create(name=db_name, display_name=db_name, description='', db_name=db_name,
+                                          schema_sql=schema_sql, seed_sql=seed_sql)
+        self.problem = {'id': 9001, 'database_name': 'practice_variant',
+                        'expected_query': 'SELECT id FROM t WHERE v >= 16'}
+
+    def grade(self, query):
+        user_result, comparison = grade_submission(SQLExecutor('practice_variant'), self.problem, query)
+        self.assertTrue(user_result['success'], user_result.get('error'))
+        return comparison['correct']
+
+    def test_hard_coded_answer_fails_on_variant(self):
+        self.assertFalse(self.grade('SELECT id FROM t WHERE id IN (2, 3)'))
+        self.assertTrue(self.grade('SELECT id FROM t WHERE v >= 16'))
+
+    def test_correct_form_is_not_trusted_on_new_variants(self):
+        self.addCleanup(invalidate_problem, 9001)
+        # Graded (and remembered) correct while no hidden variant was checked
+        with override_settings(SQL_GRADING_VARIANTS=False):
+            self.assertTrue(self.grade('SELECT id FROM t WHERE id IN (2, 3)'))
+        self.assertFalse(self.grade('SELECT id FROM t WHERE id IN (2, 3)'))
+
+    def test_variant_uses_checksum_only(self):
+        executor = mock.Mock()
+        executor.checksum.return_value = {'success': True}
+        executor.compare_checksums.return_value = {'correct': True}
+        expected = {'success': True, 'checksum': 1}
+        with mock.patch.object(grading, '_run_expected_side', return_value=expected):
+            self.assertTrue(grading._grade_variant(executor, {'variant': 'v1'}, 'SELECT 1', True,
+                                                   grading.Cancellation()))
+        executor.checksum.assert_called_once()
+        executor.execute.assert_not_called()
+
+
+class QueryFingerprintTest(TestCase):
+
+    def test_formatting_is_ignored(self):
+        self.assertEqual(fingerprint('select id from t where a = 1'),
+                         fingerprint('SELECT  id\nFROM t -- comment\n WHERE a=1;'))
+        self.assertNotEqual(fingerprint('SELECT id FROM t WHERE a = 1'), fingerprint('SELECT id FROM t WHERE a = 2'))
+        self.assertNotEqual(fingerprint("SELECT id FROM t WHERE a = '1'"), fingerprint('SELECT id FROM t WHERE a = 1'))
+
+    def test_result_cache_key_keeps_spelling(self):
+        # MySQL names the column after the source text: count(*) and COUNT(*) are different results
+        self.assertNotEqual(result_cache_key('practice', 'SELECT count(*) FROM t'),
+                            result_cache_key('practice', 'SELECT COUNT(*) FROM t'))
+        self.assertNotEqual(result_cache_key('practice', 'SELECT a+b FROM t'),
+                            result_cache_key('practice', 'SELECT a + b FROM t'))
+        self.assertEqual(result_cache_key('practice', 'SELECT a FROM t'),
+                         result_cache_key('practice', ' SELECT a FROM t; '))
+        self.assertIsNone(result_cache_key('practice', 'SELECT NOW()'))
+
+    def test_system_submissions_column(self):
+        _submissions_have_fingerprint.cache_clear()
+        self.addCleanup(_submissions_have_fingerprint.cache_clear)
+        self.assertTrue(_submissions_have_fingerprint())
+
+
+class AdmissionTest(ProblemCatalogTestCase):
+    """A burst beyond the connection budget is turned away with 429, it doesn't block on the pool"""
+
+    def controller(self, max_concurrent):
+        return AdmissionController(max_concurrent=max_concurrent, max_per_user=10, max_per_problem=10,
+                                   queue_timeout=0.05)
+
+    def test_requests_are_charged_their_connections(self):
+        admission = self.controller(max_concurrent=6)
+        submit = admission.acquire('a', 1, cost=4)  # user + expected + 2 variants
+        with self.assertRaises(AdmissionRejected) as rejected:
+            admission.acquire('b', 1, cost=4)
+        self.assertEqual(rejected.exception.reason, 'queue_timeout')
+        execute = admission.acquire('c', 1)
+        self.assertEqual(admission.stats()['connections'], 5)
+        admission.release(submit)
+        admission.release(execute)
+        # Costlier than the whole limit: runs, alone
+        admission.release(admission.acquire('d', 1, cost=100))
+        self.assertEqual(admission.stats()['connections'], 0)
+
+    def test_burst(self):
+        admission = self.controller(max_concurrent=6)
+        outcomes = []
+
+        def submit(user):
+            try:
+                with admission.admit(user, 1, cost=3):
+                    time.sleep(0.3)
+                outcomes.append('ran')
+            except AdmissionRejected as e:
+                outcomes.append(e.reason)
+
+        threads = [threading.Thread(target=submit, args=(user,)) for user in range(6)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(outcomes), ['queue_timeout'] * 4 + ['ran'] * 2)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_rejected_submit_is_429(self):
+        self.add_problems(1)
+        DatabaseSchema.objects.create(name='problem_1', display_name='problem_1', description='',
+                                      db_name='chatsql_problem_1', schema_sql='CREATE TABLE t (id integer);',
+                                      seed_sql='INSERT INTO t VALUES (1);')
+        admission = self.controller(max_concurrent=2)
+        held = admission.acquire('other', 1, cost=2)
+        self.addCleanup(admission.release, held)
+        with mock.patch.object(views, 'admission', admission):
+            response = self.client.post('/api/exercises/1/submit/', {'query': 'SELECT id FROM t'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.json()['reason'], 'queue_timeout')
+
+    def test_charged_for_connection_time(self):
+        admission = AdmissionController(budget=1, refill_rate=0.001)
+        # e.g. a stream whose client kept downloading after the query was done
+        admission.release(admission.acquire('a', 1), charged=0)
+        admission.release(admission.acquire('a', 1), charged=2)
+        with self.assertRaises(AdmissionRejected) as rejected:
+            admission.acquire('a', 1)
+        self.assertEqual(rejected.exception.reason, 'budget')
+
+    @override_settings(SQL_ADMISSION_TRUSTED_PROXIES=['10.0.0.1', '10.0.0.2'])
+    def test_client_ip_behind_proxy(self):
+        factory = RequestFactory()
+        # Whatever the client put in the header itself is left of what our proxies added
+        request = factory.get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='6.6.6.6, 1.2.3.4, 10.0.0.2')
+        self.assertEqual(client_ip(request), '1.2.3.4')
+        request = factory.get('/', REMOTE_ADDR='5.5.5.5', HTTP_X_FORWARDED_FOR='6.6.6.6')
+        self.assertEqual(client_ip(request), '5.5.5.5')
+
+
+class FakeCursor:
+    """pymysql cursor over a fixed list of rows"""
+
+    description = (('id',),)
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.closed = False
+
+    def execute(self, query):
+        pass
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+    def close(self):
+        self.closed = True
+        self.rows = []  # pymysql's SSCursor reads (and drops) the rest here
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeConnection:
+    """pymysql connection that records the commands the pool sends"""
+
+    charset = 'utf8mb4'
+    collation = None
+
+    def __init__(self, rows=(), fail_on=None):
+        self.cursors = []
+        self.rows = rows
+        self.commands = []
+        self.fail_on = fail_on
+        self.open = True
+
+    def thread_id(self):
+        return 1
+
+    def cursor(self, cursor_class=None):
+        self.cursors.append(FakeCursor(self.rows))
+        return self.cursors[-1]
+
+    def _record(self, command):
+        if command == self.fail_on:
+            raise pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query')
+        self.commands.append(command)
+
+    def _execute_command(self, command, sql):
+        self._record(command)
+
+    def _read_ok_packet(self):
+        pass
+
+    def set_character_set(self, charset, collation=None):
+        self._record('SET NAMES')
+
+    def autocommit(self, value):
+        self._record('autocommit')
+
+    def select_db(self, db_name):
+        self._record('select_db')
+
+    def close(self):
+        self.open = False
+
+
+class MySQLFetchTest(SimpleTestCase):
+    """A capped unbuffered result is not drained: its connection is closed instead"""
+
+    class Pool:
+        def __init__(self, rows):
+            self.conn = mock.Mock(raw=FakeConnection(rows))
+            self.released = []
+
+        def acquire(self, db_name):
+            return self.conn
+
+        def release(self, conn, discard=False):
+            self.released.append(discard)
+
+    def fetch(self, rows, max_rows):
+        pool = self.Pool(rows)
+        with mock.patch.object(MySQLPoolBackend, 'pool', pool):
+            result = MySQLPoolBackend({'NAME': 'practice'}, read_timeout=5).execute('SELECT id FROM t', max_rows, 5)
+        return result, pool
+
+    def test_capped_result_discards_connection(self):
+        result, pool = self.fetch([(i,) for i in range(1000)], max_rows=10)
+        self.assertEqual(result.row_count, 10)
+        self.assertEqual(pool.released, [True])
+        cursor = pool.conn.raw.cursors[0]
+        self.assertFalse(cursor.closed)
+        self.assertEqual(len(cursor.rows), 989)  # one probe row read, the rest never
+
+    def test_complete_result_returns_connection(self):
+        result, pool = self.fetch([(i,) for i in range(5)], max_rows=10)
+        self.assertEqual(result.row_count, 5)
+        self.assertEqual(pool.released, [False])
+        self.assertTrue(pool.conn.raw.cursors[0].closed)
+
+    def test_result_exactly_at_cap_returns_connection(self):
+        result, pool = self.fetch([(i,) for i in range(10)], max_rows=10)
+        self.assertEqual(result.row_count, 10)
+        self.assertEqual(pool.released, [False])
+
+
+class AsyncFetchTest(SimpleTestCase):
+    """The aiomysql path doesn't drain a capped result either"""
+
+    class Cursor:
+        description = (('id',),)
+
+        def __init__(self, rows):
+            self.rows = list(rows)
+            self._result = mock.Mock(unbuffered_active=False)
+            self.closed = False
+
+        async def execute(self, query):
+            self._result.unbuffered_active = True
+
+        async def fetchmany(self, size):
+            chunk, self.rows = self.rows[:size], self.rows[size:]
+            if not chunk:
+                self._result.unbuffered_active = False
+            return chunk
+
+        async def close(self):
+            self.closed = True
+            self.rows = []
+
+    class Connection:
+        charset = 'utf8mb4'
+        init_command = None
+
+        def __init__(self, rows):
+            self._chatsql_schema = 'practice'
+            self.cursors = []
+            self.rows = rows
+            self.commands = []
+            self.closed = False
+
+        def thread_id(self):
+            return 1
+
+        async def cursor(self, cursor_class=None):
+            self.cursors.append(AsyncFetchTest.Cursor(self.rows))
+            return self.cursors[-1]
+
+        async def _execute_command(self, command, sql):
+            self.commands.append(command)
+
+        async def _read_ok_packet(self):
+            pass
+
+        async def set_charset(self, charset):
+            self.commands.append('SET NAMES')
+
+        async def autocommit(self, value):
+            self.commands.append('autocommit')
+
+        async def select_db(self, db_name):
+            self.commands.append('select_db')
+
+        def close(self):
+            self.closed = True
+
+    def fetch(self, rows, max_rows):
+        conn = self.Connection(rows)
+        pool = mock.Mock()
+        pool.acquire = mock.AsyncMock(return_value=conn)
+        executor = mock.Mock(engine='mysql', db_config={'NAME': 'practice'}, result_cacheable=False,
+                             MAX_EXECUTION_TIME=5, MAX_ROWS=max_rows)
+        executor.validate_query.return_value = (True, None)
+        with mock.patch.object(async_executor, '_get_pool', mock.AsyncMock(return_value=pool)), \
+                mock.patch.object(async_executor, '_cost_check', mock.AsyncMock(return_value=None)):
+            result = async_to_sync(async_executor.execute_async)(executor, 'SELECT id FROM t')
+        pool.release.assert_called_once_with(conn)
+        return result, conn
+
+    def test_capped_result_closes_connection(self):
+        result, conn = self.fetch([(i,) for i in range(1000)], max_rows=10)
+        self.assertEqual(result.row_count, 10)
+        self.assertTrue(conn.closed)
+        self.assertFalse(conn.cursors[0].closed)
+        self.assertEqual(len(conn.cursors[0].rows), 989)  # one probe row read, the rest never
+
+    def test_complete_result_returns_connection(self):
+        result, conn = self.fetch([(i,) for i in range(5)], max_rows=10)
+        self.assertEqual(result.row_count, 5)
+        self.assertFalse(conn.closed)
+        self.assertTrue(conn.cursors[0].closed)
+
+    def test_result_exactly_at_cap_returns_connection(self):
+        result, conn = self.fetch([(i,) for i in range(10)], max_rows=10)
+        self.assertEqual(result.row_count, 10)
+        self.assertFalse(conn.closed)
+
+    def run_statement(self, conn, statement, timeout=5):
+        pool = mock.Mock()
+        pool.acquire = mock.AsyncMock(return_value=conn)
+        with mock.patch.object(async_executor, '_get_pool', mock.AsyncMock(return_value=pool)):
+            return async_to_sync(async_executor._run)({'NAME': 'practice_b'}, [statement], timeout)
+
+    def test_reuse_resets_session(self):
+        async def statement(cursor):
+            return 'ok'
+
+        conn = self.Connection([])
+        self.run_statement(conn, statement)
+        self.assertEqual(conn.commands, ['select_db'])  # new connection: nothing to reset
+        self.assertEqual(self.run_statement(conn, statement), 'ok')
+        self.assertEqual(conn.commands, ['select_db', COM_RESET_CONNECTION, 'SET NAMES', 'autocommit'])
+
+    def test_client_timeout_kills_the_statement(self):
+        async def statement(cursor):
+            await asyncio.sleep(1)
+
+        conn = self.Connection([])
+        with mock.patch.object(async_executor, 'CLIENT_GRACE', 0), \
+                mock.patch.object(async_executor.watchdog, 'kill_now') as kill_now:
+            with self.assertRaises(asyncio.TimeoutError):
+                self.run_statement(conn, statement, timeout=0.01)
+        kill_now.assert_called_once()
+        self.assertTrue(conn.closed)
+
+
+class ConnectionPoolTest(SimpleTestCase):
+
+    def pool(self, *connections, max_size=2):
+        pool = ConnectionPool('localhost', 3306, 'user', 'password', max_size=max_size)
+        connections = list(connections)
+
+        def connect(db_name):
+            if not connections:
+                raise pymysql.err.OperationalError(2003, "Can't connect to MySQL server")
+            return PooledConnection(connections.pop(0), db_name)
+
+        pool._connect = connect
+        return pool
+
+    def test_reuse_resets_session(self):
+        raw = FakeConnection()
+        pool = self.pool(raw)
+        conn = pool.acquire('practice_a')
+        pool.release(conn)
+        self.assertIs(pool.acquire('practice_b'), conn)
+        self.assertEqual(raw.commands, [COM_RESET_CONNECTION, 'SET NAMES', 'autocommit', 'select_db'])
+        self.assertEqual(conn.schema, 'practice_b')
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_broken_connection_is_replaced(self):
+        broken, fresh = FakeConnection(fail_on=COM_RESET_CONNECTION), FakeConnection()
+        pool = self.pool(broken, fresh)
+        pool.release(pool.acquire('practice_a'))
+        self.assertIs(pool.acquire('practice_a').raw, fresh)
+        self.assertFalse(broken.open)
+        self.assertEqual(pool.stats()['size'], 1)
+
+    def test_failed_checkout_frees_its_slot(self):
+        raw = FakeConnection(fail_on='select_db')
+        pool = self.pool(raw)
+        pool.release(pool.acquire('practice_a'))
+        with self.assertRaises(pymysql.err.OperationalError):
+            pool.acquire('practice_b')  # select_db fails, then so does the reconnect
+        self.assertFalse(raw.open)
+        self.assertEqual(pool.stats()['size'], 0)
+
+    def test_full_pool_times_out(self):
+        pool = self.pool(FakeConnection(), max_size=1)
+        conn = pool.acquire()
+        with self.assertRaises(PoolTimeoutError):
+            pool.acquire(timeout=0.01)
+        pool.release(conn)
+        self.assertIs(pool.acquire(timeout=0.01), conn)
+
+    def test_read_timeout_is_per_checkout(self):
+        raw = FakeConnection()
+        pool = self.pool(raw)
+        pool.read_timeout = 8
+        conn = pool.acquire('practice_a', read_timeout=35)
+        self.assertEqual(raw._read_timeout, 35)
+        pool.release(conn)
+        self.assertEqual(raw._read_timeout, 8)
+
+
+class ExpectedResultCacheTest(ProblemCatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_database('practice_cache', 'INSERT INTO t VALUES (1, 10), (2, 20);')
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO problems (id, title, database_name, expected_query) VALUES (%s, %s, %s, %s)',
+                           [9002, 'Cached', 'practice_cache', 'SELECT id, v FROM t'])
+        self.addCleanup(invalidate_problem, 9002)
+
+    def test_fingerprint_ignores_row_and_column_order(self):
+        self.assertEqual(fingerprint_rows(['a', 'b'], [(1, 'x'), (2, 'y')]),
+                         fingerprint_rows(['b', 'a'], [('y', 2), ('x', 1)]))
+        # Multisets: duplicates count, and NULL isn't the string 'None'
+        self.assertNotEqual(fingerprint_rows(['a'], [(1,), (1,)]), fingerprint_rows(['a'], [(1,)]))
+        self.assertNotEqual(fingerprint_rows(['a'], [(None,)]), fingerprint_rows(['a'], [('None',)]))
+
+    def test_expected_query_runs_once(self):
+        executor = SQLExecutor('practice_cache')
+        with mock.patch.object(executor.backend, 'execute', wraps=executor.backend.execute) as execute:
+            first = get_expected_result(problem_catalog.get(9002), executor)
+            second = get_expected_result(problem_catalog.get(9002), executor)
+            self.assertEqual(execute.call_count, 1)
+            # A changed problem is recomputed
+            invalidate_problem(9002)
+            third = get_expected_result(problem_catalog.get(9002), executor)
+        self.assertEqual(execute.call_count, 2)
+        self.assertEqual(first['row_count'], 2)
+        self.assertEqual(second['fingerprint'], first['fingerprint'])
+        self.assertEqual(third['fingerprint'], first['fingerprint'])
+
+
+class DataVersionTest(TestCase):
+
+    def test_reseed_in_another_process_is_seen(self):
+        versions = DataVersions(ttl=0)
+        changed = []
+        versions.subscribe(changed.append)
+        self.assertEqual(versions.get('practice_dv'), 0)
+        versions.bump('practice_dv')
+        self.assertEqual(versions.get('practice_dv'), 1)
+        # apply_seed in another process only updates the shared row
+        DataVersion.objects.filter(db_name='practice_dv').update(version=5)
+        self.assertEqual(versions.get('practice_dv'), 5)
+        self.assertEqual(changed, ['practice_dv', 'practice_dv'])
+
+    def test_versions_are_reread_after_ttl(self):
+        versions = DataVersions(ttl=60)
+        versions.get('practice_dv')
+        DataVersion.objects.create(db_name='practice_dv', version=3)
+        self.assertEqual(versions.get('practice_dv'), 0)
+        self.assertEqual(versions.loads, 1)
+
+
+@override_settings(SQL_GRADING_VARIANTS=False)
+class ConcurrentGradingTest(ProblemCatalogTestCase):
+    """grade_submission runs both sides at once and stops early when either fails"""
+
+    def setUp(self):
+        super().setUp()
+        add_database('practice_grading', 'INSERT INTO t VALUES (1, 10), (2, 20), (3, 30);')
+        self.executor = SQLExecutor('practice_grading')
+        self.addCleanup(invalidate_problem, 9003)
+
+    def grade(self, query, expected_query='SELECT id, v FROM t WHERE v > 10'):
+        problem = {'id': 9003, 'database_name': 'practice_grading', 'expected_query': expected_query}
+        return grade_submission(self.executor, problem, query)
+
+    def test_verdicts(self):
+        with override_settings(SQL_CANONICAL_GRADING=False):
+            user_result, comparison = self.grade('SELECT v, id FROM t WHERE id >= 2 ORDER BY v DESC')
+        self.assertTrue(user_result['success'])
+        self.assertTrue(comparison['correct'])
+
+        user_result, comparison = self.grade('SELECT id, v FROM t WHERE v < 30')
+        self.assertEqual(user_result['row_count'], 2)
+        self.assertFalse(comparison['correct'])
+        self.assertIsNotNone(comparison['diff'])
+
+    def test_user_query_fails(self):
+        user_result, comparison = self.grade('SELECT missing FROM t')
+        self.assertFalse(user_result['success'])
+        self.assertEqual(comparison['message'], 'Query execution failed')
+
+    def test_expected_query_fails(self):
+        with self.assertLogs('exercises.services.grading', 'ERROR'):
+            user_result, comparison = self.grade('SELECT id FROM t', expected_query='SELECT missing FROM t')
+        self.assertFalse(comparison['correct'])
+        self.assertIn('Could not compute the expected result', user_result['error'])
+
+    def test_connection_error_is_an_error_verdict(self):
+        user_cancel = []
+        user_started = threading.Event()
+
+        def slow_execute(query, cancellation=None, **kwargs):
+            user_cancel.append(cancellation)
+            user_started.set()
+            time.sleep(0.2)
+            return execute(query, **kwargs)
+
+        def expected_side(*args):
+            user_started.wait(1)
+            raise PoolTimeoutError(2003, 'Timed out waiting for a database connection')
+
+        execute = self.executor.execute
+        with mock.patch.object(self.executor, 'execute', side_effect=slow_execute), \
+                mock.patch.object(grading, '_run_expected_side', side_effect=expected_side), \
+                self.assertLogs('exercises.services.grading', 'ERROR'):
+            user_result, comparison = self.grade('SELECT id FROM t')
+        self.assertFalse(user_result['success'])
+        self.assertEqual(comparison['message'], 'Query execution failed')
+        # The user side was cancelled, not left running
+        self.assertTrue(user_cancel[0].cancelled)
+
+    def test_default_checksum_and_explain(self):
+        # Backends without server-side checksums / plans (here embedded SQLite) still answer
+        backend = self.executor.backend
+        first = backend.checksum('SELECT id, v FROM t', 5)
+        self.assertEqual(first['row_count'], 3)
+        self.assertEqual(first['checksum'], backend.checksum('SELECT v, id FROM t ORDER BY v DESC', 5)['checksum'])
+        self.assertNotEqual(first['checksum'], backend.checksum('SELECT id, v FROM t WHERE id > 1', 5)['checksum'])
+        self.assertFalse(backend.checksum('SELECT missing FROM t', 5)['success'])
+        self.assertIsNone(backend.explain('SELECT id FROM t', 5))
+
+    def test_checksum_runs_beside_the_user_query(self):
+        execute = self.executor.execute
+
+        def slow_execute(query, **kwargs):
+            time.sleep(0.3)
+            return execute(query, **kwargs)
+
+        checksum = {'success': True, 'columns': ['id', 'v'], 'row_count': 2, 'checksum': 'c'}
+
+        def slow_checksum(query, **kwargs):
+            time.sleep(0.3)
+            return dict(checksum)
+
+        self.executor.MAX_EXECUTION_TIME = 0.5  # enough for either, not for both in a row
+        with mock.patch.object(self.executor.backend, 'supports_checksum', True), \
+                mock.patch.object(self.executor, 'execute', side_effect=slow_execute), \
+                mock.patch.object(self.executor, 'checksum', side_effect=slow_checksum), \
+                mock.patch.object(grading, '_run_expected_side', return_value=dict(checksum)), \
+                override_settings(SQL_CANONICAL_GRADING=False):
+            user_result, comparison = self.grade('SELECT id, v FROM t WHERE v > 10')
+        self.assertTrue(user_result['success'], user_result.get('error'))
+        self.assertTrue(comparison['correct'])
+
+
+class QueryValidationTest(TestCase):
+
+    def setUp(self):
+        self.executor = SQLExecutor('practice_validation')
+
+    def assertValid(self, query):
+        self.assertEqual(self.executor.validate_query(query), (True, ''))
+
+    def assertRejected(self, query, message):
+        is_valid, error = self.executor.validate_query(query)
+        self.assertFalse(is_valid)
+        self.assertIn(message, error)
+
+    def test_verdicts(self):
+        # Keywords only count as whole words outside strings and quoted identifiers
+        self.assertValid("SELECT 'drop table t' AS s, `delete`, created_at, updated_by FROM t;")
+        self.assertRejected('DROP TABLE t', 'Only SELECT')
+        self.assertRejected('SELECT 1; DELETE FROM t', 'Multiple statements')
+        self.assertRejected('SELECT id FROM t -- note', 'Comments')
+        self.assertRejected('SELECT id FROM t /* note */', 'Comments')
+        self.assertRejected("SELECT 'open FROM t", 'Unterminated')
+        self.assertRejected('SELECT id FROM t WHERE 1 = 1 UNION SELECT 1 INTO OUTFILE x; update t', 'Multiple statements')
+        self.assertRejected('select id from t where exists (select 1) and 1 = (Truncate(1.5, 0))', "'TRUNCATE'")
+
+    def test_verdicts_are_memoized(self):
+        query = 'SELECT id FROM t WHERE v = 42 -- memo'
+        with mock.patch('exercises.services.executor.tokenize', wraps=tokenize) as lexer:
+            first = self.executor.validate_query(query)
+            second = SQLExecutor('practice_validation').validate_query(query)
+        self.assertEqual(first, second)
+        self.assertEqual(lexer.call_count, 1)
+
+
+class StreamingExecuteTest(ProblemCatalogTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.add_problems(1)
+        add_database('chatsql_problem_1', 'INSERT INTO t VALUES (1, 10), (2, 20), (3, 30);')
+
+    def stream(self, query):
+        response = self.client.post('/api/exercises/1/execute/?stream=1', {'query': query},
+                                    content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        response.close()
+        return lines
+
+    def test_ndjson_events(self):
+        with mock.patch.object(SQLExecutor, 'STREAM_CHUNK_ROWS', 2):
+            events = self.stream('SELECT id, v FROM t ORDER BY id')
+        self.assertEqual([event['type'] for event in events], ['header', 'rows', 'rows', 'stats'])
+        self.assertEqual(events[0]['columns'], ['id', 'v'])
+        self.assertEqual(events[1]['rows'] + events[2]['rows'], [[1, 10], [2, 20], [3, 30]])
+        self.assertEqual(events[3]['row_count'], 3)
+        self.assertFalse(events[3]['truncated'])
+        # The admission slot is released once the stream is closed
+        self.assertEqual(views.admission.stats()['in_flight'], 0)
+
+    def test_row_cap_and_errors(self):
+        with mock.patch.object(SQLExecutor, 'STREAM_MAX_ROWS', 2):
+            events = self.stream('SELECT id FROM t')
+        self.assertEqual(events[-1]['row_count'], 2)
+        self.assertTrue(events[-1]['truncated'])
+
+        events = self.stream('DELETE FROM t')
+        self.assertEqual([event['type'] for event in events], ['error'])
+
+
+class CostGuardTest(TestCase):
+
+    @staticmethod
+    def plan(condition=None):
+        second = {'table_name': 'b', 'access_type': 'ALL', 'rows_examined_per_scan': 1000,
+                  'rows_produced_per_join': 1000000}
+        if condition:
+            second['attached_condition'] = condition
+        return json.dumps({'query_block': {'nested_loop': [
+            {'table': {'table_name': 'a', 'access_type': 'ALL', 'rows_examined_per_scan': 1000,
+                       'rows_produced_per_join': 1000}},
+            {'table': second},
+        ]}})
+
+    def test_estimate(self):
+        # b is scanned once per row of a, with nothing linking them
+        estimate = estimate_from_plan(self.plan())
+        self.assertEqual(estimate.rows, 1000 + 1000 * 1000)
+        self.assertEqual(estimate.unjoined_tables, ('b',))
+        self.assertEqual(estimate_from_plan(self.plan('(b.a_id = a.id)')).unjoined_tables, ())
+        self.assertIsNone(estimate_from_plan('not json').rows)
+
+    def test_reject_and_warn(self):
+        estimate = estimate_from_plan(self.plan())
+        verdict = CostGuard('reject', max_rows=100000).judge(estimate)
+        self.assertTrue(verdict.rejected)
+        self.assertIn('Table(s) b are joined without any condition', verdict.message)
+        self.assertFalse(CostGuard('warn', max_rows=100000).judge(estimate).rejected)
+        self.assertIsNone(CostGuard('reject', max_rows=10 ** 7).judge(estimate))
+
+    def test_estimates_are_cached(self):
+        backend = mock.Mock(supports_explain=True)
+        backend.explain.return_value = self.plan()
+        guard = CostGuard('reject', max_rows=100000)
+        for query in ('SELECT * FROM a, b', 'select *  from a, b'):
+            self.assertTrue(guard.check(backend, 'practice_cost', query, 5).rejected)
+        self.assertEqual(backend.explain.call_count, 1)
+        self.assertIsNone(CostGuard('off').check(backend, 'practice_cost', 'SELECT * FROM a, b', 5))
+
+    def test_explain_is_time_limited(self):
+        connection = mock.MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = ('{}',)
+        pool = mock.MagicMock()
+        pool.connection.return_value.__enter__.return_value = connection
+        with mock.patch.object(MySQLPoolBackend, 'pool', pool), \
+                mock.patch('exercises.services.backends.watchdog') as watchdog:
+            plan = MySQLPoolBackend({'NAME': 'practice'}, read_timeout=5).explain('SELECT id FROM t', 2)
+        self.assertEqual(plan, '{}')
+        watchdog.watch.assert_called_once_with(connection, pool, 2)
+        self.assertIn('MAX_EXECUTION_TIME(2000)', cursor.execute.call_args[0][0])
+
+
+class ProblemCatalogTest(ProblemCatalogTestCase):
+
+    def test_served_from_memory(self):
+        self.add_problems(2)
+        catalog = ProblemCatalog(ttl=300, probe_interval=300)
+        self.assertEqual(catalog.get(2)['difficulty'], 'easy')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(catalog.get('1')['title'], 'Problem 1')
+            self.assertIsNone(catalog.get(99))
+            self.assertIsNone(catalog.get('x'))
+        self.assertEqual(len(queries), 0)
+        with self.assertRaises(TypeError):
+            catalog.get(1)['title'] = 'changed'  # records are shared and read-only
+
+    def test_new_problems_are_picked_up(self):
+        self.add_problems(1)
+        catalog = ProblemCatalog(ttl=300, probe_interval=300)
+        catalog.all()
+        self.add_problems(1)  # e.g. by another process
+        self.assertIsNone(catalog.get(2))  # until the next probe
+        catalog.invalidate()
+        self.assertIsNotNone(catalog.get(2))
+
+        probing = ProblemCatalog(ttl=300, probe_interval=0)
+        self.assertEqual(len(probing.all()), 2)
+        self.add_problems(1)
+        self.assertEqual(len(probing.all()), 3)
+        self.assertEqual(probing.stats()['loads'], 2)
+
+    def test_replace(self):
+        self.add_problems(1)
+        catalog = ProblemCatalog()
+        snapshot = catalog.snapshot()
+        catalog.replace(1, expected_result='{}')
+        self.assertEqual(catalog.peek(1)['expected_result'], '{}')
+        self.assertIsNot(catalog.snapshot(), snapshot)
+        self.assertIsNone(snapshot.by_id[1]['expected_result'])
+
+
+class ResultCaptureTest(SimpleTestCase):
+
+    def capture(self, rows, **budget):
+        capture = ResultCapture(max_rows=100, **budget)
+        capture.start(['id', 'body'])
+        capture.fetch_from(FakeCursor(rows), chunk_rows=3)
+        return capture.result(0)
+
+    def test_byte_budget(self):
+        rows = [(i, 'x' * 100) for i in range(10)]
+        full = self.capture(rows)
+        capped = self.capture(rows, max_bytes=500)
+        self.assertFalse(full.truncated)
+        self.assertTrue(capped.truncated)
+        self.assertEqual(len(capped.rows), 4)  # 108 bytes per row
+        # Counted and fingerprinted in full: grading doesn't depend on what was kept
+        self.assertEqual(capped.row_count, 10)
+        self.assertEqual(capped.fingerprint, full.fingerprint)
+
+    def test_cells_are_clipped(self):
+        result = self.capture([(1, 'é' * 100)], max_cell_bytes=10)
+        self.assertTrue(result.truncated)
+        self.assertTrue(result.rows[0][1].startswith('ééééé… [truncated, 200 bytes]'))
+        self.assertEqual(result.fingerprint, self.capture([(1, 'é' * 100)]).fingerprint)
@@ -6,11 +6,37 @@ from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
 from django.db import models as dj_models
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
+from rest_framework.utils.encoders import JSONEncoder
 from .models import DatabaseSchema, Exercise, UserProgress, Submission, Problem
+from .services.admission import AdmissionRejected, admission, request_user_key
+from .services.backends import backend_stats
+from .services.catalog import load_problem_tables, problem_catalog
 from .services.executor import SQLExecutor
+from .services.cost_guard import cost_guard
+from .services.async_executor import execute_async
+from .services.grading import grade_submission, grade_submission_async, grading_connections
+from .services.list_snapshots import FIELDS, ListKey, list_snapshots
+from .services.pool import pool_stats
+from .services.result_cache import result_cache
+from .services.sql_normalize import fingerprint as query_fingerprint
+from .services.sqlite_engine import embedded_engine
+import re
+import threading
+import time
+from functools import lru_cache
 import uuid
 import json
-from django.db import connection
+from urllib.parse import urlencode
+from chatsql.routers import system_connection, system_cursor
+
+_accepts_gzip = re.compile(r'\bgzip\b')
 
 
 def check_instructor(user):
@@ -22,71 +48,27 @@ def check_instructor(user):
 
 def get_problem_from_gcp(problem_id=None):
     """
-    从GCP的problems表读取数据
+    从GCP的problems表读取数据（经由内存中的题目目录，services/catalog.py）
     如果problem_id为None，返回所有problems
+    返回的记录是只读的；需要修改时先 dict(problem)
     """
-    with connection.cursor() as cursor:
-        cursor.execute('USE chatsql_system')
-        
-        if problem_id:
-            cursor.execute(
-                'SELECT id, title, difficulty, tag, description, database_name, expected_query, expected_result, created_at '
-                'FROM problems WHERE id = %s',
-                [problem_id]
-            )
-            row = cursor.fetchone()
-            if not row:
-                return None
-            return {
-                'id': row[0],
-                'title': row[1],
-                'difficulty': row[2].lower() if row[2] else 'easy',  # Convert Easy -> easy
-                'tag': row[3] or '',
-                'description': row[4] or '',
-                'database_name': row[5] or '',
-                'expected_query': row[6] or '',
-                'expected_result': row[7],
-                'created_at': row[8]
-            }
-        else:
-            cursor.execute(
-                'SELECT id, title, difficulty, tag, description, database_name, expected_query, expected_result, created_at '
-                'FROM problems ORDER BY id'
-            )
-            problems = []
-            for row in cursor.fetchall():
-                problems.append({
-                    'id': row[0],
-                    'title': row[1],
-                    'difficulty': row[2].lower() if row[2] else 'easy',
-                    'tag': row[3] or '',
-                    'description': row[4] or '',
-                    'database_name': row[5] or '',
-                    'expected_query': row[6] or '',
-                    'expected_result': row[7],
-                    'created_at': row[8]
-                })
-            return problems
+    if problem_id:
+        return problem_catalog.get(problem_id)
+    return list(problem_catalog.all())
 
 
 def get_problem_tables(problem_id):
-    """从problem_tables表获取表定义信息"""
+    """从problem_tables表获取表定义信息（多个题目请用 load_problem_tables 一次查询）"""
+    return load_problem_tables([problem_id])[int(problem_id)]
+
+
+@lru_cache(maxsize=None)
+def _submissions_have_fingerprint():
+    """chatsql_system.submissions has the query_fingerprint column (checked once per process)"""
+    connection = system_connection()
     with connection.cursor() as cursor:
-        cursor.execute('USE chatsql_system')
-        cursor.execute(
-            'SELECT table_name, table_schema, sample_data, display_order '
-            'FROM problem_tables WHERE problem_id = %s ORDER BY display_order',
-            [problem_id]
-        )
-        tables = []
-        for row in cursor.fetchall():
-            tables.append({
-                'table_name': row[0],
-                'table_schema': row[1],
-                'sample_data': row[2],
-                'display_order': row[3]
-            })
-        return tables
+        columns = connection.introspection.get_table_description(cursor, 'submissions')
+    return any(column.name == 'query_fingerprint' for column in columns)
 
 
 def save_submission_to_gcp(user_id, exercise_id, query, status, execution_time):
@@ -130,10 +112,7 @@ def save_submission_to_gcp(user_id, exercise_id, query, status, execution_time):
         return
     
     try:
-        with connection.cursor() as cursor:
-            # 切换到chatsql_system数据库
-            cursor.execute('USE chatsql_system')
-            
+        with system_cursor() as cursor:
             # 验证exercise_id是否存在于problems表中
             cursor.execute('SELECT id FROM problems WHERE id = %s', [exercise_id])
             problem_exists = cursor.fetchone()
@@ -143,15 +122,22 @@ def save_submission_to_gcp(user_id, exercise_id, query, status, execution_time):
             
             # 插入数据到submissions表
             # exercise_id是外键，指向problems表的id字段
+            # query_fingerprint: 规范化SQL的64位指纹（去重、错误答案分组）；
+            # 还没迁移（migration 0004）的chatsql_system没有这一列
+            columns = ['query', 'status', 'execution_time', 'exercise_id', 'user_id']
+            values = [query, status, execution_time, exercise_id, user_id]
+            if _submissions_have_fingerprint():
+                columns.append('query_fingerprint')
+                values.append(query_fingerprint(query))
             cursor.execute(
-                '''INSERT INTO submissions 
-                   (query, status, execution_time, exercise_id, user_id, created_at, updated_at)
-                   VALUES (%s, %s, %s, %s, %s, NOW(6), NOW(6))''',
-                [query, status, execution_time, exercise_id, user_id]
+                f'''INSERT INTO submissions 
+                   ({', '.join(columns)}, created_at, updated_at)
+                   VALUES ({', '.join(['%s'] * len(values))}, NOW(6), NOW(6))''',
+                values
             )
             
             # 显式提交事务
-            connection.commit()
+            system_connection().commit()
             
             # 验证数据是否真的保存了
             cursor.execute('SELECT COUNT(*) FROM submissions WHERE user_id = %s AND exercise_id = %s', [user_id, exercise_id])
@@ -166,11 +152,166 @@ def save_submission_to_gcp(user_id, exercise_id, query, status, execution_time):
             
     except Exception as e:
         # 回滚事务
-        connection.rollback()
+        system_connection().rollback()
         logger.error(f"Failed to save submission to GCP: user_id={user_id}, exercise_id={exercise_id}, error={str(e)}", exc_info=True)
         raise
 
 
+def record_submission(request, exercise_id, query, user_result, comparison):
+    """保存提交记录（失败只记录日志，不影响请求）"""
+    import logging
+    logger = logging.getLogger(__name__)
+    
+    # 从session获取user_id（因为使用的是CustomUser，不是Django的User）
+    # 认证系统将user_id存储在request.session['user_id']中
+    user_id = request.session.get('user_id')
+    
+    # 详细记录用户认证状态
+    logger.info(f"=== Submission Save Debug ===")
+    logger.info(f"Session user_id: {user_id}")
+    logger.info(f"Session keys: {list(request.session.keys())}")
+    logger.info(f"Django user authenticated: {request.user.is_authenticated}")
+    logger.info(f"Django user: {request.user}")
+    
+    try:
+        submission_status = 'correct' if comparison['correct'] else 'incorrect'
+        exec_time = user_result.get('execution_time')
+        
+        logger.info(f"Attempting to save submission:")
+        logger.info(f"  user_id={user_id} (from session)")
+        logger.info(f"  exercise_id={exercise_id}")
+        logger.info(f"  status={submission_status}")
+        logger.info(f"  execution_time={exec_time}")
+        logger.info(f"  query length={len(query)}")
+        
+        if user_id is None:
+            logger.warning("⚠️  WARNING: user_id is None - submission will NOT be saved!")
+            logger.warning("   This means the user is not logged in (no session['user_id']).")
+            logger.warning("   User needs to login first to save submissions.")
+        
+        save_submission_to_gcp(
+            user_id=user_id,
+            exercise_id=exercise_id,
+            query=query,
+            status=submission_status,
+            execution_time=exec_time
+        )
+        
+        logger.info(f"=== Submission Save Completed ===")
+    except Exception as e:
+        # Log error but don't fail the request
+        logger.error(f"❌ Failed to save submission to GCP: {e}", exc_info=True)
+        logger.error(f"   user_id={user_id if 'user_id' in locals() else 'unknown'}")
+        logger.error(f"   exercise_id={exercise_id if 'exercise_id' in locals() else 'unknown'}")
+
+
+class _ClosingIterator:
+    """Iterator that calls on_close exactly once when the response is closed"""
+
+    def __init__(self, iterable, on_close):
+        self._iterator = iter(iterable)
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def close(self):
+        try:
+            close = getattr(self._iterator, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            if self._on_close is not None:
+                on_close, self._on_close = self._on_close, None
+                on_close()
+
+
+class _AsyncClosingIterator:
+    """
+    _ClosingIterator for async views: each item is pulled from the sync iterator
+    in a worker thread. Given a sync iterator, Django under ASGI would read it
+    to the end with sync_to_async(list) before sending anything.
+    """
+
+    _done = object()
+
+    def __init__(self, iterable, on_close):
+        self._iterator = _ClosingIterator(iterable, on_close)
+        # A disconnect can close the response while a worker is still in next()
+        self._lock = threading.Lock()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await sync_to_async(self._next, thread_sensitive=False)()
+        if item is self._done:
+            raise StopAsyncIteration
+        return item
+
+    def _next(self):
+        with self._lock:
+            return next(self._iterator, self._done)
+
+    def close(self):
+        with self._lock:
+            self._iterator.close()
+
+
+def admission_rejected_response(e, response_class=Response):
+    """429 for a request that admission control turned away"""
+    response = response_class(
+        {'error': str(e), 'reason': e.reason, 'retry_after': e.retry_after_header},
+        status=status.HTTP_429_TOO_MANY_REQUESTS
+    )
+    response['Retry-After'] = e.retry_after_header
+    return response
+
+
+def stream_query_response(executor, query, on_close=None, asynchronous=False):
+    """
+    以NDJSON流式返回查询结果（每行一个JSON对象）:
+        {"type": "header", "columns": [...]}
+        {"type": "rows", "rows": [[...], ...]}     (repeated)
+        {"type": "stats", "row_count": n, "execution_time": t, "truncated": false}
+    or {"type": "error", "error": "...", "error_type": "..."} instead of stats;
+    a {"type": "warning", "warning": "..."} line may precede the header (cost guard).
+    on_close(seconds) is called once the response is closed, with the seconds the
+    query held its database connection (e.g. to release an admission slot).
+    asynchronous: the response is served by an async view (ASGI).
+    """
+    started = time.monotonic()
+    held = []  # set once the stream is done with the connection
+
+    def lines():
+        for kind, payload in executor.stream(query):
+            if kind == 'stats':
+                held.append(payload['execution_time'])
+            elif kind == 'error':
+                held.append(time.monotonic() - started)
+            if kind == 'header':
+                event = {'type': 'header', 'columns': payload}
+            elif kind == 'rows':
+                event = {'type': 'rows', 'rows': payload}
+            else:
+                event = {'type': kind, **payload}
+            yield json.dumps(event, cls=JSONEncoder) + '\n'
+
+    def close():
+        if on_close is not None:
+            # A client still downloading (or gone mid-stream) isn't charged past that
+            on_close(held[0] if held else time.monotonic() - started)
+
+    iterator_class = _AsyncClosingIterator if asynchronous else _ClosingIterator
+    response = StreamingHttpResponse(iterator_class(lines(), close), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
+
 class SchemaListView(APIView):
     """GET /api/schemas/ - List all database schemas"""
     
@@ -187,55 +328,112 @@ class SchemaListView(APIView):
 
 
 class ExerciseListView(APIView):
-    """GET /api/exercises/?schema_id=1&difficulty=easy&tag=SELECT"""
-    
+    """
+    GET /api/exercises/?difficulty=easy&tag=SELECT
+    可选参数：
+    - fields=id,title,difficulty  只返回这些字段（列表页不需要description时更小）
+    - after_id=&limit=            keyset分页；带任一参数时返回
+                                  {"count": 总数, "next": 下一页URL或null, "results": [...]}
+    不带分页参数时仍返回完整列表（数组）
+
+    响应是按题目目录版本预渲染的JSON（services/list_snapshots.py），带强ETag，
+    If-None-Match命中时返回304。completed始终为false，个人完成情况见
+    GET /api/exercises/completion/
+    """
+    FIELDS = FIELDS
+    DEFAULT_LIMIT = 50
+    MAX_LIMIT = 200
+
     def get(self, request):
-        # 从GCP的problems表读取数据
-        problems = get_problem_from_gcp()
-        
-        if not problems:
-            return Response([])
-        
-        # Filter by difficulty
-        difficulty = request.query_params.get('difficulty')
-        if difficulty:
-            problems = [p for p in problems if p['difficulty'].lower() == difficulty.lower()]
-        
-        # Filter by tag (GCP中tag是单个字符串，不是数组)
-        tag = request.query_params.get('tag')
-        if tag:
-            problems = [p for p in problems if tag.lower() in (p.get('tag', '') or '').lower()]
-        
-        # 构建返回数据
-        data = []
-        for problem in problems:
-            # 从problem_tables获取schema信息
-            tables = get_problem_tables(problem['id'])
-            table_name = tables[0]['table_name'] if tables else 'Unknown'
-            
-            # 构建schema信息
-            tag_display = problem.get('tag', '').strip() if problem.get('tag') else 'Database'
-            schema = {
-                'id': problem['id'],
-                'name': problem['database_name'].replace('chatsql_problem_', 'problem_'),
-                'display_name': f"Problem {problem['id']} {tag_display}",
-                'db_name': problem['database_name']
-            }
-            
-            # 将tag字符串转换为数组
-            tags = [problem['tag']] if problem.get('tag') else []
-            
-            data.append({
-                'id': problem['id'],
-                'title': problem['title'],
-                'description': problem['description'],
-                'difficulty': problem['difficulty'],
-                'schema': schema,
-                'tags': tags,
-                'completed': False  # TODO: Check user progress
-            })
-        
-        return Response(data)
+        params = request.query_params
+        try:
+            fields = self._fields(params.get('fields'))
+            after_id = self._int_param(params, 'after_id')
+            limit = self._int_param(params, 'limit')
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        paginated = 'after_id' in params or 'limit' in params
+        if paginated:
+            limit = min(max(limit or self.DEFAULT_LIMIT, 1), self.MAX_LIMIT)
+
+        # 从内存题目目录按difficulty/tag索引过滤（tag为子串匹配；GCP中tag是单个字符串，不是数组）
+        key = ListKey(
+            difficulty=params.get('difficulty', '').lower(),
+            tag=params.get('tag', '').lower(),
+            after_id=after_id,
+            limit=limit,
+            fields=fields,
+            paginated=paginated,
+        )
+
+        def next_url(next_after_id):
+            # Relative and built from the normalized parameters, so every client shares the bytes
+            query = {'difficulty': key.difficulty, 'tag': key.tag, 'after_id': next_after_id, 'limit': limit}
+            if fields != self.FIELDS:
+                query['fields'] = ','.join(fields)
+            return f"{request.path}?{urlencode({k: v for k, v in query.items() if v})}"
+
+        rendered = list_snapshots.get(problem_catalog.snapshot(), key, next_url)
+        return self._raw_response(request, rendered)
+
+    @staticmethod
+    def _raw_response(request, rendered):
+        gzipped = bool(_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+        etag = rendered.etag(gzipped)
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(rendered.gzipped if gzipped else rendered.body,
+                                    content_type='application/json')
+            if gzipped:
+                response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        # Always revalidate; an unchanged list costs a 304 with no body
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    def _fields(self, requested):
+        if not requested:
+            return self.FIELDS
+        fields = tuple(dict.fromkeys(f.strip() for f in requested.split(',') if f.strip()))
+        unknown = [f for f in fields if f not in self.FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(self.FIELDS)}")
+        return fields
+
+    @staticmethod
+    def _int_param(params, name):
+        value = params.get(name)
+        if not value:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"{name} must be an integer")
+
+
+class ExerciseCompletionView(APIView):
+    """
+    GET /api/exercises/completion/ - 当前用户已完成（有correct提交）的题目id
+    {"completed": [1, 5, 7]}；未登录时为空列表。前端把它叠加到共享的题目列表上
+    """
+
+    def get(self, request):
+        user_id = request.session.get('user_id')
+        if not user_id:
+            return Response({'completed': []})
+        with system_cursor() as cursor:
+            cursor.execute(
+                "SELECT DISTINCT exercise_id FROM submissions WHERE user_id = %s AND status = 'correct' "
+                "ORDER BY exercise_id",
+                [user_id]
+            )
+            completed = [row[0] for row in cursor.fetchall()]
+        response = Response({'completed': completed})
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
 
 class ExerciseDetailView(APIView):
@@ -294,7 +492,7 @@ class ExerciseDetailView(APIView):
 
 
 class ExecuteQueryView(APIView):
-    """POST /api/exercises/{id}/execute/ - Execute user query"""
+    """POST /api/exercises/{id}/execute/ - Execute user query (?stream=1 for NDJSON streaming)"""
     
     def post(self, request, exercise_id):
         # 从GCP的problems表读取数据
@@ -314,38 +512,30 @@ class ExecuteQueryView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Streaming mode (?stream=1): rows are sent as NDJSON while MySQL produces them
+        stream = request.query_params.get('stream') in ('1', 'true')
+        
         # Execute query using SQLExecutor with database_name from problems table
+        # (MySQL, embedded SQLite or the default database; see services/backends.py)
         try:
             executor = SQLExecutor(problem['database_name'])
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Admission control: bounded concurrency per server / user / problem
+        try:
+            ticket = admission.acquire(request_user_key(request), exercise_id)
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
+        
+        if stream:
+            # The slot is held until the stream is closed
+            return stream_query_response(executor, query,
+                                         on_close=lambda held: admission.release(ticket, held))
+        try:
             result = executor.execute(query)
-        except ValueError:
-            # Fallback: execute against default DB (SQLite) using Django connection
-            start = timezone.now()
-            try:
-                with connection.cursor() as cursor:
-                    cursor.execute(query)
-                    rows = cursor.fetchmany(SQLExecutor.MAX_ROWS)
-                    columns = [col[0] for col in cursor.description] if cursor.description else []
-                    row_list = [list(row) for row in rows]
-                exec_time = (timezone.now() - start).total_seconds()
-                result = {
-                    'success': True,
-                    'columns': columns,
-                    'rows': row_list,
-                    'row_count': len(row_list),
-                    'execution_time': round(exec_time, 3),
-                    'error': None
-                }
-            except Exception as e:
-                exec_time = (timezone.now() - start).total_seconds()
-                result = {
-                    'success': False,
-                    'error': str(e),
-                    'columns': [],
-                    'rows': [],
-                    'row_count': 0,
-                    'execution_time': round(exec_time, 3)
-                }
+        finally:
+            admission.release(ticket)
         
         # Track attempt (get or create session)
         # Note: UserProgress tracking may need to be adapted for GCP problems table
@@ -380,103 +570,21 @@ class SubmitQueryView(APIView):
             )
         
         # Execute both user query and expected query
-        executor = None
         try:
             executor = SQLExecutor(problem['database_name'])
-            user_result = executor.execute(query)
-            expected_result = executor.execute(problem['expected_query'])
-        except ValueError:
-            # Fallback execution on default DB
-            def run_on_default(q):
-                start = timezone.now()
-                try:
-                    with connection.cursor() as cursor:
-                        cursor.execute(q)
-                        rows = cursor.fetchmany(SQLExecutor.MAX_ROWS)
-                        columns = [col[0] for col in cursor.description] if cursor.description else []
-                        row_list = [list(row) for row in rows]
-                    exec_time = (timezone.now() - start).total_seconds()
-                    return {
-                        'success': True,
-                        'columns': columns,
-                        'rows': row_list,
-                        'row_count': len(row_list),
-                        'execution_time': round(exec_time, 3),
-                        'error': None
-                    }
-                except Exception as e:
-                    exec_time = (timezone.now() - start).total_seconds()
-                    return {
-                        'success': False,
-                        'error': str(e),
-                        'columns': [],
-                        'rows': [],
-                        'row_count': 0,
-                        'execution_time': round(exec_time, 3)
-                    }
-
-            user_result = run_on_default(query)
-            expected_result = run_on_default(problem['expected_query'])
-            # Create a dummy executor for comparison in fallback case
-            executor = SQLExecutor(problem['database_name']) if problem['database_name'] else None
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Compare results
-        if executor:
-            comparison = executor.compare_results(user_result, expected_result)
-        else:
-            # Simple comparison if executor is not available
-            comparison = {
-                'correct': user_result.get('success') and expected_result.get('success') and 
-                          user_result.get('row_count') == expected_result.get('row_count'),
-                'message': 'Results compared (fallback mode)',
-                'diff': None
-            }
+        # Reference solution result is cached; only executed on a cache miss
+        try:
+            # Grading holds one pooled connection per side and per hidden variant
+            with admission.admit(request_user_key(request), exercise_id, grading_connections(executor)):
+                user_result, comparison = grade_submission(executor, problem, query)
+        except AdmissionRejected as e:
+            return admission_rejected_response(e)
         
         # Save submission to GCP chatsql_system database
-        import logging
-        logger = logging.getLogger(__name__)
-        
-        # 从session获取user_id（因为使用的是CustomUser，不是Django的User）
-        # 认证系统将user_id存储在request.session['user_id']中
-        user_id = request.session.get('user_id')
-        
-        # 详细记录用户认证状态
-        logger.info(f"=== Submission Save Debug ===")
-        logger.info(f"Session user_id: {user_id}")
-        logger.info(f"Session keys: {list(request.session.keys())}")
-        logger.info(f"Django user authenticated: {request.user.is_authenticated}")
-        logger.info(f"Django user: {request.user}")
-        
-        try:
-            submission_status = 'correct' if comparison['correct'] else 'incorrect'
-            exec_time = user_result.get('execution_time')
-            
-            logger.info(f"Attempting to save submission:")
-            logger.info(f"  user_id={user_id} (from session)")
-            logger.info(f"  exercise_id={exercise_id}")
-            logger.info(f"  status={submission_status}")
-            logger.info(f"  execution_time={exec_time}")
-            logger.info(f"  query length={len(query)}")
-            
-            if user_id is None:
-                logger.warning("⚠️  WARNING: user_id is None - submission will NOT be saved!")
-                logger.warning("   This means the user is not logged in (no session['user_id']).")
-                logger.warning("   User needs to login first to save submissions.")
-            
-            save_submission_to_gcp(
-                user_id=user_id,
-                exercise_id=exercise_id,
-                query=query,
-                status=submission_status,
-                execution_time=exec_time
-            )
-            
-            logger.info(f"=== Submission Save Completed ===")
-        except Exception as e:
-            # Log error but don't fail the request
-            logger.error(f"❌ Failed to save submission to GCP: {e}", exc_info=True)
-            logger.error(f"   user_id={user_id if 'user_id' in locals() else 'unknown'}")
-            logger.error(f"   exercise_id={exercise_id if 'exercise_id' in locals() else 'unknown'}")
+        record_submission(request, exercise_id, query, user_result, comparison)
         
         # Update progress
         # Note: UserProgress tracking may need to be adapted for GCP problems table
@@ -491,6 +599,108 @@ class SubmitQueryView(APIView):
         })
 
 
+def _json_body(request):
+    """Parsed JSON body of a plain Django (async) view; None if malformed"""
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _json_response(data, status_code=200):
+    return JsonResponse(data, status=status_code, encoder=JSONEncoder)
+
+
+async def _admit_async(request, exercise_id, cost=1):
+    """admission.acquire() for the async views (the bounded wait happens in a thread)"""
+    user_key = await sync_to_async(request_user_key)(request)
+    return await admission.acquire_async(user_key, exercise_id, cost)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncExecuteQueryView(View):
+    """
+    POST /api/exercises/{id}/execute/ - ExecuteQueryView for ASGI (settings.ASYNC_VIEWS)
+    The query runs on the async MySQL driver, so no worker thread waits on Cloud SQL.
+    """
+    
+    async def post(self, request, exercise_id):
+        problem = await sync_to_async(get_problem_from_gcp)(problem_id=exercise_id)
+        if not problem:
+            return _json_response({'error': 'Problem not found'}, status.HTTP_404_NOT_FOUND)
+        
+        data = _json_body(request)
+        if data is None:
+            return _json_response({'error': 'Invalid JSON body'}, status.HTTP_400_BAD_REQUEST)
+        query = (data.get('query') or '').strip()
+        if not query:
+            return _json_response({'error': 'Query is required'}, status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            executor = await sync_to_async(SQLExecutor)(problem['database_name'])
+        except ValueError as e:
+            return _json_response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            ticket = await _admit_async(request, exercise_id)
+        except AdmissionRejected as e:
+            return admission_rejected_response(e, JsonResponse)
+        
+        if request.GET.get('stream') in ('1', 'true'):
+            # The unbuffered cursor is sync: chunks are read in worker threads and sent as they arrive
+            return stream_query_response(executor, query, on_close=lambda held: admission.release(ticket, held),
+                                         asynchronous=True)
+        
+        try:
+            result = await execute_async(executor, query)
+        finally:
+            admission.release(ticket)
+        return _json_response(dict(result))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncSubmitQueryView(View):
+    """POST /api/exercises/{id}/submit/ - SubmitQueryView for ASGI (settings.ASYNC_VIEWS)"""
+    
+    async def post(self, request, exercise_id):
+        problem = await sync_to_async(get_problem_from_gcp)(problem_id=exercise_id)
+        if not problem:
+            return _json_response({'error': 'Problem not found'}, status.HTTP_404_NOT_FOUND)
+        
+        data = _json_body(request)
+        if data is None:
+            return _json_response({'error': 'Invalid JSON body'}, status.HTTP_400_BAD_REQUEST)
+        query = (data.get('query') or '').strip()
+        if not query:
+            return _json_response({'error': 'Query is required'}, status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            executor = await sync_to_async(SQLExecutor)(problem['database_name'])
+        except ValueError as e:
+            return _json_response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+        
+        cost = await sync_to_async(grading_connections)(executor)
+        try:
+            ticket = await _admit_async(request, exercise_id, cost)
+        except AdmissionRejected as e:
+            return admission_rejected_response(e, JsonResponse)
+        try:
+            user_result, comparison = await grade_submission_async(executor, problem, query)
+        finally:
+            admission.release(ticket)
+        
+        # Session and submissions table are sync Django APIs
+        await sync_to_async(record_submission)(request, exercise_id, query, user_result, comparison)
+        
+        return _json_response({
+            'correct': comparison['correct'],
+            'message': comparison['message'],
+            'user_result': dict(user_result),
+            'diff': comparison.get('diff')
+        })
+
+
 class SubmissionListView(APIView):
     """GET /api/exercises/{id}/submissions/ - Get user's submission history for an exercise"""
     
@@ -559,9 +769,7 @@ class SubmissionListView(APIView):
             )
         
         try:
-            with connection.cursor() as cursor:
-                cursor.execute('USE chatsql_system')
-                
+            with system_cursor() as cursor:
                 # 先检查是否有任何submissions（用于调试）
                 cursor.execute('SELECT COUNT(*) FROM submissions')
                 total_count = cursor.fetchone()[0]
@@ -709,4 +917,22 @@ def instructor_exercise_detail(request, exercise_id):
     
     elif request.method == 'DELETE':
         exercise.delete()
-        return Response({'message': 'Exercise deleted successfully'}, status=204)
\ No newline at end of file
+        return Response({'message': 'Exercise deleted successfully'}, status=204)
+
+@api_view(['GET'])
+def instructor_executor_stats(request):
+    """GET /api/instructor/executor-stats/ - 查询执行相关的监控指标（缓存命中率、连接池）"""
+    from accounts.views import check_instructor as check_instructor_accounts
+    if not check_instructor_accounts(request):
+        return Response({'error': 'Unauthorized'}, status=403)
+    
+    return Response({
+        'result_cache': result_cache.stats(),
+        'connection_pools': pool_stats(),
+        'embedded_engine': embedded_engine.stats(),
+        'backends': backend_stats(),
+        'admission': admission.stats(),
+        'cost_guard': cost_guard.stats(),
+        'problem_catalog': problem_catalog.stats(),
+        'list_snapshots': list_snapshots.stats(),
+    })